@@ -1,4 +1,5 @@
 import datetime
+import json
 
 import click
 
@@ -117,4 +118,181 @@ def rundummy(
 @cli.command()
 def rundev():
   app = create_app(config_name='dev')
-  app.run()
\ No newline at end of file
+  app.run()
+
+@cli.command('import-files')
+@click.argument('directory', type=click.Path(exists=True, file_okay=False))
+@click.option(
+  '--batch_size',
+  default=100,
+  help='Number of activities saved per database transaction.'
+)
+@click.option(
+  '--workers',
+  default=None,
+  type=int,
+  help='Number of processes parsing files. Defaults to the CPU count.'
+)
+@click.option(
+  '--config_name',
+  default='dev',
+)
+def import_files(directory, batch_size, workers, config_name):
+  """Save every .fit, .tcx and .gpx file in a directory as an activity."""
+  from application import importer
+
+  app = create_app(config_name=config_name)
+
+  with app.app_context():
+    paths = importer.find_activity_files(directory)
+    stats = importer.import_files(
+      paths,
+      batch_size=batch_size,
+      max_workers=workers,
+      echo=click.echo,
+    )
+
+  rate = len(paths) / stats['seconds'] if stats['seconds'] else 0
+  click.echo(
+    f'Imported {stats["imported"]} activities, skipped {stats["skipped"]} '
+    f'already saved, {stats["failed"]} failed. '
+    f'{len(paths)} files in {stats["seconds"]:.1f}s ({rate:.1f} files/s).'
+  )
+
+
+@cli.command('import-strava-export')
+@click.argument('zip_path', type=click.Path(exists=True, dir_okay=False))
+@click.option(
+  '--strava_acct_id',
+  default=None,
+  type=int,
+  help='Strava athlete ID of the linked account that made the export.'
+)
+@click.option(
+  '--batch_size',
+  default=100,
+  help='Number of activities saved per database transaction.'
+)
+@click.option(
+  '--workers',
+  default=None,
+  type=int,
+  help='Number of processes parsing files. Defaults to the CPU count.'
+)
+@click.option(
+  '--config_name',
+  default='dev',
+)
+def import_strava_export(zip_path, strava_acct_id, batch_size, workers, config_name):
+  """Save the activities in a Strava bulk export ZIP file."""
+  from application import importer
+
+  app = create_app(config_name=config_name)
+
+  with app.app_context():
+    stats = importer.import_strava_export(
+      zip_path,
+      strava_acct_id=strava_acct_id,
+      batch_size=batch_size,
+      max_workers=workers,
+      echo=click.echo,
+    )
+
+  click.echo(
+    f'Imported {stats["imported"]} activities, skipped {stats["skipped"]}, '
+    f'{stats["failed"]} failed, in {stats["seconds"]:.1f}s.'
+  )
+
+
+@cli.command('replay-strava-events')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option(
+  '--url',
+  default=None,
+  help='Webhook URL of a running server. Defaults to the app in this process.'
+)
+@click.option(
+  '--owner_id',
+  default=None,
+  type=int,
+  help='Strava athlete ID to send the events as, instead of the recorded one.'
+)
+@click.option(
+  '--config_name',
+  default='dummy',
+)
+def replay_strava_events(path, url, owner_id, config_name):
+  """Send recorded Strava webhook events, as Strava would.
+
+  PATH is a JSON list of events, like Strava POSTs to the webhook.
+  """
+  with open(path) as f:
+    events = json.load(f)
+
+  if url is None:
+    client = create_app(config_name=config_name).test_client()
+
+    def post(event):
+      return client.post('/strava/webhook', json=event).status_code
+  else:
+    import requests
+
+    def post(event):
+      return requests.post(url, json=event).status_code
+
+  for event in events:
+    if owner_id is not None:
+      event['owner_id'] = owner_id
+    status_code = post(event)
+    click.echo(
+      f'{event["aspect_type"]} {event["object_type"]} {event["object_id"]}: '
+      f'{status_code}'
+    )
+
+
+@cli.command()
+@click.argument('directory', type=click.Path(exists=True, file_okay=False))
+@click.option(
+  '--handle_overlap',
+  default='existing',
+  type=click.Choice(['existing', 'both', 'incoming']),
+  help='What to do when a new file overlaps saved activities.'
+)
+@click.option(
+  '--workers',
+  default=None,
+  type=int,
+  help='Number of processes parsing files. Defaults to the CPU count.'
+)
+@click.option(
+  '--settle_s',
+  default=2.0,
+  help='Seconds a file must go unchanged before it is read.'
+)
+@click.option(
+  '--poll',
+  is_flag=True,
+  help='Poll the folder for changes instead of using inotify.'
+)
+@click.option(
+  '--config_name',
+  default='dev',
+)
+def watch(directory, handle_overlap, workers, settle_s, poll, config_name):
+  """Save activity files as they show up in a folder."""
+  from application import watcher
+
+  app = create_app(config_name=config_name)
+
+  with app.app_context():
+    try:
+      watcher.watch(
+        directory,
+        handle_overlap=handle_overlap,
+        max_workers=workers,
+        settle_s=settle_s,
+        use_inotify=not poll,
+        echo=click.echo,
+      )
+    except KeyboardInterrupt:
+      click.echo('Stopped watching.')
@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 # from dotenv import load_dotenv
 
@@ -38,9 +39,92 @@ class Config:
 
   CELERY_BROKER_URL = 'redis://localhost:6379/0'
   # CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
+  # Periodic tasks, run by `celery beat`. New activities on every linked
+  # Strava account are saved once a day by default.
+  CELERYBEAT_SCHEDULE = {
+    'sync-strava-activities': {
+      'task': 'application.tasks.async_sync_all_strava_accounts',
+      'schedule': int(os.environ.get('STRAVA_SYNC_INTERVAL_S', 24 * 3600)),
+    },
+  }
 
   STRAVALIB_CLIENT = os.environ.get('STRAVALIB_CLIENT', 'stravalib.Client')
 
+  # Strava API rate limits: (requests, period in seconds). Every call
+  # takes a token from a bucket for each (see `util.ratelimit`).
+  STRAVA_RATE_LIMITS = {
+    'short': (int(os.environ.get('STRAVA_SHORT_LIMIT', 100)), 15 * 60),
+    'long': (int(os.environ.get('STRAVA_LONG_LIMIT', 1000)), 24 * 3600),
+  }
+  # Where the buckets are shared. Without Redis, they're kept in the
+  # database.
+  STRAVA_RATE_LIMIT_REDIS_URL = os.environ.get('STRAVA_RATE_LIMIT_REDIS_URL')
+  # Longest a call waits for tokens before raising RateLimitExceeded.
+  STRAVA_RATE_LIMIT_MAX_WAIT_S = 5
+  # Share of each rate limit window that Celery tasks leave for page
+  # views, so pages keep working during a big import.
+  STRAVA_RATE_LIMIT_INTERACTIVE_SHARE = float(
+    os.environ.get('STRAVA_RATE_LIMIT_INTERACTIVE_SHARE', 0.2))
+  # Tokens are refreshed this long before they expire, by whichever
+  # process gets there first while the others wait (see `util.locks`).
+  STRAVA_TOKEN_REFRESH_MARGIN_S = 5 * 60
+  # Bulk imports save what Strava's activity listing has, which is all
+  # but the description. Fetching each activity for its description
+  # costs another request per activity.
+  STRAVA_IMPORT_DESCRIPTIONS = os.environ.get('STRAVA_IMPORT_DESCRIPTIONS') == '1'
+  # Requests for activity streams that a worker makes at once.
+  STRAVA_STREAM_CONCURRENCY = int(os.environ.get('STRAVA_STREAM_CONCURRENCY', 8))
+  # Strava echoes this back when the webhook subscription is created,
+  # and sends events from this subscription (if set) only.
+  STRAVA_WEBHOOK_VERIFY_TOKEN = os.environ.get('STRAVA_WEBHOOK_VERIFY_TOKEN')
+  STRAVA_WEBHOOK_SUBSCRIPTION_ID = (
+    int(os.environ['STRAVA_WEBHOOK_SUBSCRIPTION_ID'])
+    if os.environ.get('STRAVA_WEBHOOK_SUBSCRIPTION_ID') else None
+  )
+  # Activities from webhook events are saved together this long after
+  # the first event, so a burst of edits costs one import.
+  STRAVA_WEBHOOK_DELAY_S = int(os.environ.get('STRAVA_WEBHOOK_DELAY_S', 60))
+  # The Strava import table is read from a local mirror of each
+  # account's activity listing. Opening it brings the mirror up to date
+  # in the background, at most this often.
+  STRAVA_SUMMARY_SYNC_INTERVAL_S = int(
+    os.environ.get('STRAVA_SUMMARY_SYNC_INTERVAL_S', 15 * 60))
+
+  # Where locks shared by every process are kept. Without Redis, they
+  # are Postgres advisory locks, or lock files for SQLite.
+  LOCK_REDIS_URL = os.environ.get('LOCK_REDIS_URL', STRAVA_RATE_LIMIT_REDIS_URL)
+
+  # Where the shared cache is kept (see `util.cache`). Without Redis,
+  # it's kept in the database.
+  CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', STRAVA_RATE_LIMIT_REDIS_URL)
+  # How long athlete profiles from Strava are shown before being
+  # fetched again.
+  STRAVA_ATHLETE_CACHE_TTL_S = 3600
+  # Athlete profiles fetched at once, when several aren't cached.
+  STRAVA_ATHLETE_CONCURRENCY = int(os.environ.get('STRAVA_ATHLETE_CONCURRENCY', 8))
+  # How long the response to a Strava request is kept for anyone who
+  # made the same request while it was in flight (see
+  # `util.singleflight`).
+  STRAVA_SINGLE_FLIGHT_TTL_S = 5
+
+  # Where uploaded activity files are spooled, and how long they stick
+  # around afterward.
+  UPLOAD_FOLDER = os.environ.get(
+    'UPLOAD_FOLDER',
+    os.path.join(tempfile.gettempdir(), 'distilling-flask-uploads')
+  )
+  UPLOAD_MAX_AGE_S = 24 * 3600
+  # Processes that parse uploaded files. Defaults to the number of CPUs.
+  UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', 0)) or None
+  # Parsed uploads, kept so the same file never gets parsed twice. The
+  # least recently used are removed to stay under the size limit.
+  UPLOAD_CACHE_FOLDER = os.environ.get(
+    'UPLOAD_CACHE_FOLDER',
+    os.path.join(tempfile.gettempdir(), 'distilling-flask-upload-cache')
+  )
+  UPLOAD_CACHE_MAX_BYTES = int(os.environ.get('UPLOAD_CACHE_MAX_BYTES', 500e6))
+  UPLOAD_CACHE_MAX_AGE_S = 30 * 24 * 3600
+
 
 class TestingConfig(Config):
   """
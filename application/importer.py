@@ -0,0 +1,391 @@
+"""Save activity files in bulk, without going through the Strava API.
+
+Files come from a directory or from a Strava bulk export ZIP. They are
+parsed and summarized in a pool of worker processes, and the results
+are written in batches, one transaction per batch. Each activity stores
+a hash of its file's contents, so files that are already saved are
+skipped.
+"""
+import collections
+import csv
+import datetime
+import gzip
+import hashlib
+import io
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import zipfile
+
+import pytz
+from application.models import db, Activity, BestEffort
+from application.util import labels  # registers `DataFrame.fld`
+from application.util import readers
+from application.util.dataframe import (
+  calc_best_efforts, calc_distance, calc_power, calc_summary)
+
+
+# Same as for activities saved through the Strava API.
+ACTIVITY_TYPES = ('Run', 'Walk', 'Hike')
+
+
+def hash_contents(data):
+  """SHA-256 hex digest of a file's contents."""
+  return hashlib.sha256(data).hexdigest()
+
+
+def find_activity_files(directory):
+  """Paths of every .fit, .tcx and .gpx file under a directory, sorted."""
+  return sorted(
+    os.path.join(root, fname)
+    for root, _, fnames in os.walk(directory)
+    for fname in fnames
+    if os.path.splitext(fname)[1].lower() in readers.ACTIVITY_FILE_READERS
+  )
+
+
+def parse_activity_file(data, filename, source_hash):
+  """Read and summarize one activity file.
+
+  This runs in worker processes, so it takes and returns plain data.
+
+  Args:
+    data (bytes): the file's contents.
+    filename (str): the file's name, which tells its type.
+    source_hash (str): `hash_contents(data)`.
+
+  Returns:
+    dict: values for the `Activity` row's columns, plus 'best_efforts':
+    elapsed seconds keyed by distance in meters.
+  """
+  df, start_time = readers.read_activity_file(data, filename=filename)
+  calc_distance(df)
+  calc_power(df)
+
+  return dict(
+    title=os.path.splitext(os.path.basename(filename))[0],
+    tz_local='UTC',
+    recorded=start_time.tz_convert('UTC').tz_localize(None).to_pydatetime(),
+    source_hash=source_hash,
+    best_efforts=calc_best_efforts(df),
+    **calc_summary(df),
+  )
+
+
+def parse_activity_path(args):
+  """Summarize a file that was read to hash it, reporting errors rather
+  than raising.
+
+  Args:
+    args (tuple): the file's path, contents, and `hash_contents`.
+
+  Returns:
+    tuple: the output of `parse_activity_file` and None, or None and
+    an error message.
+  """
+  path, data, source_hash = args
+  try:
+    return parse_activity_file(data, path, source_hash), None
+  except Exception as e:
+    return None, f'{path}: {e}'
+
+
+def _parse_export_member(args):
+  """Worker wrapper for a file from a Strava export, maybe gzipped."""
+  data, filename, extra = args
+  try:
+    if filename.lower().endswith('.gz'):
+      data = gzip.decompress(data)
+      filename = filename[:-3]
+    row = parse_activity_file(data, filename, hash_contents(data))
+    row.update(extra)
+    return row, None
+  except Exception as e:
+    return None, f'{filename}: {e}'
+
+
+def _parallel_map(fn, jobs, max_workers=None):
+  """Like `Executor.map`, but only pulls jobs as workers free up.
+
+  That way, file contents from `jobs` don't all sit in memory at once.
+  Celery's worker processes can't start processes of their own, so
+  in one of those the jobs just run in turn.
+  """
+  if multiprocessing.current_process().daemon:
+    yield from map(fn, jobs)
+    return
+
+  max_workers = max_workers or os.cpu_count()
+  pending = collections.deque()
+  with ProcessPoolExecutor(max_workers=max_workers) as executor:
+    for job in jobs:
+      pending.append(executor.submit(fn, job))
+      if len(pending) >= 4 * max_workers:
+        yield pending.popleft().result()
+    while pending:
+      yield pending.popleft().result()
+
+
+def _copy_field(value):
+  """A value as a PostgreSQL COPY csv field: quoted, so only a NULL is
+  left empty, and an empty string or a literal \\N stays text."""
+  if value is None:
+    return ''
+  return '"' + str(value).replace('"', '""') + '"'
+
+
+def _copy_buffer(columns, rows):
+  """Rows as the input for `COPY ... FROM STDIN WITH (FORMAT csv)`."""
+  return io.StringIO(''.join(
+    ','.join(_copy_field(row.get(col)) for col in columns) + '\n'
+    for row in rows
+  ))
+
+
+def _insert_rows(table, rows):
+  """Insert rows with COPY on PostgreSQL, or one `executemany` otherwise.
+
+  Either way, the rows go in as part of the session's transaction.
+  """
+  columns = list(dict.fromkeys(key for row in rows for key in row))
+
+  if db.engine.dialect.name == 'postgresql':
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert(
+      f"COPY {table.name} ({', '.join(columns)}) "
+      "FROM STDIN WITH (FORMAT csv, NULL '')",
+      _copy_buffer(columns, rows)
+    )
+  else:
+    db.session.execute(
+      table.insert(),
+      [{col: row.get(col) for col in columns} for row in rows]
+    )
+
+
+def save_activity_batch(rows, key='source_hash'):
+  """Insert parsed activities and their best efforts in one transaction.
+
+  Args:
+    rows (list(dict)): the output of `parse_activity_file`. Any extra
+      `Activity` columns (eg `strava_id`) can be included.
+    key (str): a unique `Activity` column, set in every row, that is
+      used to find the new activities' ids.
+  """
+  if not rows:
+    return
+
+  created = datetime.datetime.utcnow()
+  activity_rows = []
+  efforts = {}
+  for row in rows:
+    row = dict(row)
+    efforts[row[key]] = row.pop('best_efforts', {})
+    activity_rows.append(dict(row, created=created))
+
+  _insert_rows(Activity.__table__, activity_rows)
+
+  key_col = getattr(Activity, key)
+  activity_ids = dict(
+    db.session.query(key_col, Activity.id).filter(key_col.in_(efforts))
+  )
+  effort_rows = [
+    dict(
+      activity_id=activity_ids[key_value],
+      distance_m=distance_m,
+      elapsed_time_s=elapsed_time_s,
+    )
+    for key_value, activity_efforts in efforts.items()
+    for distance_m, elapsed_time_s in activity_efforts.items()
+  ]
+  if effort_rows:
+    _insert_rows(BestEffort.__table__, effort_rows)
+
+  db.session.commit()
+
+
+def saved_source_hashes():
+  """Hashes of the files behind every saved activity."""
+  return {
+    source_hash for (source_hash,) in
+    db.session.query(Activity.source_hash).filter(Activity.source_hash.isnot(None))
+  }
+
+
+def save_activity(row, handle_overlap='existing'):
+  """Save one parsed activity, unless an overlap rule says otherwise.
+
+  Overlapping saved activities are handled just like they are for
+  activities saved from Strava (see `Activity.resolve_overlap`).
+
+  Args:
+    row (dict): the output of `parse_activity_file`.
+    handle_overlap (str): 'existing', 'both' or 'incoming'.
+
+  Returns:
+    bool: whether the activity was saved.
+  """
+  datetime_st = pytz.utc.localize(row['recorded'])
+  datetime_ed = datetime_st + datetime.timedelta(seconds=row['elapsed_time_s'])
+  if not Activity.resolve_overlap(datetime_st, datetime_ed, handle_overlap):
+    return False
+
+  save_activity_batch([row])
+  return True
+
+
+def _save_results(results, stats, saved_hashes, batch_size, echo):
+  """Save (row, error) results from the workers in batches."""
+  batch = []
+  for row, error in results:
+    if error:
+      echo(f'Failed to read {error}')
+      stats['failed'] += 1
+      continue
+
+    if row['source_hash'] in saved_hashes:
+      stats['skipped'] += 1
+      continue
+    saved_hashes.add(row['source_hash'])
+
+    batch.append(row)
+    if len(batch) >= batch_size:
+      save_activity_batch(batch)
+      stats['imported'] += len(batch)
+      batch = []
+      echo(f'Saved {stats["imported"]} activities')
+
+  save_activity_batch(batch)
+  stats['imported'] += len(batch)
+
+
+def import_files(paths, batch_size=100, max_workers=None, echo=print):
+  """Parse activity files in parallel and save them in batches.
+
+  Must be called within an app context.
+
+  Args:
+    paths (list(str)): activity files to import.
+    batch_size (int): number of activities saved per transaction.
+    max_workers (int): number of worker processes. Defaults to the
+      number of CPUs.
+    echo (callable): reports progress.
+
+  Returns:
+    dict: counts of files 'imported', 'skipped' (already saved) and
+    'failed', plus the 'seconds' it all took.
+  """
+  start = time.perf_counter()
+
+  saved_hashes = saved_source_hashes()
+  stats = dict(imported=0, skipped=0, failed=0)
+  echo(f'Importing {len(paths)} files')
+
+  def iter_jobs():
+    # Hashing is much cheaper than parsing, so weed out saved files
+    # first. Each file is read once, as workers are ready for it.
+    todo_hashes = set()
+    for path in paths:
+      with open(path, 'rb') as f:
+        data = f.read()
+      source_hash = hash_contents(data)
+      if source_hash in saved_hashes or source_hash in todo_hashes:
+        stats['skipped'] += 1
+        continue
+      todo_hashes.add(source_hash)
+      yield path, data, source_hash
+
+  _save_results(
+    _parallel_map(parse_activity_path, iter_jobs(), max_workers=max_workers),
+    stats, saved_hashes, batch_size, echo
+  )
+
+  stats['seconds'] = time.perf_counter() - start
+  return stats
+
+
+def read_strava_export_index(zip_file):
+  """Read the rows of a Strava export's activities.csv.
+
+  Args:
+    zip_file (zipfile.ZipFile): the export.
+
+  Yields:
+    dict: the row's values keyed by column name, eg 'Activity ID',
+    'Activity Name', 'Activity Type' and 'Filename'.
+  """
+  with zip_file.open('activities.csv') as f:
+    reader = csv.reader(io.TextIOWrapper(f, encoding='utf-8', newline=''))
+    header = next(reader)
+
+    # Some columns (eg Distance) appear twice, in different units.
+    # Keep the first.
+    cols = {}
+    for i, name in enumerate(header):
+      cols.setdefault(name, i)
+
+    for row in reader:
+      yield {name: row[i] for name, i in cols.items() if i < len(row)}
+
+
+def import_strava_export(file_obj, strava_acct_id=None, batch_size=100,
+                         max_workers=None, echo=print):
+  """Save the activities in a Strava bulk export, without the Strava API.
+
+  The ZIP is read member by member, as workers are ready for more, and
+  gzipped members are decompressed in the workers. Nothing is
+  extracted to disk.
+
+  Must be called within an app context.
+
+  Args:
+    file_obj (str or file-like object): path to the export's ZIP file,
+      or the file itself.
+    strava_acct_id (int): Strava athlete ID of the account that made
+      the export, if it is linked.
+    batch_size (int): number of activities saved per transaction.
+    max_workers (int): number of worker processes. Defaults to the
+      number of CPUs.
+    echo (callable): reports progress.
+
+  Returns:
+    dict: counts of activities 'imported', 'skipped' (already saved or
+    not a run/walk/hike), and 'failed', plus the 'seconds' it all took.
+  """
+  start = time.perf_counter()
+
+  saved_strava_ids = {
+    strava_id for (strava_id,) in
+    db.session.query(Activity.strava_id).filter(Activity.strava_id.isnot(None))
+  }
+  stats = dict(imported=0, skipped=0, failed=0)
+
+  with zipfile.ZipFile(file_obj) as zip_file:
+
+    def iter_jobs():
+      for row in read_strava_export_index(zip_file):
+        strava_id = int(row['Activity ID'])
+        if (
+          row.get('Activity Type') not in ACTIVITY_TYPES
+          or not row.get('Filename')
+          or strava_id in saved_strava_ids
+        ):
+          stats['skipped'] += 1
+          continue
+
+        extra = dict(
+          title=row.get('Activity Name'),
+          description=row.get('Activity Description'),
+          strava_id=strava_id,
+          strava_acct_id=strava_acct_id,
+        )
+        yield zip_file.read(row['Filename']), row['Filename'], extra
+
+    _save_results(
+      _parallel_map(_parse_export_member, iter_jobs(), max_workers=max_workers),
+      stats, saved_source_hashes(), batch_size, echo
+    )
+
+  stats['seconds'] = time.perf_counter() - start
+  return stats
@@ -1,7 +1,8 @@
 """Core Flask app routes."""
-from flask import redirect, render_template
+from flask import abort, jsonify, redirect, render_template, request
 from flask_login import logout_user, login_required
 
+from application import uploads
 from application.models import AdminUser
 from . import main
 
@@ -10,3 +11,43 @@ from . import main
 def logout():
   logout_user()
   return redirect('/')
+
+
+@main.route('/upload', methods=['POST'])
+@login_required
+def upload():
+  """Receive an activity file, whole or in chunks, and spool it to disk.
+
+  Form fields:
+    file: the file, or one chunk of it.
+    upload_id: identifies the chunks of one file. Omit it to upload a
+      whole file in one request.
+    offset: where this chunk starts in the file, in bytes.
+    final: '1' (or omitted) on the last chunk.
+
+  Returns the upload_id and bytes received so far, plus a handle for
+  the finished file with the last chunk.
+  """
+  file = request.files.get('file')
+  if file is None:
+    abort(400)
+
+  try:
+    uploads.check_filename(file.filename)
+    upload_id = request.form.get('upload_id') or uploads.new_upload_id()
+    received = uploads.write_chunk(
+      upload_id,
+      file.stream,
+      offset=request.form.get('offset', 0, type=int)
+    )
+    result = {'upload_id': upload_id, 'received': received}
+
+    if request.form.get('final', '1') == '1':
+      result['handle'] = uploads.finish_upload(upload_id, file.filename)
+      result['filename'] = file.filename
+  except ValueError as e:
+    response = jsonify({'error': str(e)})
+    response.status_code = 400
+    return response
+
+  return jsonify(result)
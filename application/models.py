@@ -1,19 +1,28 @@
+from concurrent.futures import ThreadPoolExecutor
 import datetime
 from functools import cached_property
+import heapq
 from importlib import import_module
 import os
 import sys
+import threading
+import time
+from types import SimpleNamespace
 
-from dateutil import tz
+from dateutil import parser, tz
 from flask import current_app
 from flask_login import UserMixin
 import pandas as pd
 import pytz
 import sqlalchemy as sa
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.sql.expression import FunctionElement
 from stravalib.exc import RateLimitExceeded
 
 from application import db, login
-from application.util import power, units
+from application.util import cache, locks, power, ratelimit, singleflight, units
+from application.util.dataframe import calc_best_efforts
 
 
 CLIENT_ID = os.environ.get('STRAVA_CLIENT_ID')
@@ -50,9 +59,11 @@ class Activity(db.Model):
     nullable=False
   )
 
+  # Indexed for finding the saved activities near a point in time.
   recorded = db.Column(
     db.DateTime,
     unique=False,
+    index=True,
     nullable=False
   )
 
@@ -80,6 +91,15 @@ class Activity(db.Model):
   # String
   # data_source = ...
 
+  # SHA-256 of the file the activity was imported from, if any.
+  # Lets bulk imports skip files that are already saved.
+  source_hash = db.Column(
+    db.String(64),
+    unique=True,
+    index=True,
+    nullable=True,
+  )
+
   # Nullable because not every activity has latlons, so getting vals 
   # might not be possible.
   distance_m = db.Column(
@@ -119,6 +139,13 @@ class Activity(db.Model):
     nullable=True
   )
 
+  best_efforts = db.relationship(
+    'BestEffort',
+    backref='activity',
+    lazy=True,
+    cascade='all, delete-orphan'
+  )
+
   @property
   def intensity_factor(self):
     if self.ngp_ms:
@@ -147,6 +174,124 @@ class Activity(db.Model):
       )
     ]
 
+  @classmethod
+  def resolve_overlap(cls, datetime_st, datetime_ed, handle_overlap='existing'):
+    """Apply an overlap rule for an incoming activity.
+
+    Args:
+      datetime_st, datetime_ed (datetime.datetime): tz-aware start and
+        end of the incoming activity.
+      handle_overlap (str): what to do if saved activities overlap it.
+        'existing' keeps them and drops the incoming activity, 'both'
+        keeps everything, and 'incoming' deletes them.
+
+    Returns:
+      bool: whether the incoming activity should be saved.
+    """
+    overlap_ids = cls.find_overlap_ids(datetime_st, datetime_ed)
+    if not len(overlap_ids):
+      print('No overlaps detected')
+      return True
+
+    print('Overlapping existing activities detected.')
+    if handle_overlap == 'existing':
+      print('Keeping existing activities; not saving incoming activity.')
+      return False
+    elif handle_overlap == 'both':
+      print('Keeping existing activities AND saving incoming activity.')
+    elif handle_overlap == 'incoming':
+      print('Deleting existing activities and saving incoming activity.')
+      for saved_activity_id in overlap_ids:
+        db.session.delete(cls.query.get(saved_activity_id))
+        db.session.commit()
+
+    return True
+
+  @classmethod
+  def resolve_overlaps(cls, intervals, handle_overlap='existing'):
+    """Apply an overlap rule for a batch of incoming activities at once.
+
+    Works like calling `resolve_overlap` for each incoming activity in
+    turn and saving the ones it allows, so incoming activities can
+    overlap each other too. But saved activities are read in one query
+    and any deletions happen in one statement. Nothing is committed.
+
+    Incoming activities are taken in order of start time, so anything
+    that ends before one starts can't overlap the rest. The sweep only
+    keeps the saved and accepted activities still running (in heaps
+    by end time), rather than checking every one for each activity.
+
+    Args:
+      intervals (list(tuple)): tz-naive UTC start and end datetimes of
+        each incoming activity.
+      handle_overlap (str): 'existing', 'both' or 'incoming', as for
+        `resolve_overlap`.
+
+    Returns:
+      list(bool): whether each incoming activity should be saved.
+    """
+    if not intervals:
+      return []
+
+    # Only saved activities that could reach the batch's time span, found
+    # with the index on their start time.
+    longest_s = db.session.query(sa.func.max(cls.elapsed_time_s)).scalar() or 0
+    saved = sorted(
+      (recorded, recorded + datetime.timedelta(seconds=elapsed_time_s), id_)
+      for id_, recorded, elapsed_time_s in db.session.query(
+        cls.id, cls.recorded, cls.elapsed_time_s
+      ).filter(
+        cls.recorded > min(st for st, _ in intervals)
+          - datetime.timedelta(seconds=longest_s),
+        cls.recorded < max(ed for _, ed in intervals),
+      )
+    )
+
+    delete_ids = set()
+    accepted = {}  # index in `intervals`: (start, end)
+    running_saved = []  # (end, start, id) of saved activities
+    running_accepted = []  # (end, index) of accepted activities
+    next_saved = 0
+    for i in sorted(range(len(intervals)), key=lambda i: intervals[i][0]):
+      datetime_st, datetime_ed = intervals[i]
+
+      while next_saved < len(saved) and saved[next_saved][0] < datetime_ed:
+        st, ed, id_ = saved[next_saved]
+        heapq.heappush(running_saved, (ed, st, id_))
+        next_saved += 1
+      while running_saved and running_saved[0][0] <= datetime_st:
+        heapq.heappop(running_saved)
+      while running_accepted and running_accepted[0][0] <= datetime_st:
+        heapq.heappop(running_accepted)
+
+      # Saved activities are in the heap once one incoming activity
+      # ends after they start, so the start still needs checking.
+      overlap_ids = {
+        id_ for _, st, id_ in running_saved
+        if st < datetime_ed and id_ not in delete_ids
+      }
+      # Accepted activities all started no later than this one.
+      overlap_idxs = {j for _, j in running_accepted if j in accepted}
+
+      if overlap_ids or overlap_idxs:
+        if handle_overlap == 'existing':
+          continue
+        elif handle_overlap == 'incoming':
+          delete_ids |= overlap_ids
+          for j in overlap_idxs:
+            del accepted[j]
+
+      accepted[i] = (datetime_st, datetime_ed)
+      heapq.heappush(running_accepted, (datetime_ed, i))
+
+    if delete_ids:
+      print(f'Deleting {len(delete_ids)} overlapping existing activities.')
+      BestEffort.query.filter(BestEffort.activity_id.in_(delete_ids)).delete(
+        synchronize_session=False)
+      cls.query.filter(cls.id.in_(delete_ids)).delete(synchronize_session=False)
+
+    return [i in accepted for i in range(len(intervals))]
+
   @classmethod
   def load_table_as_df(cls, fields=None):
 
@@ -175,6 +320,68 @@ class Activity(db.Model):
       return '<Activity {}>'.format(self.id)
 
 
+class BestEffort(db.Model):
+  """Fastest segment of a saved activity over a standard distance.
+
+  Computed from the activity's streams when it is saved, so questions
+  like "what are my 10 fastest miles?" never need the streams again.
+  """
+
+  __table_args__ = (
+    db.UniqueConstraint('activity_id', 'distance_m'),
+    db.Index('ix_best_effort_distance_m_elapsed_time_s',
+      'distance_m', 'elapsed_time_s'),
+  )
+
+  id = db.Column(
+    db.Integer,
+    primary_key=True
+  )
+
+  activity_id = db.Column(
+    db.Integer,
+    db.ForeignKey('activity.id', ondelete='CASCADE'),
+    nullable=False,
+  )
+
+  # One of the values in `dataframe.BEST_EFFORT_DISTANCES`.
+  distance_m = db.Column(
+    db.Float,
+    nullable=False,
+  )
+
+  elapsed_time_s = db.Column(
+    db.Float,
+    nullable=False,
+  )
+
+  @classmethod
+  def from_df(cls, df):
+    """Create (unsaved) best efforts from an activity's stream DataFrame."""
+    return [
+      cls(distance_m=distance_m, elapsed_time_s=elapsed_time_s)
+      for distance_m, elapsed_time_s in calc_best_efforts(df).items()
+    ]
+
+  @classmethod
+  def fastest(cls, distance_m, limit=10):
+    """The fastest saved efforts over a distance, fastest first."""
+    return (
+      cls.query
+      .filter_by(distance_m=distance_m)
+      .order_by(cls.elapsed_time_s)
+      .limit(limit)
+      .all()
+    )
+
+  @property
+  def speed_ms(self):
+    return self.distance_m / self.elapsed_time_s
+
+  def __repr__(self):
+    return f'<BestEffort {self.distance_m:.0f}m in {self.elapsed_time_s:.0f}s>'
+
+
 class AdminUser(UserMixin):
   id = 1
 
@@ -243,6 +450,33 @@ def import_string(dotted_path):
     ) from err
 
 
+# Shown in place of an athlete profile that couldn't be fetched.
+RATE_LIMITED_PROFILE = dict(
+  profile=None,
+  firstname='Rate',
+  lastname='Limit',
+  follower_count=None,
+  email=None,
+  city=None,
+  state=None,
+  country=None,
+  run_count=1,
+)
+
+
+# Strava clients that are ready to use, keyed by account id, as
+# (backend, access token, client). Reusing a client reuses its HTTP
+# session, so its connections to Strava stay open between requests.
+# Pooled per thread, because `requests.Session` isn't thread-safe.
+_client_pool = threading.local()
+
+
+def _pooled_clients():
+  if not hasattr(_client_pool, 'clients'):
+    _client_pool.clients = {}
+  return _client_pool.clients
+
+
 class StravaAccount(db.Model):
   # admin_user_id = db.Column(
   #   db.Integer,
@@ -257,20 +491,76 @@ class StravaAccount(db.Model):
   access_token = db.Column(db.String())
   refresh_token = db.Column(db.String())
   expires_at = db.Column(db.Integer)
+  # Unix start time of the latest activity listed from Strava, once
+  # everything listed with it is saved. The next sync only lists
+  # activities that start after it.
+  synced_until = db.Column(db.Integer)
+  # Unix start time of the latest activity in the last listing that
+  # went all the way through to the activity summary mirror. The next
+  # mirror sync lists activities that start after it, or all of them
+  # if it's not set.
+  summaries_synced_until = db.Column(db.Integer)
   # email = db.Column(db.String)
   # token = db.Column(db.PickleType)
   activities = db.relationship('Activity', backref='strava_acct', lazy='dynamic')
+  activity_summaries = db.relationship(
+    'StravaActivitySummary',
+    lazy='dynamic',
+    cascade='all, delete-orphan'
+  )
 
   # @property
   def get_token(self):
+    """This account's token, refreshed first if it's about to expire.
 
-    if datetime.datetime.utcnow() < datetime.datetime.utcfromtimestamp(self.expires_at):
-      return dict(
-        access_token=self.access_token,
-        refresh_token=self.refresh_token,
-        expires_at=self.expires_at,
-      )
+    Only one process refreshes a given account's token at a time. The
+    rest wait on a shared lock (see `util.locks`), then use the token it
+    got instead of spending an API call (and the single-use refresh
+    token) on their own.
+    """
+    if not self._token_expires_soon():
+      return self._token()
 
+    try:
+      with locks.named_lock(f'strava-token:{self.strava_id}'):
+        self._load_saved_token()
+        if self._token_expires_soon():
+          self._refresh_token()
+    except locks.LockTimeout:
+      # Whoever has the lock is stuck. The token may still be good.
+      if self._token_expired():
+        raise
+
+    return self._token()
+
+  def _token(self):
+    return dict(
+      access_token=self.access_token,
+      refresh_token=self.refresh_token,
+      expires_at=self.expires_at,
+    )
+
+  def _token_expired(self, margin_s=0):
+    return time.time() + margin_s >= (self.expires_at or 0)
+
+  def _token_expires_soon(self):
+    return self._token_expired(
+      margin_s=current_app.config.get('STRAVA_TOKEN_REFRESH_MARGIN_S', 0))
+
+  def _load_saved_token(self):
+    """Catch up with a token that another process saved."""
+    saved = db.session.execute(
+      sa.select(
+        StravaAccount.access_token,
+        StravaAccount.refresh_token,
+        StravaAccount.expires_at
+      ).where(StravaAccount.strava_id == self.strava_id)
+    ).one_or_none()
+    if saved is not None:
+      for key, value in saved._mapping.items():
+        set_committed_value(self, key, value)
+
+  def _refresh_token(self):
     print('refreshing expired token')
     token = self.get_client().refresh_access_token(
       client_id=CLIENT_ID,
@@ -283,7 +573,8 @@ class StravaAccount(db.Model):
     self.expires_at = token['expires_at']
     db.session.commit()
 
-    return token
+    # The pooled client has the old token.
+    _pooled_clients().pop(self.strava_id, None)
 
   @property
   def has_authorized(self):
@@ -291,15 +582,49 @@ class StravaAccount(db.Model):
 
   @property
   def client(self):
+    """A client for this account's Strava data.
+
+    The underlying client is pooled (see `_client_pool`), and only
+    rebuilt when the access token or backend changes. Identical
+    requests made at the same time, here or in another process, share
+    one response (see `util.singleflight`).
+    """
     token = self.get_token()
-    return self.get_client(access_token=token['access_token'])
+    backend = current_app.config.get('STRAVALIB_CLIENT')
+
+    pool = _pooled_clients()
+    pooled = pool.get(self.strava_id)
+    if pooled is None or pooled[:2] != (backend, token['access_token']):
+      pooled = (
+        backend,
+        token['access_token'],
+        self._new_client(backend=backend, access_token=token['access_token'])
+      )
+      pool[self.strava_id] = pooled
+
+    return self._single_flight(self._rate_limited(pooled[2]), self.strava_id)
 
   @staticmethod
-  def get_client(backend=None, access_token=None):
+  def get_client(backend=None, access_token=None, lane=None, strava_id=None):
     """Load a strava connection backend and return an instance of it.
     If backend is None (default), use `config.STRAVALIB_CLIENT`, or
     finally default to stravalib.
+
+    Its requests go through the shared rate limiter, in the background
+    lane inside Celery tasks and the interactive lane otherwise, unless
+    `lane` says which. If `strava_id` says whose data it gets, its
+    requests are coalesced like those of `StravaAccount.client`.
     """
+    client = StravaAccount._rate_limited(
+      StravaAccount._new_client(backend=backend, access_token=access_token),
+      lane=lane
+    )
+    if strava_id is None:
+      return client
+    return StravaAccount._single_flight(client, strava_id)
+
+  @staticmethod
+  def _new_client(backend=None, access_token=None):
     backend = backend or current_app.config.get('STRAVALIB_CLIENT')
     klass = import_string(backend or 'stravalib.Client')
     for cfg_name, cfg_val in current_app.config.items():
@@ -314,28 +639,106 @@ class StravaAccount(db.Model):
         )
     return klass(access_token=access_token)
 
+  @staticmethod
+  def _rate_limited(client, lane=None):
+    return ratelimit.RateLimitedClient(
+      client,
+      ratelimit.get_rate_limiter(),
+      max_wait_s=current_app.config.get('STRAVA_RATE_LIMIT_MAX_WAIT_S', 0),
+      lane=lane or ratelimit.current_lane(),
+    )
+
+  @staticmethod
+  def _single_flight(client, strava_id):
+    return singleflight.SingleFlightClient(client, key_prefix=f'strava:{strava_id}')
+
   @cached_property
   def athlete(self):
+    """This account's athlete profile, from the shared cache if it's
+    there (see `load_athletes`)."""
+    profile = cache.get_cache().get(self._athlete_cache_key)
+    if profile is None:
+      profile = self._fetch_athlete_profile(self.client)
+      self._cache_athlete_profile(profile)
+    return SimpleNamespace(**profile)
+
+  @classmethod
+  def load_athletes(cls, strava_accounts):
+    """Load the athlete profiles of several accounts at once.
+
+    Profiles that aren't cached are fetched from Strava concurrently,
+    up to `STRAVA_ATHLETE_CONCURRENCY` at a time, so loading a handful
+    takes about as long as one request.
+    """
+    profiles = {}
+    stale = []
+    for strava_acct in strava_accounts:
+      profile = cache.get_cache().get(strava_acct._athlete_cache_key)
+      if profile is None:
+        stale.append(strava_acct)
+      else:
+        profiles[strava_acct.strava_id] = profile
+
+    if len(stale) == 1:
+      profiles[stale[0].strava_id] = stale[0]._fetch_athlete_profile(stale[0].client)
+    elif stale:
+      # Threads don't know about this session or Celery task, so they
+      # get a token and a lane to make their own clients with.
+      app = current_app._get_current_object()
+      lane = ratelimit.current_lane()
+
+      def fetch(strava_id, access_token):
+        with app.app_context():
+          return cls._fetch_athlete_profile(cls.get_client(
+            access_token=access_token, lane=lane, strava_id=strava_id))
+
+      concurrency = current_app.config.get('STRAVA_ATHLETE_CONCURRENCY', 8)
+      with ThreadPoolExecutor(max_workers=min(concurrency, len(stale))) as executor:
+        fetched = executor.map(
+          fetch,
+          [acct.strava_id for acct in stale],
+          [acct.get_token()['access_token'] for acct in stale]
+        )
+        for strava_acct, profile in zip(stale, fetched):
+          profiles[strava_acct.strava_id] = profile
+
+    for strava_acct in strava_accounts:
+      profile = profiles[strava_acct.strava_id]
+      if strava_acct in stale:
+        strava_acct._cache_athlete_profile(profile)
+      strava_acct.__dict__['athlete'] = SimpleNamespace(**profile)
+
+  @property
+  def _athlete_cache_key(self):
+    return f'strava-athlete:{self.strava_id}'
+
+  @staticmethod
+  def _fetch_athlete_profile(client):
     try:
-      _athlete = self.client.get_athlete()
+      athlete = client.get_athlete()
+      # `athlete.stats` would ask Strava who's logged in first.
+      stats = client.get_athlete_stats(athlete.id)
+      return dict(
+        profile=athlete.profile,
+        firstname=athlete.firstname,
+        lastname=athlete.lastname,
+        follower_count=athlete.follower_count,
+        email=getattr(athlete, 'email', None),
+        city=athlete.city,
+        state=athlete.state,
+        country=athlete.country,
+        run_count=stats.all_run_totals.count,
+      )
     except RateLimitExceeded:
-      from application.util.mock_stravalib import DummyClass
-      
-      _athlete = DummyClass(
-        profile=None,
-        firstname='Rate',
-        lastname='Limit',
-        follower_count=None,
-        email=None,
-        city=None,
-        state=None,
-        country=None,
-        stats=DummyClass(
-          all_run_totals=DummyClass(count=1)
-        )
+      return RATE_LIMITED_PROFILE
+
+  def _cache_athlete_profile(self, profile):
+    if profile is not RATE_LIMITED_PROFILE:
+      cache.get_cache().set(
+        self._athlete_cache_key,
+        profile,
+        current_app.config.get('STRAVA_ATHLETE_CACHE_TTL_S', 0)
       )
-    
-    return _athlete
 
   @property
   def profile_picture_url(self):
@@ -351,7 +754,7 @@ class StravaAccount(db.Model):
 
   @property
   def run_count(self):
-    return self.athlete.stats.all_run_totals.count
+    return self.athlete.run_count
 
   @property
   def follower_count(self):
@@ -366,6 +769,230 @@ class StravaAccount(db.Model):
     return f'https://www.strava.com/athletes/{self.strava_id}'
 
 
+class epoch_s(FunctionElement):
+  """Unix time of a tz-naive UTC DateTime column, in SQL."""
+  type = sa.Float()
+  inherit_cache = True
+
+
+@compiles(epoch_s)
+def _compile_epoch_s(element, compiler, **kw):
+  return f'EXTRACT(EPOCH FROM {compiler.process(element.clauses, **kw)})'
+
+
+@compiles(epoch_s, 'sqlite')
+def _compile_epoch_s_sqlite(element, compiler, **kw):
+  return f"CAST(strftime('%s', {compiler.process(element.clauses, **kw)}) AS REAL)"
+
+
+class StravaActivitySummary(db.Model):
+  """A Strava activity as it appears in the account's activity listing.
+
+  Kept in step with Strava by the listing syncs and the webhook (see
+  `tasks.sync_activity_summaries`), so the import table can be paged,
+  sorted and filtered without asking Strava.
+  """
+  strava_id = db.Column(
+    db.BigInteger,
+    primary_key=True,
+    autoincrement=False
+  )
+  strava_acct_id = db.Column(
+    db.Integer,
+    db.ForeignKey('strava_account.strava_id'),
+    index=True,
+    nullable=False
+  )
+  name = db.Column(db.String(255))
+  type = db.Column(db.String(40))
+  # tz-naive UTC.
+  start_date = db.Column(
+    db.DateTime,
+    nullable=False
+  )
+  # tz-naive, in the activity's time zone.
+  start_date_local = db.Column(db.DateTime)
+  moving_time_s = db.Column(db.Integer)
+  elapsed_time_s = db.Column(
+    db.Integer,
+    nullable=False
+  )
+  distance_m = db.Column(db.Float)
+  elevation_m = db.Column(db.Float)
+
+  @staticmethod
+  def row_from_summary(strava_acct_id, summary):
+    """Column values from an activity summary (see
+    `tasks.activity_summary`) or a whole activity as a dict."""
+    start_date = parser.isoparse(summary['start_date'])
+    start_date_local = summary.get('start_date_local')
+    return dict(
+      strava_id=summary['id'],
+      strava_acct_id=strava_acct_id,
+      name=summary['name'],
+      type=summary['type'],
+      start_date=start_date.astimezone(datetime.timezone.utc).replace(tzinfo=None),
+      start_date_local=(
+        parser.isoparse(start_date_local) if start_date_local
+        else start_date
+      ).replace(tzinfo=None),
+      moving_time_s=summary['moving_time'],
+      elapsed_time_s=summary['elapsed_time'],
+      distance_m=summary['distance'],
+      elevation_m=summary['total_elevation_gain'],
+    )
+
+  @classmethod
+  def upsert(cls, strava_acct_id, summaries):
+    """Add or update the mirrored activities, and commit.
+
+    Args:
+      strava_acct_id (int): the account the activities belong to.
+      summaries (list(dict)): activity summaries or whole activities.
+    """
+    rows = list({
+      summary['id']: cls.row_from_summary(strava_acct_id, summary)
+      for summary in summaries
+    }.values())
+    if not rows:
+      return
+
+    dialect = db.engine.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+      insert = import_module(f'sqlalchemy.dialects.{dialect}').insert
+      stmt = insert(cls.__table__)
+      db.session.execute(
+        stmt.on_conflict_do_update(
+          index_elements=[cls.strava_id],
+          set_={
+            column.name: stmt.excluded[column.name]
+            for column in cls.__table__.columns
+            if column.name != 'strava_id'
+          }
+        ),
+        rows
+      )
+    else:
+      cls.query.filter(cls.strava_id.in_([row['strava_id'] for row in rows])).delete(
+        synchronize_session=False)
+      db.session.execute(cls.__table__.insert(), rows)
+    db.session.commit()
+
+  @classmethod
+  def table_query(cls, strava_acct_id, with_overlap_count=False):
+    """The account's mirrored activities, each with whether it's saved,
+    and optionally how many saved activities overlap it.
+
+    Counting overlaps in SQL compares every mirrored activity with
+    every saved one, so only ask for it to sort or filter by the count.
+    Otherwise, count just the activities being shown with
+    `overlap_counts`.
+
+    Returns:
+      tuple: a query of (StravaActivitySummary, saved) rows, with
+      overlap_count on the end if asked for, and the `saved` and
+      `overlap_count` (or None) columns to sort or filter it with.
+    """
+    is_saved = sa.exists().where(Activity.strava_id == cls.strava_id).label('saved')
+    query = db.session.query(cls, is_saved).filter(cls.strava_acct_id == strava_acct_id)
+    if not with_overlap_count:
+      return query, is_saved, None
+
+    overlapping = sa.orm.aliased(Activity)
+    start_s = epoch_s(cls.start_date)
+    overlapping_start_s = epoch_s(overlapping.recorded)
+    overlap_count = sa.func.count(overlapping.id).label('overlap_count')
+
+    query = (
+      query.add_columns(overlap_count)
+      .outerjoin(
+        overlapping,
+        sa.and_(
+          overlapping_start_s < start_s + cls.elapsed_time_s,
+          start_s < overlapping_start_s + overlapping.elapsed_time_s,
+        )
+      )
+      .group_by(cls.strava_id)
+    )
+    return query, is_saved, overlap_count
+
+  @staticmethod
+  def overlap_counts(summaries):
+    """How many saved activities overlap each of a few mirrored ones.
+
+    Saved activities are read in one query, limited (on the indexed
+    start time) to those that could reach the summaries' time span.
+
+    Returns:
+      dict: overlap counts keyed by strava_id.
+    """
+    if not summaries:
+      return {}
+
+    intervals = {
+      summary.strava_id: (
+        summary.start_date,
+        summary.start_date + datetime.timedelta(seconds=summary.elapsed_time_s)
+      )
+      for summary in summaries
+    }
+    longest_s = db.session.query(sa.func.max(Activity.elapsed_time_s)).scalar() or 0
+    saved = [
+      (recorded, recorded + datetime.timedelta(seconds=elapsed_time_s))
+      for recorded, elapsed_time_s in db.session.query(
+        Activity.recorded, Activity.elapsed_time_s
+      ).filter(
+        Activity.recorded > min(st for st, _ in intervals.values())
+          - datetime.timedelta(seconds=longest_s),
+        Activity.recorded < max(ed for _, ed in intervals.values()),
+      )
+    ]
+    return {
+      strava_id: sum(1 for st, ed in saved if st < end and start < ed)
+      for strava_id, (start, end) in intervals.items()
+    }
+
+  def __repr__(self):
+    return f'<StravaActivitySummary {self.strava_id}>'
+
+
+class RateLimitBucket(db.Model):
+  """A shared token bucket (see `application.util.ratelimit`), for when
+  there's no Redis to keep it in."""
+  name = db.Column(
+    db.String(40),
+    primary_key=True
+  )
+  tokens = db.Column(
+    db.Float,
+    nullable=False
+  )
+  # Unix time that `tokens` was last brought up to date.
+  updated = db.Column(
+    db.Float,
+    nullable=False
+  )
+
+
+class CacheEntry(db.Model):
+  """A shared cache entry (see `application.util.cache`), for when
+  there's no Redis to keep it in."""
+  key = db.Column(
+    db.String(200),
+    primary_key=True
+  )
+  # JSON.
+  value = db.Column(
+    db.Text,
+    nullable=False
+  )
+  # Unix time after which the entry is ignored.
+  expires = db.Column(
+    db.Float,
+    nullable=False
+  )
+
+
 class UserSettings(db.Model):
   id = db.Column(
     db.Integer,
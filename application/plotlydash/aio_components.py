@@ -378,7 +378,7 @@ class FigureRowsAIO(html.Div):
       if df.fld.has('GAP'):
         plotter.add_trace(SPEED_ID,
           'GAP',
-          formatter=units.speed_to_pace,
+          series_formatter=units.speed_to_pace_series,
           visible=True,
           line_color='#FC4C02',
           **TRACE_LAYOUT[SPEED]
@@ -387,14 +387,14 @@ class FigureRowsAIO(html.Div):
       if df.fld.has('NGP'):
         plotter.add_trace(SPEED_ID,
           'NGP',
-          formatter=units.speed_to_pace,
+          series_formatter=units.speed_to_pace_series,
           visible=True,
           line_color='#204D74',
           **TRACE_LAYOUT[SPEED]
         )
 
       plotter.add_trace(SPEED_ID, SPEED,
-        formatter=units.speed_to_pace,
+        series_formatter=units.speed_to_pace_series,
         visible=True,
         line_color='black',
         **TRACE_LAYOUT[SPEED]
@@ -825,8 +825,8 @@ class StatsDivAIO(dbc.Accordion):
 
       df_stats['Speed (m/s)'] = df_stats['Distance (m)'] / df_stats['Time (s)']
       df_stats['Distance (mi)'] = df_stats['Distance (m)'].astype('float') / units.M_PER_MI
-      df_stats['Time'] = df_stats['Time (s)'].apply(units.seconds_to_string)
-      df_stats['Pace'] = df_stats['Speed (m/s)'].apply(units.speed_to_pace)
+      df_stats['Time'] = units.seconds_to_string_series(df_stats['Time (s)'])
+      df_stats['Pace'] = units.speed_to_pace_series(df_stats['Speed (m/s)'])
 
       return df_stats
 
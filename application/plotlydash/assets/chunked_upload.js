@@ -0,0 +1,112 @@
+/*
+Upload files to the Flask `/upload` route in chunks, then hand Dash the
+handles of the uploaded files (never their contents).
+
+Any element with a `data-chunked-upload` attribute becomes a drop zone
+that also opens a file picker when clicked. Its other data attributes:
+  data-upload-url: where to POST the chunks.
+  data-target: id of a (hidden) dcc.Input that receives a JSON list of
+    {handle, filename} objects, or {error} if an upload failed.
+  data-multiple: if present, more than one file can be picked at once.
+  data-accept: file types for the picker, eg ".fit,.tcx,.gpx".
+*/
+(function () {
+  const CHUNK_SIZE = 4 * 1024 * 1024;
+
+  function newUploadId() {
+    const bytes = new Uint8Array(16);
+    crypto.getRandomValues(bytes);
+    return Array.from(bytes, (b) => b.toString(16).padStart(2, '0')).join('');
+  }
+
+  async function uploadFile(file, url) {
+    const uploadId = newUploadId();
+    const numChunks = Math.max(1, Math.ceil(file.size / CHUNK_SIZE));
+    let result = null;
+
+    for (let i = 0; i < numChunks; i++) {
+      const offset = i * CHUNK_SIZE;
+      const form = new FormData();
+      form.append('upload_id', uploadId);
+      form.append('offset', offset);
+      form.append('final', i === numChunks - 1 ? '1' : '0');
+      form.append('file', file.slice(offset, offset + CHUNK_SIZE), file.name);
+
+      const response = await fetch(url, {
+        method: 'POST',
+        body: form,
+        credentials: 'same-origin',
+      });
+      result = await response.json();
+      if (!response.ok) {
+        throw new Error(result.error || `Upload failed (${response.status})`);
+      }
+    }
+
+    return {handle: result.handle, filename: result.filename};
+  }
+
+  function setDashInputValue(id, value) {
+    // dcc.Input is a controlled React input, so React only notices a new
+    // value set through the native setter, followed by an input event.
+    const input = document.getElementById(id);
+    const setValue = Object.getOwnPropertyDescriptor(
+      window.HTMLInputElement.prototype, 'value'
+    ).set;
+    setValue.call(input, value);
+    input.dispatchEvent(new Event('input', {bubbles: true}));
+  }
+
+  async function uploadFiles(zone, files) {
+    if (!files.length) {
+      return;
+    }
+    if (!('multiple' in zone.dataset)) {
+      files = [files[0]];
+    }
+
+    zone.classList.add('uploading');
+    try {
+      const results = [];
+      for (const file of files) {
+        results.push(await uploadFile(file, zone.dataset.uploadUrl));
+      }
+      setDashInputValue(zone.dataset.target, JSON.stringify(results));
+    } catch (err) {
+      setDashInputValue(zone.dataset.target, JSON.stringify({error: err.message}));
+    } finally {
+      zone.classList.remove('uploading');
+    }
+  }
+
+  function findZone(event) {
+    return event.target.closest && event.target.closest('[data-chunked-upload]');
+  }
+
+  document.addEventListener('click', (event) => {
+    const zone = findZone(event);
+    if (!zone) {
+      return;
+    }
+    const picker = document.createElement('input');
+    picker.type = 'file';
+    picker.multiple = 'multiple' in zone.dataset;
+    picker.accept = zone.dataset.accept || '';
+    picker.addEventListener('change', () => uploadFiles(zone, Array.from(picker.files)));
+    picker.click();
+  });
+
+  document.addEventListener('dragover', (event) => {
+    if (findZone(event)) {
+      event.preventDefault();
+    }
+  });
+
+  document.addEventListener('drop', (event) => {
+    const zone = findZone(event);
+    if (zone) {
+      event.preventDefault();
+      uploadFiles(zone, Array.from(event.dataTransfer.files));
+    }
+  });
+})();
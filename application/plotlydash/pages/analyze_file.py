@@ -1,24 +1,28 @@
-"""Display data from an uploaded activity or route file.
+"""Display data from uploaded activity or route files.
 
-No saving the file for now - keep as a DataFrame in memory.
-(Opportunity to use redis?)
+Files are streamed to disk in chunks by `assets/chunked_upload.js`
+(see `application.uploads`), and only their handles pass through Dash.
+They are parsed all at once in worker processes (or come straight from
+the cache of parsed files), and each file's stats show up as soon as it
+is ready, with a summary of them all at the end. Nothing is saved to
+the database.
 """
-import base64
-import datetime
-import io
 import json
+import os
 
 import dash
-from dash import dcc, html, callback, Input, Output, State
+from dash import dcc, html, callback, Input, Output, State, Patch
 from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
+from flask import url_for
 import pandas as pd
 
+from application import uploads
 from application.plotlydash.aio_components import FigureDivAIO, StatsDivAIO
 from application.plotlydash.layout import SettingsContainer
 from application.plotlydash.util import layout_login_required
-from application.util import readers
-from application.util.dataframe import calc_power
+from application.util import units
+from application.util.dataframe import calc_summary
 
 
 dash.register_page(__name__, path_template='/analyze-file',
@@ -30,14 +34,14 @@ def layout(**_):
 
   return SettingsContainer(
     [
-      dcc.Upload(
+      # Handled by assets/chunked_upload.js, which puts the uploaded
+      # file's handle in the hidden input below.
+      html.Div(
         id='upload-data',
-        # children=html.Div([
         children=[
           'Drag and Drop or ',
           html.A('Select File')
         ],
-        # ]),
         style={
           'width': '100%',
           'height': '60px',
@@ -46,13 +50,24 @@ def layout(**_):
           'borderStyle': 'dashed',
           'borderRadius': '5px',
           'textAlign': 'center',
-          'margin': '10px 0px'
+          'margin': '10px 0px',
+          'cursor': 'pointer',
         },
-        # Allow multiple files to be uploaded?
-        multiple=False,
+        **{
+          'data-chunked-upload': '',
+          'data-upload-url': url_for('main.upload'),
+          'data-target': 'upload-handle',
+          'data-accept': ','.join(uploads.UPLOAD_EXTENSIONS),
+          'data-multiple': '',
+        }
       ),
+      dcc.Input(id='upload-handle', type='text', style={'display': 'none'}),
+      # The uploaded files, and the summary of each once it's parsed.
+      dcc.Store(id='upload-files'),
+      dcc.Interval(id='upload-interval', interval=500, disabled=True),
       html.Div(id='file-stats'),
       html.Div(id='stats-container'),
+      html.Div(id='summary-container'),
       html.Div(id='figure-container'),
     ],
     page_title='Analyze an Activity File'
@@ -126,74 +141,128 @@ def layout(**_):
   #   return str(data)
 
 
+def read_upload_handles(value):
+  """The uploaded files listed in the `upload-handle` input's value.
+
+  Raises:
+    ValueError: if the upload failed.
+  """
+  if not value:
+    raise PreventUpdate
+
+  files = json.loads(value)
+  if isinstance(files, dict):
+    raise ValueError(files.get('error', 'Upload failed'))
+
+  return files
+
+
 @callback(
+  Output('upload-files', 'data'),
+  Output('upload-interval', 'disabled'),
+  Output('file-stats', 'children'),
   Output('stats-container', 'children'),
+  Output('summary-container', 'children'),
   Output('figure-container', 'children'),
-  Input('upload-data', 'contents'),
-  State('upload-data', 'filename'),
-  # State('upload-data', 'last_modified'),
+  Input('upload-handle', 'value'),
 )
-def get_file_data(contents, fname):
-  if contents is None:
-    raise PreventUpdate
-
-  df = parse_contents(contents, fname)
-
-  if df is None:
-    raise PreventUpdate
+def start_parsing_files(value):
+  try:
+    files = uploads.start_parsing(read_upload_handles(value))
+  except (ValueError, OSError) as e:
+    return None, True, dbc.Alert(str(e), color='danger'), [], None, None
 
-  # Add calcd fields to the DataFrame.
-  calc_power(df)
+  file_info = html.Div([
+    html.H5(f['filename'] if len(files) == 1 else f'{len(files)} files'),
+    html.H6(
+      f'{sum(os.path.getsize(uploads.path_for(f["handle"])) for f in files) / 1e6:.1f} MB'
+    ),
+    html.Hr(),
+  ])
 
-  return (
-    StatsDivAIO(df=df, aio_id='upload'),
-    FigureDivAIO(df=df, aio_id='upload'),
-  )
+  return files, False, file_info, [], dbc.Spinner(), None
 
 
 @callback(
-  Output('file-info', 'children'),
-  Input('upload-data', 'filename'),
-  State('upload-data', 'last_modified'),
+  Output('stats-container', 'children', allow_duplicate=True),
+  Output('upload-files', 'data', allow_duplicate=True),
+  Output('upload-interval', 'disabled', allow_duplicate=True),
+  Output('summary-container', 'children', allow_duplicate=True),
+  Output('figure-container', 'children', allow_duplicate=True),
+  Input('upload-interval', 'n_intervals'),
+  State('upload-files', 'data'),
+  prevent_initial_call=True,
 )
-def update_file_info(fname, date):
-  if fname is None or date is None:
+def show_parsed_files(_, files):
+  """Add the stats of each file that has been parsed since last time."""
+  if not files:
     raise PreventUpdate
 
-  stats = html.Div([
-    html.H5(fname),
-    html.H6(datetime.datetime.fromtimestamp(date)),
-    html.Hr(),
-  ])
+  stats_divs = Patch()
+  last_df = None
+  for f in files:
+    if 'summary' in f or 'error' in f:
+      continue
 
-  return stats
+    try:
+      df = uploads.parsed_result(f['key'])
+    except ValueError as e:
+      f['error'] = str(e)
+      stats_divs.append(dbc.Alert(f['error'], color='danger'))
+      continue
 
+    if df is None:
+      continue
 
-def parse_contents(contents, filename):
- 
-  content_type, content_string = contents.split(',')
+    try:
+      f['summary'] = calc_summary(df)
+    except (KeyError, IndexError) as e:
+      # Parsed before files were checked for this.
+      f['error'] = f'{f["filename"]}: no records to total ({e})'
+      stats_divs.append(dbc.Alert(f['error'], color='danger'))
+      continue
 
-  decoded = base64.b64decode(content_string)
+    last_df = df
+    stats_divs.append(html.Div([
+      html.H5(f['filename']),
+      StatsDivAIO(df=df, aio_id=f['handle']),
+    ]))
 
-  if filename.lower().endswith('fit'):
-    return readers.from_fit(decoded)
-  
-  elif filename.lower().endswith('csv'):
-    return pd.read_csv(io.StringIO(decoded.decode('utf-8')))
+  if not all('summary' in f or 'error' in f for f in files):
+    return stats_divs, files, False, dash.no_update, dash.no_update
 
-  elif filename.lower().endswith('tcx'):
-    return readers.from_tcx(decoded)
+  # With just one file, there's room for its figures.
+  figure_div = None
+  if len(files) == 1 and last_df is not None:
+    figure_div = FigureDivAIO(df=last_df, aio_id='upload')
 
-  elif filename.lower().endswith('gpx'):
-    return readers.from_gpx(decoded)
+  return stats_divs, files, True, SummaryTable(files), figure_div
 
-  # elif filename.lower().endswith('json'):
-  #   data_json = json.loads(decoded.decode('utf-8'))
-  #   # Assume the user uploaded strava stream json output
-  #   return readers.from_strava_streams(data_json)
 
-  else:
-    raise TypeError(
-      f'{filename} does not seem to be a file type that is accepted '
-      'at this time (.fit, .tcx, .gpx)'
-    )
+def SummaryTable(files):
+  """Each parsed file's totals, and the totals of them all together."""
+  summaries = [f for f in files if 'summary' in f]
+  if not summaries:
+    return None
+
+  df_summary = pd.DataFrame([f['summary'] for f in summaries])
+  df_summary.loc[len(summaries)] = df_summary.sum(min_count=1)
+  df_summary.loc[len(summaries), 'ngp_ms'] = None
+
+  df_display = pd.DataFrame({
+    'File': [f['filename'] for f in summaries] + ['Total'],
+    'Time': units.seconds_to_string_series(df_summary['elapsed_time_s']),
+    'Moving time': units.seconds_to_string_series(df_summary['moving_time_s']),
+    'Distance (mi)': (df_summary['distance_m'] / units.M_PER_MI).round(2),
+    'Elevation gain (m)': df_summary['elevation_m'].round(0),
+    'NGP': units.speed_to_pace_series(df_summary['ngp_ms']),
+  }, index=df_summary.index)
+
+  return html.Div([
+    html.H4('Summary'),
+    dbc.Table.from_dataframe(
+      df_display.astype(object).where(df_display.notna(), ''),
+      striped=True,
+      size='sm',
+    ),
+  ])
@@ -6,6 +6,7 @@ from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
 from stravalib.exc import RateLimitExceeded
 
+from application import streams
 from application.models import Activity
 from application.plotlydash.aio_components import FigureDivAIO, StatsDivAIO
 from application.util import dataframe, readers, units
@@ -66,14 +67,11 @@ def layout(activity_id=None, **_):
     ))
     return layout_container
 
-  client = strava_account.client
-
+  # Draw the map and plots from a small preview first. The full streams
+  # take longer, and replace it once they're in (see `load_streams`).
   try:
-    df = readers.from_strava_streams(client.get_activity_streams(
-      activity.strava_id,
-      types=['time', 'latlng', 'distance', 'altitude', 'velocity_smooth',
-        'heartrate', 'cadence', 'watts', 'temp', 'moving', 'grade_smooth']
-    ))
+    df_preview = readers.from_strava_streams(streams.get_activity_streams(
+      strava_account.client, activity.strava_id, 'preview'))
   except RateLimitExceeded as e:
     layout_container.children.append(html.Div(
       f'Strava API rate limit exceeded: '
@@ -81,13 +79,48 @@ def layout(activity_id=None, **_):
     ))
     return layout_container
 
-  # Add additional calculated columns to the DataFrame
-  dataframe.calc_power(df)
-
   layout_container.children.extend([
-      StatsDivAIO(df=df, aio_id='saved', className='mb-4'),
-      FigureDivAIO(df=df, aio_id='saved'),
-    ]
-  )
+    html.Div(
+      FigureDivAIO(df=df_preview, aio_id='saved-preview'),
+      id='saved-streams',
+    ),
+    dcc.Store(id='saved-activity-id', data=activity.id),
+  ])
 
   return layout_container
+
+
+@callback(
+  Output('saved-streams', 'children'),
+  Input('saved-activity-id', 'data'),
+)
+def load_streams(activity_id):
+  """Replace the preview with the full streams and the stats."""
+  if activity_id is None:
+    raise PreventUpdate
+
+  # The id comes back from the browser, so it may not be one the layout
+  # would have drawn streams for.
+  activity = Activity.query.get(activity_id)
+  if activity is None or activity.strava_id is None:
+    raise PreventUpdate
+  strava_account = activity.strava_acct
+  if not strava_account or not strava_account.has_authorized:
+    raise PreventUpdate
+
+  try:
+    df = readers.from_strava_streams(streams.get_activity_streams(
+      strava_account.client, activity.strava_id, 'full'))
+  except RateLimitExceeded as e:
+    return html.Div(
+      f'Strava API rate limit exceeded: '
+      f'{e.limit} requests in {e.timeout} seconds.'
+    )
+
+  # Add additional calculated columns to the DataFrame
+  dataframe.calc_power(df)
+
+  return [
+    StatsDivAIO(df=df, aio_id='saved', className='mb-4'),
+    FigureDivAIO(df=df, aio_id='saved'),
+  ]
@@ -119,7 +119,7 @@ def update_table(page_current, page_size, sort_by):
       'Sport': 'Run*',
       'Date': activity.recorded,
       'Title': f'[{activity.title}]({activity.relative_url})',
-      'Time': f'{units.seconds_to_string(activity.moving_time_s, show_hour=True)}',
+      'Time': activity.moving_time_s,
       'Distance': activity.distance_m,
       'Elevation': activity.elevation_m,
       'TSS': activity.tss,
@@ -133,6 +133,7 @@ def update_table(page_current, page_size, sort_by):
     for activity in page
   ])
 
+  dfs['Time'] = units.seconds_to_string_series(dfs['Time'], show_hour=True)
   dfs['Distance'] = dfs['Distance'].apply(lambda meters: f'{meters/units.M_PER_MI:.2f} mi')
   dfs['Elevation'] = dfs['Elevation'].apply(lambda meters: f'{meters*units.FT_PER_M:.0f} ft')
   dfs['TSS'] = dfs['TSS'].apply(lambda tss: f'{tss:.1f}')
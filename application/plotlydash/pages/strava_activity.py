@@ -6,10 +6,13 @@ from dash import dcc, html, callback, Input, Output, State
 from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
 import dateutil
+from flask_login import current_user
 import pandas as pd
 from sqlalchemy.exc import IntegrityError
+from stravalib.exc import RateLimitExceeded
 
-from application.models import db, Activity, StravaAccount
+from application import streams
+from application.models import db, Activity, BestEffort, StravaAccount
 from application.plotlydash.aio_components import FigureDivAIO, StatsDivAIO
 from application.plotlydash.util import layout_login_required
 from application.util import readers, units
@@ -37,13 +40,54 @@ def layout(activity_id=None, **queries):
       'Currently supported activity types are Run, Walk, and Hike.'
     )
   
+  # Draw the map and plots from a small preview first. The full streams
+  # take longer, and replace it once they're in (see `load_streams`).
+  df_preview = readers.from_strava_streams(
+    streams.get_activity_streams(client, activity_id, 'preview'))
+
+  return dbc.Container(
+    [
+      html.Div(id='strava-stats'),
+      html.Div(
+        FigureDivAIO(df=df_preview, aio_id='strava-preview'),
+        id='strava-streams',
+      ),
+      dcc.Store(id='strava-summary-response', data=activity.to_dict()),
+      dcc.Store(
+        id='strava-activity-ids',
+        data=dict(activity_id=activity_id, strava_id=strava_acct.strava_id),
+      ),
+    ],
+    id='dash-container',
+    fluid=True,
+  )
+
+
+@callback(
+  Output('strava-streams', 'children'),
+  Input('strava-activity-ids', 'data'),
+)
+def load_streams(activity_ids):
+  """Replace the preview with the full streams and everything that
+  needs them."""
+  # The ids come back from the browser, so anyone could send any.
+  if activity_ids is None or not current_user.is_authenticated:
+    raise PreventUpdate
+
+  activity_id = activity_ids['activity_id']
+  strava_acct = StravaAccount.query.get(activity_ids['strava_id'])
+  if strava_acct is None:
+    raise PreventUpdate
+
   # Read the Strava json response into a DataFrame and perform
   # additional calculations on it.
-  df = readers.from_strava_streams(client.get_activity_streams(
-    activity_id,
-    types=['time', 'latlng', 'distance', 'altitude', 'velocity_smooth',
-      'heartrate', 'cadence', 'watts', 'temp', 'moving', 'grade_smooth']
-  ))
+  try:
+    df = readers.from_strava_streams(
+      streams.get_activity_streams(strava_acct.client, activity_id, 'full'))
+  except RateLimitExceeded as e:
+    return html.Div(
+      f'Strava API rate limit exceeded. Try again in {e.timeout:.0f} seconds.'
+    )
   calc_power(df)
 
   existing_activity = strava_acct.activities.filter_by(strava_id=activity_id).first()
@@ -68,17 +112,11 @@ def layout(activity_id=None, **queries):
       ),
     ])
 
-  return dbc.Container(
-    [
-      html.Div(id='strava-stats'),
-      dbc.Row(button_col, class_name='mb-3'),
-      StatsDivAIO(df=df, aio_id='strava'),
-      FigureDivAIO(df=df, aio_id='strava'),
-      dcc.Store(id='strava-summary-response', data=activity.to_dict()),
-    ],
-    id='dash-container',
-    fluid=True,
-  )
+  return [
+    dbc.Row(button_col, class_name='mb-3'),
+    StatsDivAIO(df=df, aio_id='strava'),
+    FigureDivAIO(df=df, aio_id='strava'),
+  ]
 
 
 @callback(
@@ -121,6 +159,7 @@ def save_activity(
       distance_m=activity_data['distance'],
       elevation_m=activity_data['total_elevation_gain'],
       ngp_ms=units.pace_to_speed(ngp_string),
+      best_efforts=BestEffort.from_df(FigureDivAIO.df_from_data(record_data)),
     )
     db.session.add(new_act)
     db.session.commit()
@@ -18,9 +18,11 @@ dash.register_page(__name__, path_template='/settings/strava',
 @layout_login_required
 def layout(**_):
 
+  strava_accounts = StravaAccount.query.all()
+  StravaAccount.load_athletes(strava_accounts)
   strava_account_rows = [
     StravaAccountRow(strava_account) 
-    for strava_account in StravaAccount.query.all()
+    for strava_account in strava_accounts
   ]
 
   connect_btn_text = (
@@ -42,9 +44,24 @@ def layout(**_):
     justify='center', # verify this sets justify-content-center
   )
 
+  import_btn_row = dbc.Row(
+    dbc.Button(
+      href=url_for('strava_api.import_export'),
+      color='secondary',
+      class_name='mt-2',
+      external_link=True,
+      children=[
+        html.I(className='fa-solid fa-file-zipper'),
+        ' Import a Strava Bulk Export',
+      ],
+    ),
+    justify='center',
+  )
+
   content = [
     # <div class="alert"> for each message in get_flashed_messages
     connect_btn_row,
+    import_btn_row,
   ] + strava_account_rows
 
   return SettingsContainer(content, page_title='Manage Strava Accounts')
@@ -1,12 +1,15 @@
+import datetime
+import math
+
 import dash
 from dash import dash_table, dcc, html, Input, Output, State
 from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
+import dateutil
 import pandas as pd
-from stravalib.exc import RateLimitExceeded
 
 from application import tasks
-from application.models import Activity, StravaAccount
+from application.models import StravaAccount, StravaActivitySummary
 from application.plotlydash.util import layout_login_required
 from application.util import units
 
@@ -17,6 +20,31 @@ dash.register_page(__name__, path_template='/strava/activities',
 
 PAGE_SIZE = 25
 
+# Table columns that can be sorted and filtered, and the mirror
+# columns behind them. 'Overlap' is added by `table_query` when it's
+# sorted or filtered by.
+SORT_COLUMNS = {
+  'Sport': StravaActivitySummary.type,
+  'Date': StravaActivitySummary.start_date_local,
+  'Title': StravaActivitySummary.name,
+  'Time': StravaActivitySummary.moving_time_s,
+  'Distance': StravaActivitySummary.distance_m,
+  'Elevation': StravaActivitySummary.elevation_m,
+}
+
+# Filter operators, in the order they're looked for, as in
+# https://dash.plotly.com/datatable/filtering
+FILTER_OPERATORS = [
+  ['ge ', '>='],
+  ['le ', '<='],
+  ['lt ', '<'],
+  ['gt ', '>'],
+  ['ne ', '!='],
+  ['eq ', '='],
+  ['contains '],
+  ['datestartswith '],
+]
+
 
 @layout_login_required
 def layout(**url_queries):
@@ -27,6 +55,10 @@ def layout(**url_queries):
     return html.Div([])  # todo: add help text
     # return redirect(url_for('strava_api.authorize'))
 
+  # The table is read from the activity summary mirror. Catch it up with
+  # Strava in the background, for next time.
+  tasks.sync_activity_summaries_soon(int(strava_id))
+
   out = dbc.Container(
     [
       dcc.Location(id='url'),
@@ -83,8 +115,8 @@ def layout(**url_queries):
         page_size=int(url_queries.get('limit', PAGE_SIZE)),
         # page_count=math.ceiling(activity_count/page_size),
         page_action='custom',
-        # filter_action='custom',
-        # filter_query='',
+        filter_action='custom',
+        filter_query='',
         sort_action='custom',
         # sort_mode='multi',
         style_table={
@@ -129,70 +161,183 @@ def layout(**url_queries):
   return out
 
 
+def split_filter_part(filter_part):
+  """Column id, operator and value of one part of a DataTable filter
+  query, like `{Distance} s> 5`."""
+  for operator_type in FILTER_OPERATORS:
+    for operator in operator_type:
+      if operator in filter_part:
+        name_part, value_part = filter_part.split(operator, 1)
+        name = name_part[name_part.find('{') + 1: name_part.rfind('}')]
+
+        value_part = value_part.strip()
+        v0 = value_part[:1]
+        if v0 and v0 == value_part[-1] and v0 in ("'", '"', '`'):
+          value = value_part[1: -1].replace('\\' + v0, v0)
+        else:
+          try:
+            value = float(value_part)
+          except ValueError:
+            value = value_part
+
+        return name, operator_type[0].strip(), value
+
+  return [None] * 3
+
+
+def _filter_value(column_id, value):
+  """A filter value as typed into the table, in the mirror's units."""
+  if column_id == 'Distance':
+    return float(value) * units.M_PER_MI
+  elif column_id == 'Elevation':
+    return float(value) / units.FT_PER_M
+  elif column_id == 'Time':
+    # Like the table shows it (h:mm:ss or m:ss), or else minutes.
+    if isinstance(value, str) and ':' in value:
+      return units.string_to_seconds(value)
+    return float(value) * 60
+  elif column_id == 'Date':
+    return dateutil.parser.parse(str(value))
+  return value
+
+
+def filter_clause(column, column_id, operator, value):
+  """A SQL condition for one part of a DataTable filter query."""
+  if column_id in ('Sport', 'Title'):
+    if operator == 'contains':
+      return column.ilike(f'%{value}%')
+    value = str(value)
+  else:
+    value = _filter_value(column_id, value)
+
+  if column_id == 'Date' and operator in ('eq', 'datestartswith'):
+    # The whole day (or whatever was typed).
+    return (column >= value) & (column < value + datetime.timedelta(days=1))
+
+  if operator == 'eq':
+    return column == value
+  elif operator == 'ne':
+    return column != value
+  elif operator == 'lt':
+    return column < value
+  elif operator == 'le':
+    return column <= value
+  elif operator == 'gt':
+    return column > value
+  elif operator == 'ge':
+    return column >= value
+  elif operator == 'contains':
+    return column == value
+
+
+def _uses_overlap(sort_by, filter_query):
+  """Whether the table is sorted or filtered by the Overlap column."""
+  return (
+    any(sort['column_id'] == 'Overlap' for sort in sort_by or [])
+    or any(
+      split_filter_part(filter_part)[0] == 'Overlap'
+      for filter_part in (filter_query or '').split(' && ')
+    )
+  )
+
+
+def table_query(strava_id, sort_by=None, filter_query=None):
+  """The account's mirrored activities, as filtered and sorted in the
+  table, with the Saved column.
+
+  The Overlap column is only counted in SQL to sort or filter by, since
+  that means comparing every activity with every saved one. Otherwise
+  it's left for `update_table` to count on the page being shown.
+
+  Returns:
+    sqlalchemy.orm.Query: of (StravaActivitySummary, saved) rows, with
+    overlap_count on the end when it's sorted or filtered by.
+  """
+  query, saved, overlap_count = StravaActivitySummary.table_query(
+    strava_id, with_overlap_count=_uses_overlap(sort_by, filter_query))
+  columns = dict(SORT_COLUMNS)
+  if overlap_count is not None:
+    columns['Overlap'] = overlap_count
+
+  for filter_part in (filter_query or '').split(' && '):
+    column_id, operator, value = split_filter_part(filter_part)
+    if column_id not in columns:
+      continue
+    try:
+      clause = filter_clause(columns[column_id], column_id, operator, value)
+    except (TypeError, ValueError, OverflowError):
+      # Not a value this column can be filtered by (yet).
+      continue
+    if column_id == 'Overlap':
+      query = query.having(clause)
+    else:
+      query = query.filter(clause)
+
+  order_by = []
+  for sort in sort_by or []:
+    if sort['column_id'] in columns:
+      column = columns[sort['column_id']]
+      order_by.append(column.asc() if sort['direction'] == 'asc' else column.desc())
+  order_by.append(StravaActivitySummary.start_date.desc())
+
+  return query.order_by(*order_by)
+
+
 @dash.callback(
   Output('datatable-activity', 'columns'),
   Output('datatable-activity', 'data'),
+  Output('datatable-activity', 'page_count'),
   Input('datatable-activity', 'page_current'),
   Input('datatable-activity', 'page_size'),
   Input('datatable-activity', 'sort_by'),
+  Input('datatable-activity', 'filter_query'),
   State('strava-id', 'data'),
 )
-def update_table(page_current, page_size, sort_by, strava_id):
+def update_table(page_current, page_size, sort_by, filter_query, strava_id):
+  """Fill the table from the activity summary mirror.
+
+  Paging, sorting and filtering all happen in SQL, across every
+  activity, without asking Strava.
+  """
   if strava_id is None:
     raise PreventUpdate
-  
-  strava_acct = StravaAccount.query.get(strava_id)
-  
-  try:
-    activities = strava_acct.client.get_activities(limit=page_size)
-  except RateLimitExceeded as e:
-    # layout_container.children.append(html.Div(
-    print(
-      f'Strava API rate limit exceeded: '
-      f'{e.limit} requests in {e.timeout} seconds.'
-    )
-    # ))
-    # return layout_container
-    
-    raise PreventUpdate
-  
-  activities.per_page = min(page_size, 200)
-  activities._page = page_current + 1
-
-  saved_activity_id_list = [a.strava_id for a in strava_acct.activities.all()]
-  df = pd.DataFrame([
-    {
-      'Sport': activity.type,
-      'Date': activity.start_date_local,
-      'Title': f'[{activity.name}](/strava/activity/{activity.id}?id={strava_acct.strava_id})',
-      'Time': f'{units.seconds_to_string(activity.moving_time.total_seconds(), show_hour=True)}',
-      'Distance': activity.distance.to("mile").magnitude,
-      'Elevation': activity.total_elevation_gain.to("foot").magnitude,
-      'Saved': str(activity.id in saved_activity_id_list),
-      'Id': activity.id,
-      'Overlap': str(Activity.find_overlap_ids(
-        activity.start_date,
-        activity.start_date + activity.elapsed_time,
-      ))
-      # 'Map': activity.map,  # stravalib.model.Map
-    }
-    for activity in activities
-  ])
-
-  if sort_by and len(sort_by):
-    # Sort is applied
-    dfs = df.sort_values(
-      sort_by[0]['column_id'],
-      ascending=sort_by[0]['direction'] == 'asc'
-    )
-  else:
-    # No sort is applied
-    dfs = df
 
+  query = table_query(int(strava_id), sort_by, filter_query)
+  page_count = max(1, math.ceil(query.count() / page_size))
+
+  rows = query.offset(page_current * page_size).limit(page_size).all()
+  if not _uses_overlap(sort_by, filter_query):
+    overlap_counts = StravaActivitySummary.overlap_counts(
+      [activity for activity, _ in rows])
+    rows = [
+      (activity, saved, overlap_counts[activity.strava_id])
+      for activity, saved in rows
+    ]
+
+  dfs = pd.DataFrame(
+    [
+      {
+        'Sport': activity.type,
+        'Date': activity.start_date_local,
+        'Title': f'[{activity.name}](/strava/activity/{activity.strava_id}?id={strava_id})',
+        'Time': activity.moving_time_s,
+        'Distance': (activity.distance_m or 0) / units.M_PER_MI,
+        'Elevation': (activity.elevation_m or 0) * units.FT_PER_M,
+        'Saved': str(bool(saved)),
+        'Id': activity.strava_id,
+        'Overlap': overlap_count,
+      }
+      for activity, saved, overlap_count in rows
+    ],
+    columns=['Sport', 'Date', 'Title', 'Time', 'Distance', 'Elevation',
+      'Saved', 'Id', 'Overlap']
+  )
+
+  dfs['Time'] = units.seconds_to_string_series(dfs['Time'], show_hour=True)
   dfs['Distance'] = dfs['Distance'].apply(lambda float: f'{float:.2f} mi')
   dfs['Elevation'] = dfs['Elevation'].apply(lambda float: f'{float:.0f} ft')
   # eg "Sat, 12/31/2022 20:10:00"
-  dfs['Date'] = dfs['Date'].dt.strftime(date_format='%a, %m/%d/%Y %H:%M:%S')
+  dfs['Date'] = pd.to_datetime(dfs['Date']).dt.strftime(date_format='%a, %m/%d/%Y %H:%M:%S')
 
   return (
     [
@@ -201,7 +346,8 @@ def update_table(page_current, page_size, sort_by, strava_id):
       for c in dfs.columns
       if c not in ['Id', 'Saved']
     ],
-    dfs.to_dict('records')
+    dfs.to_dict('records'),
+    page_count,
   )
 
 
@@ -234,7 +380,7 @@ def save_strava_activities(
 
   if n_clicks_all:
     # call a master task that gathers all the strava activity ids
-    # then dispatches a new task for each ID.
+    # then dispatches a new task for each batch of IDs.
     tasks.async_save_all_strava_activities.delay(
       strava_account_id,
       handle_overlap=overlap_choice
@@ -244,11 +390,10 @@ def save_strava_activities(
     df = pd.DataFrame.from_records(activity_data)
     strava_ids = df.iloc[selected_rows, :]['Id'].to_list()
 
-    for strava_activity_id in strava_ids:
-      tasks.async_save_strava_activity.delay(
-        strava_account_id,
-        strava_activity_id,
-        handle_overlap=overlap_choice
-      )
+    tasks.async_save_selected_strava_activities.delay(
+      strava_account_id,
+      strava_ids,
+      handle_overlap=overlap_choice
+    )
 
   return '/settings/strava'
@@ -270,9 +270,9 @@ def create_week_cal(df_week):
       df_week['title'], 
       df_week['description'].astype(str).str.slice(0, 50) + ' ...',
       df_week['distance_m'] / units.M_PER_MI,
-      df_week['moving_time_s'].apply(units.seconds_to_string),
-      (df_week['distance_m'] / df_week['moving_time_s']).apply(units.speed_to_pace),
-      (df_week['distance_m'] / df_week['elapsed_time_s']).apply(units.speed_to_pace),
+      units.seconds_to_string_series(df_week['moving_time_s']),
+      units.speed_to_pace_series(df_week['distance_m'] / df_week['moving_time_s']),
+      units.speed_to_pace_series(df_week['distance_m'] / df_week['elapsed_time_s']),
       df_week['elevation_m'] * units.FT_PER_M,
     ])),
     hovertemplate=
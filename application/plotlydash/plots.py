@@ -36,15 +36,16 @@ class Plotter(object):
   @property
   def x_stream_text(self):
     if self._x_stream_label == 'time':
-      return self.x_stream.apply(
-        lambda seconds: units.seconds_to_string(seconds, show_hour=True))
+      return units.seconds_to_string_series(self.x_stream, show_hour=True)
     elif self._x_stream_label == 'distance':
       return self.x_stream.apply(lambda meters: f'{meters/units.M_PER_MI:.2f} mi')
     else:
       return self.x_stream.apply(lambda record: f'Point {record}')
 
-  def get_trace_text(self, stream_label, formatter):
-    if formatter is None:
+  def get_trace_text(self, stream_label, formatter, series_formatter=None):
+    if series_formatter is not None:
+      ser_y_text = series_formatter(self.df[stream_label])
+    elif formatter is None:
       ser_y_text = self.df[stream_label]
     else:
       ser_y_text = self.df[stream_label].apply(formatter)
@@ -248,12 +249,21 @@ class Plotter(object):
 
     self._fig_yaxes[fig_id].append(field_name)
 
-  def add_trace(self, fig_id, stream_label, formatter=None, **kwargs):
+  def add_trace(self, fig_id, stream_label, formatter=None,
+    series_formatter=None, **kwargs):
+    """Add a trace to an xy figure.
+
+    Args:
+      formatter (callable): formats each value for hover text.
+      series_formatter (callable): formats the whole Series at once,
+        eg `units.speed_to_pace_series`. Preferred over `formatter`
+        for long streams.
+    """
 
     trace = dict(
       x=self.x_stream,
       y=self.df[stream_label],
-      text=self.get_trace_text(stream_label, formatter),
+      text=self.get_trace_text(stream_label, formatter, series_formatter),
       name=str(stream_label),
       visible='legendonly',
       hovertemplate='%{text}',
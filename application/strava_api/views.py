@@ -1,13 +1,13 @@
 import os
 from urllib.parse import urljoin
 
-from flask import flash, redirect, render_template, request, url_for
+from flask import current_app, flash, jsonify, redirect, render_template, request, url_for
 from flask_login import login_required
 from stravalib.exc import RateLimitExceeded
 
 from application.models import db, StravaAccount
 from application.util import units
-from application import messages
+from application import messages, uploads
 from . import strava_api
 
 
@@ -139,6 +139,97 @@ def revoke():
   return redirect('/settings/strava')
 
 
+@strava_api.route('/import-export', methods=['GET', 'POST'])
+@login_required
+def import_export():
+  """Queue up the activities in a Strava bulk export ZIP for saving."""
+  from application.tasks import async_import_strava_export
+
+  if request.method == 'GET':
+    return render_template(
+      'strava_api/import_export.html',
+      strava_accounts=StravaAccount.query.all()
+    )
+
+  upload = request.files.get('file')
+  if upload is None or not upload.filename.lower().endswith('.zip'):
+    flash(
+      'Please choose the .zip file from your Strava account export.',
+      category=messages.WARNING
+    )
+    return redirect('/settings/strava')
+
+  # The worker reads the export from disk, member by member, so it goes
+  # in the upload folder every process shares. The task deletes it.
+  path = os.path.join(uploads.upload_folder(), f'{uploads.new_upload_id()}.zip')
+  upload.save(path)
+
+  async_import_strava_export.delay(
+    path,
+    strava_account_id=request.form.get('strava_acct_id', type=int)
+  )
+
+  flash(
+    f'Importing activities from {upload.filename}. They will show up in '
+    'your saved activities as they are processed.',
+    category=messages.SUCCESS
+  )
+  return redirect('/settings/strava')
+
+
+@strava_api.route('/webhook', methods=['GET', 'POST'])
+def webhook():
+  """Strava's push notifications.
+
+  A GET is Strava checking the callback URL while a subscription is
+  created: it's answered with the challenge if the verify token matches.
+
+  A POST is an event. Each new activity, or updated one that isn't
+  saved yet, is queued to be saved (see `tasks.queue_webhook_activity`),
+  and the event is answered right away, since Strava wants an answer
+  within two seconds. Edits and deletes go straight to the activity
+  summary mirror, and title edits to the saved activity.
+
+  https://developers.strava.com/docs/webhooks/
+  """
+  from application.tasks import (apply_webhook_event, queue_webhook_activity,
+    saved_strava_ids)
+
+  if request.method == 'GET':
+    verify_token = current_app.config.get('STRAVA_WEBHOOK_VERIFY_TOKEN')
+    if (
+      request.args.get('hub.mode') != 'subscribe'
+      or verify_token is None
+      or request.args.get('hub.verify_token') != verify_token
+    ):
+      return 'Invalid verification request', 403
+    return jsonify({'hub.challenge': request.args.get('hub.challenge')})
+
+  event = request.get_json(silent=True)
+  if not isinstance(event, dict):
+    return 'Invalid event', 400
+  object_id = event.get('object_id')
+  if type(object_id) is not int or object_id <= 0:
+    return 'Invalid event', 400
+
+  subscription_id = current_app.config.get('STRAVA_WEBHOOK_SUBSCRIPTION_ID')
+  if subscription_id is not None and event.get('subscription_id') != subscription_id:
+    return 'Unknown subscription', 403
+
+  if event.get('object_type') == 'activity':
+    strava_acct = StravaAccount.query.get(event.get('owner_id'))
+    # Events for accounts that aren't linked (anymore) are dropped.
+    if strava_acct is not None and strava_acct.has_authorized:
+      apply_webhook_event(strava_acct.strava_id, event)
+      aspect_type = event.get('aspect_type')
+      if aspect_type == 'create' or (
+        aspect_type == 'update' and not saved_strava_ids([object_id])
+      ):
+        queue_webhook_activity(strava_acct.strava_id, object_id)
+
+  return '', 200
+
+
 @strava_api.route('/status')
 @login_required
 def show_strava_status():
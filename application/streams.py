@@ -0,0 +1,110 @@
+"""Fetch the streams of Strava activities.
+
+What gets fetched depends on what the streams are for. Each use has a
+profile in `STREAM_PROFILES`, so nothing asks for streams (or a
+resolution) that it won't use.
+
+Fetching streams is nearly all waiting on Strava, so a worker that
+fetched them one after another spent most of its time idle. Instead,
+`fetch_activity_streams` runs each request on a thread of its own, up
+to `STRAVA_STREAM_CONCURRENCY` at a time, and each still takes its turn
+with the shared rate limiter (see `util.ratelimit`).
+"""
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+from flask import current_app
+from stravalib.exc import Fault, RateLimitExceeded
+
+from application.models import StravaAccount
+from application.util import ratelimit
+
+
+# Keyword arguments to `stravalib.Client.get_activity_streams()` for
+# each use of an activity's streams.
+STREAM_PROFILES = {
+  # Enough to draw the map, elevation and speed plots while the rest
+  # loads. Strava cuts low-resolution streams down to about 100 points.
+  'preview': dict(
+    types=['latlng', 'altitude', 'velocity_smooth'],
+    resolution='low',
+  ),
+  # What saving an activity needs for NGP and best efforts.
+  'analysis': dict(
+    types=['time', 'distance', 'velocity_smooth', 'grade_smooth'],
+  ),
+  # Everything the activity dashboards can show.
+  'full': dict(
+    types=['time', 'latlng', 'distance', 'altitude', 'velocity_smooth',
+      'heartrate', 'cadence', 'watts', 'temp', 'moving', 'grade_smooth'],
+  ),
+}
+
+
+def get_activity_streams(client, activity_id, profile='full'):
+  """Fetch one activity's streams, as its profile says.
+
+  Args:
+    client: a Strava client.
+    activity_id (int): Strava id of the activity.
+    profile (str): key of `STREAM_PROFILES`.
+  """
+  return client.get_activity_streams(activity_id, **STREAM_PROFILES[profile])
+
+
+def fetch_activity_streams(strava_acct, activity_ids, profile='analysis', concurrency=None):
+  """Fetch the streams of several activities concurrently.
+
+  Args:
+    strava_acct (StravaAccount): the account the activities belong to.
+    activity_ids (list(int)): Strava ids of the activities.
+    profile (str): key of `STREAM_PROFILES`.
+    concurrency (int): most requests at once. Defaults to the
+      `STRAVA_STREAM_CONCURRENCY` config value.
+
+  Returns:
+    tuple(dict, list): streams keyed by activity id, as returned by
+    `stravalib.Client.get_activity_streams()`, and ids of the
+    activities whose streams weren't fetched because the rate limit was
+    hit, in the order given. Activities whose streams Strava can't find
+    or won't show are in neither.
+  """
+  if not activity_ids:
+    return {}, []
+
+  concurrency = concurrency or current_app.config.get('STRAVA_STREAM_CONCURRENCY', 1)
+
+  # Work out the token, account and lane here: threads don't know
+  # about the caller's session or Celery task.
+  access_token = strava_acct.get_token()['access_token']
+  strava_id = strava_acct.strava_id
+  lane = ratelimit.current_lane()
+  app = current_app._get_current_object()
+
+  # One client per thread, since `requests.Session` isn't thread-safe.
+  clients = threading.local()
+
+  def fetch(activity_id):
+    with app.app_context():
+      if not hasattr(clients, 'client'):
+        clients.client = StravaAccount.get_client(
+          access_token=access_token, lane=lane, strava_id=strava_id)
+      return get_activity_streams(clients.client, activity_id, profile)
+
+  streams = {}
+  remaining = []
+  with ThreadPoolExecutor(max_workers=min(concurrency, len(activity_ids))) as executor:
+    futures = [
+      (activity_id, executor.submit(fetch, activity_id))
+      for activity_id in activity_ids
+    ]
+    for activity_id, future in futures:
+      try:
+        streams[activity_id] = future.result()
+      except RateLimitExceeded:
+        remaining.append(activity_id)
+      except Fault as e:
+        # Deleted or made private since it was listed, say.
+        print(f'Skipping the streams of activity {activity_id}: {e}')
+
+  return streams, remaining
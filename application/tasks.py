@@ -1,199 +1,698 @@
+import collections
+from concurrent.futures import ThreadPoolExecutor
 import datetime
-import math
+import os
+import threading
+import uuid
 
-from celery import group
+from celery import chain
+from flask import current_app
 import dateutil
-import pandas as pd
-from scipy.interpolate import interp1d
+import sqlalchemy as sa
 from sqlalchemy.exc import IntegrityError
-from stravalib.exc import RateLimitExceeded
-
-from application import celery
-from application.models import db, Activity, AdminUser, StravaAccount
-from application.util.dataframe import calc_power
-from application.util import power, readers
-
-
-def est_15_min_rate(strava_client):
-  # Whether we are rate-limited or not, we just got current info
-  # on the rate limit status.
-  rate_limit_status = strava_client.protocol.rate_limiter.rules[0].rate_limits
-
-  # Create groups of activities to be added. 
-  # Split into 15-minute waves (because of 15-min limit),
-  # but ultimately decide the rate based on the daily limit.
-  # (In the future, we can be smarter about which limit will
-  # be hit first.)
-  rate_hourly_max = min(
-    (rate_limit_status['long']['limit'] - 5) / (24 * 3),
-    (rate_limit_status['short']['limit']- 5) / (0.25 * 3)
-  )
-  
-  return math.floor(rate_hourly_max * 0.25)
+from stravalib.exc import Fault, RateLimitExceeded
 
+from application import celery, streams
+from application.models import db, Activity, StravaAccount, StravaActivitySummary
+from application.util.dataframe import calc_best_efforts, calc_ngp, calc_power
+from application.util import cache, locks, ratelimit, readers
 
-@celery.task(bind=True)
-def async_save_all_strava_activities(self, strava_account_id, handle_overlap='existing'):
-  """Master task that (hopefully) spawns a task for each activity."""
-  strava_acct = StravaAccount.query.get(strava_account_id)
-  saved_strava_activity_ids = [saved_activity.strava_id for saved_activity in strava_acct.activities.all()]
-  client = strava_acct.client
 
-  try:
-    # activity_ids = [activity.id for activity in client.get_activities()]
-    # activity_dicts = [activity.to_dict() for activity in client.get_activities()]
-    activity_ids = [
-      activity.id 
-      for activity in client.get_activities()
+# Number of activities fetched and saved together by one task.
+BATCH_SIZE = 20
+
+# Most pages of an activity listing fetched at once.
+LISTING_CONCURRENCY = 4
+
+# How long a listing's saves are waited on to move the sync cursor. If
+# they take longer, it stays put, and the next sync lists them again.
+LISTING_TTL_S = 7 * 24 * 3600
+
+# Fields of an activity that are saved, and that Strava's activity
+# listing already has.
+SUMMARY_FIELDS = ['id', 'name', 'type', 'start_date', 'start_date_local',
+  'timezone', 'moving_time', 'elapsed_time', 'distance', 'total_elevation_gain']
+
+
+def activity_summary(activity):
+  """The fields of a listed Strava activity that get saved, as a dict
+  that can be passed to a task."""
+  activity_data = activity.to_dict()
+  return {field: activity_data.get(field) for field in SUMMARY_FIELDS}
+
+
+def saved_strava_ids(strava_activity_ids=None):
+  """Strava ids of saved activities, optionally only out of those given."""
+  query = db.session.query(Activity.strava_id).filter(Activity.strava_id.isnot(None))
+  if strava_activity_ids is not None:
+    query = query.filter(Activity.strava_id.in_(strava_activity_ids))
+  return {strava_id for (strava_id,) in query}
+
+
+def _save_in_turn(strava_account_id, activity_ids, handle_overlap, summaries=None,
+                  then=None):
+  """Save activities in batches, one batch after another.
+
+  A call's batches aren't run in parallel: they would only be competing
+  for the same rate limit. Each batch takes tokens from the shared rate
+  limiter as it goes, and waits for more when it runs out (see
+  `async_save_strava_activities`). Other chains, like a webhook's or
+  another account's sync, can run at the same time, and the limiter
+  shares the limit out among them.
+
+  `summaries` (see `activity_summary`), keyed by id, go along with
+  their batch so it doesn't have to fetch them again. `then`, a task
+  signature, runs once every batch is saved, and not if one fails.
+  """
+  summaries = summaries or {}
+  tasks = [
+    async_save_strava_activities.si(
+      strava_account_id,
+      batch,
+      handle_overlap=handle_overlap,
+      summaries=[summaries[i] for i in batch if i in summaries] or None,
+    )
+    for batch in (
+      activity_ids[i:i + BATCH_SIZE]
+      for i in range(0, len(activity_ids), BATCH_SIZE)
+    )
+  ]
+  if then is not None:
+    tasks.append(then)
+  if not tasks:
+    return
+
+  return chain(tasks).delay()
+
+
+def iter_activity_pages(strava_acct, after=None, concurrency=LISTING_CONCURRENCY):
+  """List an account's activities a few pages at a time, in order.
+
+  The first page is fetched alone, since for a sync it's usually the
+  only one. If it's full, up to `concurrency` pages are fetched at once
+  after that, each still taking its turn with the rate limiter.
+
+  Args:
+    strava_acct (StravaAccount): the account to list.
+    after (datetime.datetime): only list activities that start after
+      this. All of them if None.
+    concurrency (int): most pages fetched at once.
+
+  Yields:
+    list: the activities on each page, in order, until a page that
+    isn't full.
+  """
+  def fetch(listing, page):
+    raw_results = listing.result_fetcher(page=page, per_page=listing.per_page)
+    return [
+      listing.entity.deserialize(raw, bind_client=listing.bind_client)
+      for raw in raw_results
+    ]
+
+  listing = strava_acct.client.get_activities(after=after)
+  activities = fetch(listing, 1)
+  if activities:
+    yield activities
+  if len(activities) < listing.per_page:
+    return
+
+  # Work out the token and lane here: threads don't know about the
+  # caller's session or Celery task.
+  access_token = strava_acct.get_token()['access_token']
+  strava_id = strava_acct.strava_id
+  lane = ratelimit.current_lane()
+  app = current_app._get_current_object()
+
+  # One client per thread, since `requests.Session` isn't thread-safe.
+  listings = threading.local()
+
+  def fetch_in_thread(page):
+    with app.app_context():
+      if not hasattr(listings, 'listing'):
+        listings.listing = StravaAccount.get_client(
+          access_token=access_token, lane=lane, strava_id=strava_id
+        ).get_activities(after=after)
+      return fetch(listings.listing, page)
+
+  with ThreadPoolExecutor(max_workers=concurrency) as executor:
+    pending = collections.deque(
+      executor.submit(fetch_in_thread, page) for page in range(2, 2 + concurrency))
+    next_page = 2 + concurrency
+    while pending:
+      activities = pending.popleft().result()
+      if activities:
+        yield activities
+      if len(activities) < listing.per_page:
+        # Pages still in flight are past the end.
+        for future in pending:
+          future.cancel()
+        return
+      pending.append(executor.submit(fetch_in_thread, next_page))
+      next_page += 1
+
+
+def _listing_key(strava_account_id, listing_id):
+  return f'strava-listing:{strava_account_id}:{listing_id}'
+
+
+def _count_listing_parts(key, change, synced_until=None):
+  """Add `change` to the number of a listing's parts that aren't done,
+  and note where its sync cursor goes once they all are.
+
+  The listing itself is a part until it reaches the end, and so is each
+  page's chain of saves until its last batch is saved. The count is
+  kept in the shared cache, for as long as `LISTING_TTL_S`.
+
+  Returns:
+    dict: the listing's 'pending' part count and 'synced_until'.
+  """
+  with locks.named_lock(key):
+    parts = cache.get_cache().get(key) or {'pending': 0, 'synced_until': None}
+    parts['pending'] += change
+    if synced_until is not None:
+      parts['synced_until'] = synced_until
+    if parts['pending'] > 0:
+      cache.get_cache().set(key, parts, LISTING_TTL_S)
+    else:
+      cache.get_cache().delete(key)
+  return parts
+
+
+def _finish_listing_part(strava_account_id, key, synced_until=None):
+  parts = _count_listing_parts(key, -1, synced_until=synced_until)
+  if parts['pending'] == 0 and parts['synced_until'] is not None:
+    _advance_sync_cursor(strava_account_id, parts['synced_until'])
+
+
+def _save_new_activities(strava_acct, handle_overlap, after=None):
+  """List an account's activities, and save the runs, walks and hikes
+  that aren't saved yet.
+
+  Each page's new activities are queued to be saved in batches, in
+  turn, as soon as the page arrives. Each page's chain ends by checking
+  off its part of the listing (see `_count_listing_parts`), and the
+  last part done moves the sync cursor up to the start of the latest
+  activity listed. So if a batch fails, the cursor stays put and the
+  next sync lists its activities again.
+
+  Every listed activity goes in the activity summary mirror too (see
+  `StravaActivitySummary`), since it's already here.
+
+  Args:
+    strava_acct (StravaAccount): the account to list.
+    handle_overlap (str): 'existing', 'both' or 'incoming'.
+    after (datetime.datetime): only list activities that start after
+      this. All of them if None.
+  """
+  key = _listing_key(strava_acct.strava_id, uuid.uuid4().hex)
+  # The listing is a part until it reaches the end.
+  _count_listing_parts(key, 1)
+
+  latest_start = None
+  for activities in iter_activity_pages(strava_acct, after=after):
+    StravaActivitySummary.upsert(
+      strava_acct.strava_id,
+      [activity_summary(activity) for activity in activities]
+    )
+    saved_ids = saved_strava_ids([activity.id for activity in activities])
+    summaries = {
+      activity.id: activity_summary(activity)
+      for activity in activities
       if (
         activity.type in ('Run', 'Walk', 'Hike')
-        and activity.id not in saved_strava_activity_ids
+        and activity.id not in saved_ids
+      )
+    }
+    if summaries:
+      _count_listing_parts(key, 1)
+      _save_in_turn(
+        strava_acct.strava_id,
+        list(summaries),
+        handle_overlap,
+        summaries,
+        then=async_finish_listing_part.si(strava_acct.strava_id, key),
       )
-    ]
 
-  except RateLimitExceeded:
-    # This generates retries in 1, 3, and 9 minutes.
-    self.retry(
-      countdown=60 * 3 ** self.request.retries,
-      max_retries=3,
-    )
+    page_latest_start = max(activity.start_date for activity in activities)
+    if latest_start is None or page_latest_start > latest_start:
+      latest_start = page_latest_start
 
-  num_15_max = est_15_min_rate(client)
-  for chunk_index, i in enumerate(range(0, len(activity_ids), num_15_max)):
-    activity_ids_15_min = activity_ids[i:i + num_15_max]
-    group_15_min = group(
-      async_save_strava_activity.s(
-        strava_account_id,
-        strava_activity_id,
-        handle_overlap=handle_overlap
-      )
-      for strava_activity_id in activity_ids_15_min
+  if latest_start is not None and after is None:
+    # The whole account was listed, so the mirror is complete too.
+    _advance_summaries_cursor(strava_acct, latest_start)
+
+  _finish_listing_part(
+    strava_acct.strava_id,
+    key,
+    synced_until=None if latest_start is None else int(latest_start.timestamp())
+  )
+
+
+@celery.task
+def async_finish_listing_part(strava_account_id, key):
+  """Check off a page's saves, once they're all done (see
+  `_count_listing_parts`)."""
+  _finish_listing_part(strava_account_id, key)
+
+
+def _advance_sync_cursor(strava_account_id, synced_until):
+  """Move an account's sync cursor up to `synced_until` (unix time),
+  once everything listed before it is saved."""
+  strava_acct = StravaAccount.query.get(strava_account_id)
+  if strava_acct.synced_until is None or synced_until > strava_acct.synced_until:
+    strava_acct.synced_until = synced_until
+    db.session.commit()
+
+
+def sync_after(strava_acct):
+  """Where an incremental sync of an account starts listing activities.
+
+  That's the sync cursor, or without one, the start of the account's
+  latest saved activity. None (list everything) for a new account.
+  """
+  if strava_acct.synced_until is not None:
+    return datetime.datetime.fromtimestamp(
+      strava_acct.synced_until, datetime.timezone.utc)
+
+  latest_recorded = db.session.query(sa.func.max(Activity.recorded)).filter(
+    Activity.strava_acct_id == strava_acct.strava_id).scalar()
+  if latest_recorded is not None:
+    return latest_recorded.replace(tzinfo=datetime.timezone.utc)
+
+
+def _advance_summaries_cursor(strava_acct, latest_start):
+  """Move the summary mirror's cursor up to `latest_start`, once every
+  activity before it has been listed."""
+  synced_until = int(latest_start.timestamp())
+  if (strava_acct.summaries_synced_until is None
+      or synced_until > strava_acct.summaries_synced_until):
+    strava_acct.summaries_synced_until = synced_until
+    db.session.commit()
+
+
+def sync_activity_summaries(strava_acct):
+  """Mirror the activities added to a Strava account since the mirror
+  was last listed in full (all of them, the first time).
+
+  The mirror also gets activities from webhook events and activity
+  syncs, so its latest activity doesn't mean the ones before it are
+  there too. Only a listing that reaches the end moves the cursor.
+
+  Returns:
+    int: the number of activities listed.
+  """
+  after = None
+  if strava_acct.summaries_synced_until is not None:
+    after = datetime.datetime.fromtimestamp(
+      strava_acct.summaries_synced_until, datetime.timezone.utc)
+
+  count = 0
+  latest_start = None
+  for activities in iter_activity_pages(strava_acct, after=after):
+    StravaActivitySummary.upsert(
+      strava_acct.strava_id,
+      [activity_summary(activity) for activity in activities]
     )
-    group_15_min.apply_async(countdown=15 * 60 * chunk_index)
+    count += len(activities)
+
+    page_latest_start = max(activity.start_date for activity in activities)
+    if latest_start is None or page_latest_start > latest_start:
+      latest_start = page_latest_start
+
+  if latest_start is not None:
+    _advance_summaries_cursor(strava_acct, latest_start)
+  return count
+
+
+def _summaries_synced_key(strava_account_id):
+  return f'strava-summaries-synced:{strava_account_id}'
+
+
+def sync_activity_summaries_soon(strava_account_id):
+  """Queue a sync of the activity summary mirror, unless one was
+  queued in the last `STRAVA_SUMMARY_SYNC_INTERVAL_S`.
+
+  Returns:
+    bool: whether a sync was queued.
+  """
+  key = _summaries_synced_key(strava_account_id)
+  if cache.get_cache().get(key) is not None:
+    return False
+  cache.get_cache().set(
+    key, True, current_app.config['STRAVA_SUMMARY_SYNC_INTERVAL_S'])
+  async_sync_activity_summaries.delay(strava_account_id)
+  return True
 
 
 @celery.task(bind=True)
-def async_save_selected_strava_activities(self, strava_account_id, strava_activity_ids, handle_overlap='existing'):
+def async_sync_activity_summaries(self, strava_account_id):
+  """Bring an account's activity summary mirror up to date."""
   strava_acct = StravaAccount.query.get(strava_account_id)
-  saved_strava_activity_ids = [saved_activity.strava_id for saved_activity in strava_acct.activities.all()]
 
-  run_in_parallel = group(
-    async_save_strava_activity.s(
-      strava_account_id,
-      strava_activity_id,
-      handle_overlap=handle_overlap
+  try:
+    count = sync_activity_summaries(strava_acct)
+  except RateLimitExceeded as e:
+    self.retry(
+      countdown=max(1, e.timeout or 60),
+      max_retries=None,
     )
-    for strava_activity_id in strava_activity_ids
-    if strava_activity_id not in saved_strava_activity_ids
-  )
 
-  return run_in_parallel.delay()
+  print(f'Mirrored {count} activities from Strava account {strava_account_id}.')
+
+
+def apply_webhook_event(strava_account_id, event):
+  """Apply an activity's webhook event to its mirrored summary, and to
+  the saved activity's title.
+
+  Deletes and edits to the title or type are applied as they come,
+  without asking Strava. New activities get mirrored when they're
+  saved (see `queue_webhook_activity`).
+  """
+  updates = event.get('updates') or {}
+
+  if event['aspect_type'] == 'update' and 'title' in updates:
+    Activity.query.filter_by(strava_id=event['object_id']).update(
+      {'title': updates['title']}, synchronize_session=False)
+
+  summary = StravaActivitySummary.query.filter_by(
+    strava_acct_id=strava_account_id, strava_id=event['object_id']).first()
+  if summary is not None:
+    if event['aspect_type'] == 'delete':
+      db.session.delete(summary)
+    elif event['aspect_type'] == 'update':
+      if 'title' in updates:
+        summary.name = updates['title']
+      if 'type' in updates:
+        summary.type = updates['type']
+  db.session.commit()
 
 
 @celery.task(bind=True)
-def async_save_strava_activity(self, account_id, activity_id, handle_overlap='existing'):
+def async_save_all_strava_activities(self, strava_account_id, handle_overlap='existing'):
+  """Master task that (hopefully) spawns a task for each batch of activities."""
+  strava_acct = StravaAccount.query.get(strava_account_id)
 
-  strava_acct = StravaAccount.query.get(account_id)
-  client = strava_acct.client
-  
   try:
-    activity = client.get_activity(activity_id)
-  except RateLimitExceeded:
-    # This generates retries in 3, 9, and 27 minutes.
+    _save_new_activities(strava_acct, handle_overlap)
+  except RateLimitExceeded as e:
+    # Come back once the limit has room again.
     self.retry(
-      countdown=180 * 3 ** self.request.retries,
-      max_retries=3,
+      countdown=max(1, e.timeout or 60),
+      max_retries=None,
     )
 
-  if activity.type not in ('Run', 'Walk', 'Hike'):
-    print(f"Throwing out a {activity_data['type']}")
-    return
 
-  # check for saved activity with identical strava id;
-  # if it exists, skip saving the new activity
-  if Activity.query.filter_by(strava_id=activity.id).count():
-    print(f'Saved activity with strava id {activity.id} already exists...skipping.')
-    return
+@celery.task(bind=True)
+def async_sync_strava_activities(self, strava_account_id, handle_overlap='existing'):
+  """Save the activities added to a Strava account since its last sync.
+
+  Only activities that start after the sync cursor (see `sync_after`)
+  are listed, so a sync usually costs one or two requests plus those
+  that fetch the new activities.
+  """
+  strava_acct = StravaAccount.query.get(strava_account_id)
 
-  # check for overlapping saved activities and handle accordingly
-  overlap_ids = Activity.find_overlap_ids(
-    activity.start_date,
-    activity.start_date + activity.elapsed_time
-  )
-  if len(overlap_ids):
-    print('Overlapping existing activities detected.')
-    if handle_overlap == 'existing':
-      print('Keeping existing activities; not saving incoming strava activity.')
-      return
-    elif handle_overlap == 'both':
-      print('Keeping existing activities AND saving incoming strava activity.')
-      pass
-    elif handle_overlap == 'incoming':
-      print('Deleting existing activities and saving incoming strava activity.')
-      for saved_activity_id in overlap_ids:
-        db.session.delete(Activity.query.get(saved_activity_id))
-        db.session.commit()
-  else:
-    print('No overlaps detected')
-    pass
-  
   try:
-    activity_streams = client.get_activity_streams(
-      activity_id,
-      types=['time', 'latlng', 'distance', 'altitude', 'velocity_smooth',
-          'heartrate', 'cadence', 'watts', 'temp', 'moving',
-          'grade_smooth']
-    )
-  except RateLimitExceeded:
+    _save_new_activities(strava_acct, handle_overlap, after=sync_after(strava_acct))
+  except RateLimitExceeded as e:
     self.retry(
-      countdown=180 * 3 ** self.request.retries,
-      max_retries=3,
+      countdown=max(1, e.timeout or 60),
+      max_retries=None,
     )
 
-  intensity_factor = None
-  tss = None
+
+@celery.task
+def async_sync_all_strava_accounts(handle_overlap='existing'):
+  """Sync every linked Strava account. Run periodically by celery beat
+  (see `config.Config.CELERYBEAT_SCHEDULE`)."""
+  for strava_acct in StravaAccount.query.all():
+    if strava_acct.has_authorized:
+      async_sync_strava_activities.delay(
+        strava_acct.strava_id, handle_overlap=handle_overlap)
+
+
+def _webhook_queue_key(strava_account_id):
+  return f'strava-webhook:{strava_account_id}'
+
+
+def queue_webhook_activity(strava_account_id, activity_id):
+  """Queue an activity from a webhook event to be saved shortly.
+
+  Ids wait in the shared cache, and the first one in schedules
+  `async_save_webhook_activities` to save them all a little later
+  (`STRAVA_WEBHOOK_DELAY_S`). So a burst of events, like an upload
+  followed by a few edits, or Strava redelivering an event, costs one
+  import of each activity.
+
+  Returns:
+    bool: whether the activity wasn't already queued.
+  """
+  key = _webhook_queue_key(strava_account_id)
+  delay_s = current_app.config['STRAVA_WEBHOOK_DELAY_S']
+
+  with locks.named_lock(key):
+    queued = cache.get_cache().get(key)
+    if queued is not None and activity_id in queued:
+      return False
+    # Kept well past the save, in case the worker is backed up. If the
+    # save never happens, the next event after they expire starts over.
+    cache.get_cache().set(key, (queued or []) + [activity_id], delay_s + 3600)
+
+  if queued is None:
+    async_save_webhook_activities.apply_async(
+      (strava_account_id,), countdown=delay_s)
+  return True
+
+
+@celery.task
+def async_save_webhook_activities(strava_account_id, handle_overlap='existing'):
+  """Save the activities queued by `queue_webhook_activity`.
+
+  Activities that are already saved are skipped, so an update to one
+  costs nothing.
+  """
+  key = _webhook_queue_key(strava_account_id)
+  with locks.named_lock(key):
+    activity_ids = cache.get_cache().get(key) or []
+    cache.get_cache().delete(key)
+
+  saved_ids = saved_strava_ids(activity_ids)
+  return _save_in_turn(
+    strava_account_id,
+    [activity_id for activity_id in activity_ids if activity_id not in saved_ids],
+    handle_overlap
+  )
+
+
+@celery.task(bind=True)
+def async_save_selected_strava_activities(self, strava_account_id, strava_activity_ids, handle_overlap='existing'):
+  saved_strava_activity_ids = saved_strava_ids(strava_activity_ids)
+
+  return _save_in_turn(
+    strava_account_id,
+    [
+      strava_activity_id for strava_activity_id in strava_activity_ids
+      if strava_activity_id not in saved_strava_activity_ids
+    ],
+    handle_overlap
+  )
+
+
+def _strava_activity_row(activity_data, activity_streams, strava_acct_id):
+  """Values for an `Activity` row (plus 'best_efforts') from Strava data.
+
+  `activity_data` is a summary (see `activity_summary`) or a whole
+  activity as a dict.
+  """
+  ngp_scalar = None
+  best_efforts = {}
 
   if activity_streams:
     df = readers.from_strava_streams(activity_streams)
     calc_power(df)
+    best_efforts = calc_best_efforts(df)
 
     if 'NGP' in df.columns:
-      # Resample the NGP stream at 1 sec intervals
-      # TODO: Figure out how/where to make this repeatable.
-      # 1sec even samples make the math so much easier.
-      interp_fn = interp1d(df['time'], df['NGP'], kind='linear')
-      ngp_1sec = interp_fn([i for i in range(df['time'].max())])
-
-      # Apply a 30-sec rolling average.
-      window = 30
-      ngp_rolling = pd.Series(ngp_1sec).rolling(window).mean()          
-      ngp_scalar = power.lactate_norm(ngp_rolling[29:])
-
-      total_seconds = df['time'].iloc[-1] - df['time'].iloc[0]
-
-      tss = power.training_stress_score(
-        ngp_scalar, AdminUser().settings.ftp_ms, total_seconds)
+      ngp_scalar = calc_ngp(df)
     elif 'speed' in df.columns:
       # TODO: Add capabilities for flat-ground TSS.
       pass
 
-  activity_data = activity.to_dict()
-
-  db.session.add(Activity(
+  return dict(
     title=activity_data['name'],
-    description=activity_data['description'],
-    created=datetime.datetime.utcnow(),  
-    recorded=dateutil.parser.isoparse(activity_data['start_date']),
+    description=activity_data.get('description'),
+    recorded=dateutil.parser.isoparse(activity_data['start_date'])
+      .astimezone(datetime.timezone.utc).replace(tzinfo=None),
     tz_local=activity_data['timezone'],
     moving_time_s=activity_data['moving_time'],
     elapsed_time_s=activity_data['elapsed_time'],
     # Fields below here not required
     strava_id=activity_data['id'],
-    strava_acct_id=strava_acct.strava_id,
+    strava_acct_id=strava_acct_id,
     distance_m=activity_data['distance'],
     elevation_m=activity_data['total_elevation_gain'],
-    intensity_factor=intensity_factor,
-    tss=tss,
-  ))
+    ngp_ms=ngp_scalar,
+    best_efforts=best_efforts,
+  )
 
-  db.session.commit()
+
+def save_strava_activities(strava_acct, activity_ids, handle_overlap='existing', summaries=None):
+  """Fetch activities from Strava and save them in one transaction.
+
+  Already-saved activities are found with one query, overlaps with one
+  sweep (see `Activity.resolve_overlaps`), and the new activities and
+  their best efforts go in with one bulk insert each.
+
+  An activity with a summary only needs its streams fetched. The rest
+  are fetched whole first, as are all of them when
+  `STRAVA_IMPORT_DESCRIPTIONS` is set (summaries have no description).
+
+  Args:
+    strava_acct (StravaAccount): the account the activities belong to.
+    activity_ids (list(int)): Strava ids of the activities.
+    handle_overlap (str): 'existing', 'both' or 'incoming'.
+    summaries (list(dict)): summaries of some or all of the
+      activities, from `activity_summary`.
+
+  Returns:
+    list(int): ids of activities that weren't fetched because the
+    Strava rate limit was hit. The rest are saved either way, except
+    those Strava can't find or won't show, which are skipped.
+  """
+  from application import importer
+
+  saved_ids = saved_strava_ids(activity_ids)
+  remaining = [
+    activity_id for activity_id in dict.fromkeys(activity_ids)
+    if activity_id not in saved_ids
+  ]
+  if len(remaining) < len(activity_ids):
+    print(f'Skipping {len(activity_ids) - len(remaining)} saved activities.')
+
+  if current_app.config.get('STRAVA_IMPORT_DESCRIPTIONS'):
+    summaries = None
+  summaries = {summary['id']: summary for summary in summaries or []}
+
+  client = strava_acct.client
+  activity_data = {}
+  missing_ids = set()
+  for activity_id in remaining:
+    try:
+      data = summaries.get(activity_id) or client.get_activity(activity_id).to_dict()
+    except RateLimitExceeded:
+      break
+    except Fault as e:
+      # Deleted or made private since it was listed, say.
+      print(f'Skipping activity {activity_id}: {e}')
+      missing_ids.add(activity_id)
+      continue
+    activity_data[activity_id] = data
+    if data['type'] not in ('Run', 'Walk', 'Hike'):
+      print(f'Throwing out a {data["type"]}')
+
+  # Activities that came from a webhook aren't mirrored yet.
+  StravaActivitySummary.upsert(strava_acct.strava_id, activity_data.values())
+
+  # The streams of the whole batch are fetched at once.
+  activity_streams, rate_limited_ids = streams.fetch_activity_streams(
+    strava_acct,
+    [
+      activity_id for activity_id, data in activity_data.items()
+      if data['type'] in ('Run', 'Walk', 'Hike')
+    ],
+    profile='analysis'
+  )
+  rows = [
+    _strava_activity_row(activity_data[activity_id], activity_streams[activity_id], strava_acct.strava_id)
+    for activity_id in activity_data
+    if activity_id in activity_streams
+  ]
+  remaining = [
+    activity_id for activity_id in remaining
+    if activity_id in rate_limited_ids
+    or (activity_id not in activity_data and activity_id not in missing_ids)
+  ]
+
+  keep = Activity.resolve_overlaps(
+    [
+      (row['recorded'], row['recorded'] + datetime.timedelta(seconds=row['elapsed_time_s']))
+      for row in rows
+    ],
+    handle_overlap=handle_overlap
+  )
+  importer.save_activity_batch(
+    [row for row, keep_row in zip(rows, keep) if keep_row],
+    key='strava_id'
+  )
+
+  return remaining
+
+
+def _rate_limit_countdown(cost=2):
+  """Seconds until tasks can make the requests for another activity:
+  2, or just 1 for the streams when there's a summary.
+
+  Retrying then, rather than after a guess, keeps tasks from piling up
+  retries against the rate limit.
+  """
+  return max(
+    1,
+    ratelimit.get_rate_limiter().seconds_until_available(cost, lane=ratelimit.BACKGROUND)
+  )
+
+
+@celery.task(bind=True)
+def async_save_strava_activities(self, account_id, activity_ids, handle_overlap='existing', summaries=None):
+  """Save a batch of Strava activities, retrying any the rate limit
+  kept from being fetched.
+
+  `summaries` from the activity listing spare a request per activity
+  (see `save_strava_activities`).
+  """
+  strava_acct = StravaAccount.query.get(account_id)
+
+  try:
+    remaining = save_strava_activities(
+      strava_acct, activity_ids, handle_overlap, summaries=summaries)
+  except IntegrityError:
+    # Another task saved one of these activities first. On the retry,
+    # it is skipped.
+    db.session.rollback()
+    remaining = activity_ids
+
+  if remaining:
+    summaries = [
+      summary for summary in summaries or [] if summary['id'] in remaining]
+    self.retry(
+      args=(account_id, remaining),
+      kwargs=dict(handle_overlap=handle_overlap, summaries=summaries or None),
+      countdown=_rate_limit_countdown(1 if summaries else 2),
+      max_retries=None,
+    )
+
+
+@celery.task(bind=True)
+def async_save_strava_activity(self, account_id, activity_id, handle_overlap='existing'):
+  strava_acct = StravaAccount.query.get(account_id)
+
+  if save_strava_activities(strava_acct, [activity_id], handle_overlap):
+    self.retry(
+      countdown=_rate_limit_countdown(),
+      max_retries=None,
+    )
+
+
+@celery.task
+def async_import_strava_export(path, strava_account_id=None):
+  """Save the activities in an uploaded Strava bulk export, then delete it."""
+  from application import importer
+
+  try:
+    stats = importer.import_strava_export(path, strava_acct_id=strava_account_id)
+  finally:
+    os.remove(path)
+
+  print(
+    f'Imported {stats["imported"]} activities from Strava export, '
+    f'skipped {stats["skipped"]}, {stats["failed"]} failed.'
+  )
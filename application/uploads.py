@@ -0,0 +1,326 @@
+"""Temporary storage for uploaded activity files.
+
+Uploads are spooled to disk under `UPLOAD_FOLDER`, in chunks if the
+client sends them that way. Afterward they are referred to by a
+handle, so file contents never have to pass through Dash callbacks.
+
+Uploaded files are parsed on a pool of worker processes, so several can
+be parsed at once without tying up the web worker. Each parsed
+DataFrame is written to a cache under `UPLOAD_CACHE_FOLDER`, keyed by a
+hash of the file's contents, for the page to pick up. A file that has
+been uploaded before is never parsed again.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import os
+import re
+import shutil
+import time
+import uuid
+
+from flask import current_app
+import numpy as np
+import pandas as pd
+
+from application.util import labels  # registers `DataFrame.fld`
+from application.util import readers
+from application.util.dataframe import calc_power, calc_summary
+
+
+UPLOAD_EXTENSIONS = ('.fit', '.tcx', '.gpx', '.csv')
+
+_UPLOAD_ID = re.compile(r'^[0-9a-f]{32}$')
+_HANDLE = re.compile(r'^[0-9a-f]{32}\.(fit|tcx|gpx|csv)$')
+_KEY = re.compile(r'^[0-9a-f]{64}$')
+
+
+def upload_folder():
+  folder = current_app.config['UPLOAD_FOLDER']
+  os.makedirs(folder, exist_ok=True)
+  return folder
+
+
+def new_upload_id():
+  return uuid.uuid4().hex
+
+
+def check_filename(filename):
+  """Raise ValueError unless the file is a type that can be uploaded."""
+  if os.path.splitext(filename or '')[1].lower() not in UPLOAD_EXTENSIONS:
+    raise ValueError(
+      f'{filename} does not seem to be a file type that is accepted '
+      'at this time (.fit, .tcx, .gpx, .csv)'
+    )
+
+
+def _part_path(upload_id):
+  if not _UPLOAD_ID.match(upload_id or ''):
+    raise ValueError(f'Invalid upload id: {upload_id!r}')
+  return os.path.join(upload_folder(), f'{upload_id}.part')
+
+
+def write_chunk(upload_id, stream, offset=0):
+  """Write one chunk of an upload to disk, at its offset in the file.
+
+  Writing at an offset means a chunk that gets sent twice (eg on a
+  retry) doesn't corrupt the file.
+
+  Args:
+    upload_id (str): from `new_upload_id`, the same for every chunk.
+    stream (file-like object): the chunk's contents.
+    offset (int): where the chunk starts in the file, in bytes.
+
+  Returns:
+    int: where the chunk ends in the file, in bytes.
+  """
+  path = _part_path(upload_id)
+  with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+    f.seek(offset)
+    shutil.copyfileobj(stream, f)
+    return f.tell()
+
+
+def finish_upload(upload_id, filename):
+  """Mark an upload complete once its last chunk is written.
+
+  Returns:
+    str: the handle used to find the file with `path_for`.
+  """
+  check_filename(filename)
+  handle = upload_id + os.path.splitext(filename)[1].lower()
+  os.replace(_part_path(upload_id), os.path.join(upload_folder(), handle))
+
+  remove_stale_uploads()
+
+  return handle
+
+
+def path_for(handle):
+  """Path to the uploaded file with a handle from `finish_upload`.
+
+  Raises:
+    ValueError: if the handle isn't one `finish_upload` would make.
+    FileNotFoundError: if the file is gone (eg removed as stale).
+  """
+  if not _HANDLE.match(handle or ''):
+    raise ValueError(f'Invalid upload handle: {handle!r}')
+
+  path = os.path.join(upload_folder(), handle)
+  if not os.path.exists(path):
+    raise FileNotFoundError(f'Upload {handle} is no longer available')
+
+  return path
+
+
+def remove_stale_uploads(max_age_s=None):
+  """Delete uploads, finished or not, older than `UPLOAD_MAX_AGE_S`."""
+  if max_age_s is None:
+    max_age_s = current_app.config['UPLOAD_MAX_AGE_S']
+
+  cutoff = time.time() - max_age_s
+  with os.scandir(upload_folder()) as entries:
+    for entry in entries:
+      if entry.is_file() and entry.stat().st_mtime < cutoff:
+        try:
+          os.remove(entry.path)
+        except FileNotFoundError:
+          pass
+
+
+def read_upload(path, filename):
+  """Read an uploaded file straight from disk into a DataFrame.
+
+  FIT files are memory-mapped rather than read into memory.
+  """
+  check_filename(filename)
+  ext = os.path.splitext(filename)[1].lower()
+
+  if ext == '.csv':
+    return pd.read_csv(path)
+
+  return readers.ACTIVITY_FILE_READERS[ext](path)[0]
+
+
+_executor = None
+
+
+def _get_executor():
+  """The pool that parses uploads, started the first time it's needed."""
+  global _executor
+  if _executor is None:
+    _executor = ProcessPoolExecutor(
+      max_workers=current_app.config.get('UPLOAD_WORKERS'))
+  return _executor
+
+
+def content_hash(path):
+  """SHA-256 hex digest of a file's contents, read a chunk at a time."""
+  digest = hashlib.sha256()
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(1024 * 1024), b''):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+
+def cache_folder():
+  folder = current_app.config['UPLOAD_CACHE_FOLDER']
+  os.makedirs(folder, exist_ok=True)
+  return folder
+
+
+def _check_key(key):
+  if not _KEY.match(key or ''):
+    raise ValueError(f'Invalid parsed upload key: {key!r}')
+
+
+def _cache_path(key):
+  _check_key(key)
+  return os.path.join(cache_folder(), f'{key}.npz')
+
+
+def _error_path(key):
+  _check_key(key)
+  return os.path.join(upload_folder(), f'{key}.error')
+
+
+def write_frame(path, df):
+  """Save a DataFrame's columns as arrays in an uncompressed .npz file.
+
+  Each column is stored on its own, so reading one back is a straight
+  copy with no parsing. The index is not kept. The file is written
+  under a temporary name and then renamed, so it's never seen
+  half-written.
+
+  Text columns (eg from a CSV) are stored as fixed-width strings, so
+  the file can be read without unpickling anything. Missing values in
+  them come back as ''.
+  """
+  arrays = {}
+  for col in df.columns:
+    if df[col].dtype == object:
+      arrays[col] = df[col].fillna('').to_numpy(dtype=str)
+    else:
+      arrays[col] = df[col].to_numpy()
+
+  tmp_path = f'{path}.{os.getpid()}.tmp'
+  with open(tmp_path, 'wb') as f:
+    np.savez(f, **arrays)
+  os.replace(tmp_path, path)
+
+
+def read_frame(path):
+  """Read a DataFrame saved with `write_frame`."""
+  with np.load(path, allow_pickle=False) as npz:
+    return pd.DataFrame({col: npz[col] for col in npz.files})
+
+
+def _parse_to_cache(path, filename, cache_path, error_path):
+  """Worker: parse an upload and write the DataFrame (or error) to disk.
+
+  A file that can't be totaled (with no times, say) is an error too,
+  rather than a result the page can't show.
+  """
+  try:
+    df = read_upload(path, filename)
+    calc_power(df)
+    calc_summary(df)
+    write_frame(cache_path, df)
+  except Exception as e:
+    with open(error_path + '.tmp', 'w') as f:
+      f.write(f'{filename}: {e}')
+    os.replace(error_path + '.tmp', error_path)
+
+
+def start_parsing(files):
+  """Start parsing uploaded files in the background, all at once.
+
+  Files whose contents are already in the cache are not parsed again.
+
+  Args:
+    files (list(dict)): 'handle' (from `finish_upload`) and 'filename'
+      of each file.
+
+  Returns:
+    list(dict): `files`, each with the 'key' to pass `parsed_result`.
+
+  Raises:
+    ValueError, FileNotFoundError: as for `path_for`, before anything
+      is started.
+  """
+  files = [
+    dict(f, key=content_hash(path_for(f['handle'])))
+    for f in files
+  ]
+
+  evict_cached_frames()
+
+  started = set()
+  for f in files:
+    cache_path = _cache_path(f['key'])
+    if os.path.exists(cache_path):
+      # Counts as a use, for eviction.
+      os.utime(cache_path)
+    elif f['key'] not in started:
+      started.add(f['key'])
+      # Give a file that failed before another try.
+      if os.path.exists(_error_path(f['key'])):
+        os.remove(_error_path(f['key']))
+      _get_executor().submit(
+        _parse_to_cache,
+        path_for(f['handle']),
+        f['filename'],
+        cache_path,
+        _error_path(f['key'])
+      )
+
+  return files
+
+
+def parsed_result(key):
+  """The DataFrame parsed from an upload by `start_parsing`.
+
+  Args:
+    key (str): the file's 'key' from `start_parsing`.
+
+  Returns:
+    pandas.DataFrame: the file's records, with power columns added, or
+    None if the file hasn't been parsed yet.
+
+  Raises:
+    ValueError: if the file couldn't be parsed, or the key isn't one
+      `start_parsing` would make.
+  """
+  path = _cache_path(key)
+  if os.path.exists(path):
+    return read_frame(path)
+
+  if os.path.exists(_error_path(key)):
+    with open(_error_path(key)) as f:
+      raise ValueError(f.read())
+
+
+def evict_cached_frames(max_bytes=None, max_age_s=None):
+  """Remove parsed uploads that are too old, then the least recently
+  used until the cache fits in `UPLOAD_CACHE_MAX_BYTES`."""
+  if max_bytes is None:
+    max_bytes = current_app.config['UPLOAD_CACHE_MAX_BYTES']
+  if max_age_s is None:
+    max_age_s = current_app.config['UPLOAD_CACHE_MAX_AGE_S']
+
+  cutoff = time.time() - max_age_s
+  entries = []
+  with os.scandir(cache_folder()) as it:
+    for entry in it:
+      if entry.is_file() and entry.name.endswith('.npz'):
+        stat = entry.stat()
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+  total_bytes = sum(size for _, size, _ in entries)
+  for mtime, size, path in sorted(entries):
+    if mtime >= cutoff and total_bytes <= max_bytes:
+      break
+    try:
+      os.remove(path)
+    except FileNotFoundError:
+      pass
+    total_bytes -= size
@@ -0,0 +1,96 @@
+"""A small cache with expiring entries, shared by every process.
+
+Meant for things that are slow to get from Strava and fine to show a
+little stale, like athlete profiles. Values must be JSON-serializable.
+
+Entries live in Redis when `CACHE_REDIS_URL` is set, and in the
+`cache_entry` table otherwise.
+"""
+from importlib import import_module
+import json
+import time
+
+from flask import current_app
+
+from application import db
+
+
+class DatabaseCache(object):
+  """Keeps entries in `CacheEntry` rows.
+
+  Each write runs in its own transaction on its own connection, so it
+  never commits (or waits on) the caller's session.
+  """
+
+  def __init__(self, clock=time.time):
+    self.clock = clock
+
+  def _table(self):
+    from application.models import CacheEntry
+    return CacheEntry.__table__
+
+  def get(self, key):
+    table = self._table()
+    with db.engine.connect() as conn:
+      row = conn.execute(
+        table.select().where(table.c.key == key)
+      ).one_or_none()
+    if row is None or row.expires <= self.clock():
+      return None
+    return json.loads(row.value)
+
+  def set(self, key, value, ttl_s):
+    table = self._table()
+    row = dict(key=key, value=json.dumps(value), expires=self.clock() + ttl_s)
+    with db.engine.begin() as conn:
+      conn.execute(table.delete().where(table.c.expires <= self.clock()))
+
+      # Another process may be setting the same key, so replace it in
+      # one statement where the database can.
+      dialect = conn.dialect.name
+      if dialect in ('postgresql', 'sqlite'):
+        stmt = import_module(f'sqlalchemy.dialects.{dialect}').insert(table)
+        conn.execute(stmt.values(**row).on_conflict_do_update(
+          index_elements=[table.c.key],
+          set_={'value': stmt.excluded.value, 'expires': stmt.excluded.expires}
+        ))
+      else:
+        conn.execute(table.delete().where(table.c.key == key))
+        conn.execute(table.insert().values(**row))
+
+  def delete(self, key):
+    table = self._table()
+    with db.engine.begin() as conn:
+      conn.execute(table.delete().where(table.c.key == key))
+
+
+class RedisCache(object):
+  """Keeps entries in Redis, which expires them itself."""
+
+  KEY_PREFIX = 'cache:'
+
+  def __init__(self, url):
+    import redis
+
+    self.redis = redis.Redis.from_url(url)
+
+  def get(self, key):
+    value = self.redis.get(self.KEY_PREFIX + key)
+    return None if value is None else json.loads(value)
+
+  def set(self, key, value, ttl_s):
+    self.redis.set(
+      self.KEY_PREFIX + key, json.dumps(value), px=max(1, int(ttl_s * 1000)))
+
+  def delete(self, key):
+    self.redis.delete(self.KEY_PREFIX + key)
+
+
+def get_cache():
+  """The cache for the current app, made the first time it's needed."""
+  cache = current_app.extensions.get('shared_cache')
+  if cache is None:
+    redis_url = current_app.config.get('CACHE_REDIS_URL')
+    cache = RedisCache(redis_url) if redis_url else DatabaseCache()
+    current_app.extensions['shared_cache'] = cache
+  return cache
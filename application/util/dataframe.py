@@ -1,11 +1,47 @@
 import datetime
 
 from dateutil import tz
+import numpy as np
 import pandas as pd
 from specialsauce.sources import minetti, strava, trainingpeaks
 
 from application.plotlydash.figure_layout import GRADE, SPEED
-from application.util.power import training_stress_score
+from application.util.power import lactate_norm, training_stress_score
+from application.util.readers import DISTANCE, ELEVATION, LAT, LON, MOVING, TIME
+from application.util.units import M_PER_MI
+
+
+# Mean radius of the Earth, in meters.
+EARTH_RADIUS_M = 6371008.8
+
+# Standard distances (in meters) whose fastest efforts are indexed
+# whenever an activity is saved.
+BEST_EFFORT_DISTANCES = {
+  '400m': 400.0,
+  '1 mile': M_PER_MI,
+  '5k': 5000.0,
+  '10k': 10000.0,
+  'Half-Marathon': 21097.5,
+}
+
+
+def calc_distance(df):
+  """Add a distance column from lat/lon, if the DataFrame lacks one.
+
+  GPX files only record positions. Distance is summed along great
+  circles between consecutive positions, skipping records without one.
+  """
+  if DISTANCE in df.columns or not df.fld.has(LAT, LON):
+    return
+
+  positions = df[[LAT, LON]].ffill().bfill().to_numpy(dtype='float64')
+  lat, lon = np.radians(positions[:, 0]), np.radians(positions[:, 1])
+  a = (
+    np.sin(np.diff(lat) / 2) ** 2
+    + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lon) / 2) ** 2
+  )
+  steps = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+  df[DISTANCE] = np.concatenate([[0.0], np.cumsum(np.nan_to_num(steps))])
 
 
 def calc_power(df):
@@ -16,6 +52,124 @@ def calc_power(df):
     df['GAP'] = df[SPEED] * strava.gap_speed_factor(df[GRADE]/100)
 
 
+def calc_best_efforts(df, distances=None):
+  """Find the fastest segment of the activity for each target distance.
+
+  Each segment ends on a record and starts at a point interpolated
+  between records, so it covers exactly the target distance. Distance
+  is treated as non-decreasing, which lets a single forward sweep find
+  the start of every segment (a two-pointer sweep, done here with
+  `numpy.searchsorted`).
+
+  Args:
+    df (pandas.DataFrame): each row represents a record. 'time' and
+      'distance' columns are required; otherwise there is nothing to do.
+    distances (iterable(float)): target distances in meters. Defaults
+      to the values of `BEST_EFFORT_DISTANCES`.
+
+  Returns:
+    dict: elapsed seconds of the fastest segment, keyed by target
+    distance in meters. Distances longer than the activity are left out.
+  """
+  if TIME not in df.columns or DISTANCE not in df.columns:
+    return {}
+
+  if distances is None:
+    distances = BEST_EFFORT_DISTANCES.values()
+
+  df_valid = df[[TIME, DISTANCE]].dropna()
+  time = df_valid[TIME].to_numpy(dtype='float64')
+  # GPS blips can make distance dip momentarily; don't let them.
+  distance = np.maximum.accumulate(df_valid[DISTANCE].to_numpy(dtype='float64'))
+
+  efforts = {}
+  for target in distances:
+    ends = np.flatnonzero(distance - distance[0] >= target) if len(distance) else []
+    if not len(ends):
+      continue
+
+    # The last record at least `target` meters before each segment end.
+    starts = np.searchsorted(distance, distance[ends] - target, side='right') - 1
+
+    d_0, d_1 = distance[starts], distance[starts + 1]
+    t_0, t_1 = time[starts], time[starts + 1]
+    frac = np.divide(
+      distance[ends] - target - d_0,
+      d_1 - d_0,
+      out=np.zeros(len(ends)),
+      where=d_1 > d_0
+    )
+
+    elapsed = time[ends] - (t_0 + frac * (t_1 - t_0))
+    efforts[target] = float(elapsed.min())
+
+  return efforts
+
+
+def calc_ngp(df):
+  """Normalized graded pace of the activity, in m/s.
+
+  Falls back to plain speed when there is no 'NGP' column (eg files
+  without grade), like the stats on the analyze-file page.
+
+  Returns:
+    float: the lactate norm of the 30-second rolling average of the
+    1-second resampled NGP stream, or None if there isn't enough data.
+  """
+  col = 'NGP' if 'NGP' in df.columns else SPEED
+  if col not in df.columns:
+    return None
+
+  df_valid = df[[TIME, col]].dropna()
+  if not len(df_valid) or df_valid[TIME].iloc[-1] - df_valid[TIME].iloc[0] < 30:
+    return None
+
+  # Resample at 1 sec intervals, which makes the math so much easier.
+  time_1sec = np.arange(df_valid[TIME].iloc[0], df_valid[TIME].iloc[-1] + 1)
+  ngp_1sec = np.interp(time_1sec, df_valid[TIME], df_valid[col])
+
+  # Apply a 30-sec rolling average.
+  ngp_rolling = pd.Series(ngp_1sec).rolling(30).mean()
+
+  return float(lactate_norm(ngp_rolling[29:]))
+
+
+def calc_summary(df):
+  """Summarize an activity's records with the fields `Activity` saves.
+
+  Args:
+    df (pandas.DataFrame): each row represents a record. A 'time'
+      column is required.
+
+  Returns:
+    dict: `elapsed_time_s`, `moving_time_s`, `distance_m`,
+    `elevation_m` and `ngp_ms`. The last three are None when the data
+    to calculate them isn't there.
+  """
+  elapsed_time_s = int(df[TIME].iloc[-1] - df[TIME].iloc[0])
+
+  # Count time if the user was moving at the START of the interval.
+  moving_time_s = elapsed_time_s
+  if MOVING in df.columns:
+    moving_time_s = int(df[TIME].diff(1)[df[MOVING].shift(1, fill_value=False)].sum())
+
+  distance_m = None
+  if DISTANCE in df.columns and df[DISTANCE].notna().any():
+    distance_m = float(df[DISTANCE].max() - df[DISTANCE].min())
+
+  elevation_m = None
+  if ELEVATION in df.columns and df[ELEVATION].notna().any():
+    elevation_m = int(round(df[ELEVATION].dropna().diff(1).clip(lower=0).sum()))
+
+  return dict(
+    elapsed_time_s=elapsed_time_s,
+    moving_time_s=moving_time_s,
+    distance_m=distance_m,
+    elevation_m=elevation_m,
+    ngp_ms=calc_ngp(df),
+  )
+
+
 def calc_ctl_atl(df, ftp):
   """Add power-related columns to the DataFrame.
   
@@ -0,0 +1,262 @@
+"""A fast, minimal decoder for the FIT messages this app reads.
+
+`fitparse` turns every field of every message into Python objects,
+which is slow for long activities. Here, only the message headers are
+walked in Python. The fields of `record` and `event` messages are then
+pulled out of the file in bulk with NumPy, using a structured dtype
+built once per definition message.
+
+Files using features this decoder doesn't handle (compressed timestamp
+headers, chained files) raise `FitDecodeError`, so callers can fall
+back to fitparse. The file CRC is not checked.
+
+FIT protocol reference:
+https://developer.garmin.com/fit/protocol/
+"""
+import numpy as np
+
+
+# Global message numbers, from the FIT profile.
+MESG_NUMS = {
+  'record': 20,
+  'event': 21,
+}
+
+# FIT base type number: (NumPy dtype, invalid value).
+BASE_TYPES = {
+  0x00: ('u1', 0xFF),  # enum
+  0x01: ('i1', 0x7F),
+  0x02: ('u1', 0xFF),
+  0x83: ('i2', 0x7FFF),
+  0x84: ('u2', 0xFFFF),
+  0x85: ('i4', 0x7FFFFFFF),
+  0x86: ('u4', 0xFFFFFFFF),
+  0x88: ('f4', None),  # invalid is a NaN bit pattern
+  0x89: ('f8', None),
+  0x0A: ('u1', 0x00),  # uint8z
+  0x8B: ('u2', 0x0000),  # uint16z
+  0x8C: ('u4', 0x00000000),  # uint32z
+  0x8E: ('i8', 0x7FFFFFFFFFFFFFFF),
+  0x8F: ('u8', 0xFFFFFFFFFFFFFFFF),
+  0x90: ('u8', 0x0000000000000000),  # uint64z
+}
+
+SEMICIRCLES_PER_DEGREE = 2 ** 31 / 180
+
+# FIT timestamps count seconds from 1989-12-31T00:00:00Z.
+FIT_EPOCH_S = 631065600
+
+# Fields decoded from each message, by field definition number:
+# (fitparse name, scale, offset). Values are `raw / scale - offset`,
+# as in the FIT profile.
+MESG_FIELDS = {
+  'record': {
+    253: ('timestamp', 1, 0),
+    0: ('position_lat', SEMICIRCLES_PER_DEGREE, 0),
+    1: ('position_long', SEMICIRCLES_PER_DEGREE, 0),
+    5: ('distance', 100, 0),
+    2: ('altitude', 5, 500),
+    78: ('enhanced_altitude', 5, 500),
+    6: ('speed', 1000, 0),
+    73: ('enhanced_speed', 1000, 0),
+    3: ('heart_rate', 1, 0),
+    4: ('cadence', 1, 0),
+    53: ('fractional_cadence', 128, 0),
+    7: ('power', 1, 0),
+    13: ('temperature', 1, 0),
+  },
+  'event': {
+    253: ('timestamp', 1, 0),
+    0: ('event', 1, 0),
+    1: ('event_type', 1, 0),
+  },
+}
+
+
+class FitDecodeError(Exception):
+  """Raised when a file can't be decoded here."""
+
+
+class _Layout(object):
+  """Where a message's decoded fields sit within its data messages.
+
+  One is built for each definition message of a message type we decode.
+  Offsets of the data messages that use it are collected as the file is
+  walked, then all of them are decoded at once.
+  """
+  def __init__(self, mesg_name, field_defs, big_endian, size):
+    self.mesg_name = mesg_name
+    self.size = size
+    self.offsets = []
+
+    byteorder = '>' if big_endian else '<'
+    wanted = MESG_FIELDS[mesg_name]
+    self.invalid = {}
+    names, formats, field_offsets = [], [], []
+    pos = 0
+    for i in range(0, len(field_defs), 3):
+      num, field_size, base_type = field_defs[i:i + 3]
+      fmt = BASE_TYPES.get(base_type)
+      if (
+        num in wanted
+        and num not in self.invalid
+        and fmt is not None
+        and np.dtype(fmt[0]).itemsize == field_size
+      ):
+        names.append(str(num))
+        formats.append(byteorder + fmt[0])
+        field_offsets.append(pos)
+        self.invalid[num] = fmt[1]
+      pos += field_size
+
+    self.dtype = np.dtype({
+      'names': names,
+      'formats': formats,
+      'offsets': field_offsets,
+      'itemsize': size,
+    })
+
+  def decode(self, raw):
+    """Decode this layout's data messages.
+
+    Args:
+      raw (numpy.ndarray): the file's bytes, as uint8.
+
+    Returns:
+      dict(numpy.ndarray): float64 values keyed by field definition
+      number, with invalid values as NaN.
+    """
+    if not self.offsets or not self.invalid:
+      return {}
+
+    offsets = np.asarray(self.offsets)
+    rows = raw[offsets[:, None] + np.arange(self.size)]
+    recs = rows.view(self.dtype)[:, 0]
+
+    fields = {}
+    for num, invalid in self.invalid.items():
+      values = recs[str(num)]
+      decoded = values.astype('float64')
+      if invalid is not None:
+        decoded[values == invalid] = np.nan
+      fields[num] = decoded
+    return fields
+
+
+def decode_messages(data, mesg_names=('record', 'event')):
+  """Decode FIT messages into NumPy arrays.
+
+  Args:
+    data (bytes-like): the contents of a .fit file. Anything that
+      supports the buffer protocol works, eg `bytes` or `mmap.mmap`.
+    mesg_names (iterable(str)): names of the messages to decode, out
+      of the keys of `MESG_FIELDS`.
+
+  Returns:
+    dict(dict(numpy.ndarray)): For each message name, float64 arrays of
+    field values keyed by fitparse field name, in file order. Fields
+    that no message of that type contains are left out. Positions are
+    in degrees, and timestamps in seconds since the FIT epoch.
+
+  Raises:
+    FitDecodeError: if the file isn't FIT or uses a feature that
+      this decoder doesn't support.
+  """
+  if len(data) < 12 or data[8:12] != b'.FIT':
+    raise FitDecodeError('Invalid .FIT file header')
+
+  header_size = data[0]
+  data_size = int.from_bytes(data[4:8], 'little')
+  end = header_size + data_size
+  if end + 2 > len(data):
+    raise FitDecodeError('File is shorter than its header says')
+  if end + 2 < len(data):
+    raise FitDecodeError('Chained FIT files are not supported')
+
+  wanted = {MESG_NUMS[name]: name for name in mesg_names}
+  layouts = []
+  local_mesgs = {}  # local message number: (data size, _Layout or None)
+
+  pos = header_size
+  while pos < end:
+    header = data[pos]
+
+    if header & 0x80:
+      raise FitDecodeError('Compressed timestamp headers are not supported')
+
+    local_mesg_num = header & 0x0F
+
+    if header & 0x40:
+      # Definition message: reserved byte, architecture, global message
+      # number, field count, then 3 bytes per field.
+      big_endian = data[pos + 2]
+      global_mesg_num = int.from_bytes(
+        data[pos + 3:pos + 5], 'big' if big_endian else 'little')
+      num_fields = data[pos + 5]
+      pos += 6
+      field_defs = data[pos:pos + 3 * num_fields]
+      pos += 3 * num_fields
+      size = sum(field_defs[1::3])
+
+      if header & 0x20:
+        # Developer fields only get skipped over.
+        num_dev_fields = data[pos]
+        size += sum(data[pos + 1:pos + 1 + 3 * num_dev_fields][1::3])
+        pos += 1 + 3 * num_dev_fields
+
+      layout = None
+      if global_mesg_num in wanted:
+        layout = _Layout(wanted[global_mesg_num], field_defs, big_endian, size)
+        layouts.append(layout)
+      local_mesgs[local_mesg_num] = (size, layout)
+
+    else:
+      try:
+        size, layout = local_mesgs[local_mesg_num]
+      except KeyError:
+        raise FitDecodeError(
+          f'Data message before definition of local message {local_mesg_num}')
+      if layout is not None:
+        layout.offsets.append(pos + 1)
+      pos += 1 + size
+
+  if pos != end:
+    raise FitDecodeError('Last message runs past the end of the data')
+
+  raw = np.frombuffer(data, dtype=np.uint8, count=end)
+
+  return {
+    name: _merge_layouts([l for l in layouts if l.mesg_name == name], raw)
+    for name in mesg_names
+  }
+
+
+def _merge_layouts(layouts, raw):
+  """Combine the fields of one message type's layouts, in file order."""
+  fields = MESG_FIELDS[layouts[0].mesg_name] if layouts else {}
+  offsets = np.array([o for l in layouts for o in l.offsets], dtype='int64')
+
+  # Position in file order of each message, layout by layout.
+  rank = np.empty(len(offsets), dtype='int64')
+  rank[np.argsort(offsets, kind='stable')] = np.arange(len(offsets))
+
+  merged = {}
+  start = 0
+  for layout in layouts:
+    stop = start + len(layout.offsets)
+    for num, values in layout.decode(raw).items():
+      name = fields[num][0]
+      if name not in merged:
+        merged[name] = np.full(len(offsets), np.nan)
+      merged[name][rank[start:stop]] = values
+    start = stop
+
+  # Apply scale and offset, keeping the profile's field order.
+  decoded = {}
+  for name, scale, offset in fields.values():
+    if name in merged:
+      values = merged[name]
+      if scale != 1 or offset:
+        values = values / scale - offset
+      decoded[name] = values
+  return decoded
@@ -0,0 +1,119 @@
+"""Named locks held across every process that uses the app.
+
+Used where work must happen once no matter how many gunicorn or Celery
+workers want it at the same moment, like refreshing a Strava token.
+
+The lock lives in Redis when `LOCK_REDIS_URL` is set. Otherwise it is a
+Postgres advisory lock when the database is Postgres, or a lock file
+when it isn't (SQLite only works on one machine anyway).
+"""
+import contextlib
+import hashlib
+import os
+import tempfile
+import time
+
+from flask import current_app
+import sqlalchemy as sa
+
+from application import db
+
+
+class LockTimeout(TimeoutError):
+  """Raised when a lock is still held by someone else after waiting."""
+
+
+# How often to retry a lock that is held.
+_POLL_INTERVAL_S = 0.05
+
+
+def _poll(try_acquire, name, timeout_s):
+  time_ed = time.monotonic() + timeout_s
+  while not try_acquire():
+    if time.monotonic() > time_ed:
+      raise LockTimeout(f'Lock {name!r} still held after {timeout_s} seconds.')
+    time.sleep(_POLL_INTERVAL_S)
+
+
+@contextlib.contextmanager
+def _redis_lock(url, name, timeout_s, ttl_s):
+  import redis
+
+  lock = redis.Redis.from_url(url).lock(
+    f'lock:{name}', timeout=ttl_s, blocking_timeout=timeout_s)
+  if not lock.acquire():
+    raise LockTimeout(f'Lock {name!r} still held after {timeout_s} seconds.')
+  try:
+    yield
+  finally:
+    try:
+      lock.release()
+    except redis.exceptions.LockError:
+      # It outlived its ttl and someone else has it now.
+      pass
+
+
+@contextlib.contextmanager
+def _advisory_lock(name, timeout_s):
+  # Advisory locks are keyed by a signed 64-bit integer.
+  key = int.from_bytes(
+    hashlib.sha256(name.encode()).digest()[:8], 'big', signed=True)
+  with db.engine.connect() as conn:
+    _poll(
+      lambda: conn.execute(
+        sa.text('SELECT pg_try_advisory_lock(:key)'), {'key': key}
+      ).scalar(),
+      name,
+      timeout_s
+    )
+    try:
+      yield
+    finally:
+      conn.execute(sa.text('SELECT pg_advisory_unlock(:key)'), {'key': key})
+
+
+@contextlib.contextmanager
+def _file_lock(name, timeout_s):
+  # Unix only, so imported here rather than for every backend.
+  import fcntl
+
+  folder = os.path.join(tempfile.gettempdir(), 'distilling-flask-locks')
+  os.makedirs(folder, exist_ok=True)
+  path = os.path.join(folder, hashlib.sha256(name.encode()).hexdigest())
+
+  def try_acquire():
+    try:
+      fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+      return False
+    return True
+
+  # Each acquire opens the file anew, so threads in one process shut
+  # each other out too.
+  with open(path, 'a') as f:
+    _poll(try_acquire, name, timeout_s)
+    try:
+      yield
+    finally:
+      fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def named_lock(name, timeout_s=30, ttl_s=60):
+  """Hold the lock called `name` for the duration of a `with` block.
+
+  Args:
+    name (str): what the lock protects.
+    timeout_s (float): longest to wait for someone else to let go.
+    ttl_s (float): with Redis, how long until the lock lets go by
+      itself, in case its holder dies. Database and file locks let go
+      when their connection or process goes away.
+
+  Raises:
+    LockTimeout: if the lock is still held after `timeout_s`.
+  """
+  redis_url = current_app.config.get('LOCK_REDIS_URL')
+  if redis_url:
+    return _redis_lock(redis_url, name, timeout_s, ttl_s)
+  if db.engine.dialect.name == 'postgresql':
+    return _advisory_lock(name, timeout_s)
+  return _file_lock(name, timeout_s)
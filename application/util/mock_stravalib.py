@@ -8,6 +8,8 @@ from stravalib.exc import RateLimitExceeded
 with open('tests/unit_tests/sample_data/exchange_code_for_token.json', 'r') as f:
   MOCK_TOKEN = json.load(f)
 
+MOCK_START_DATE = datetime.datetime(2018, 2, 20, 10, 2, 2, tzinfo=datetime.timezone.utc)
+
 
 class DummyClass:
   def __init__(self, *args, **kwargs):
@@ -51,6 +53,11 @@ class Client:
   def __init__(self, *args, **kwargs):
     self.access_token = kwargs.pop('access_token', None)
 
+    # Simulate a particular rate limit status.
+    for name in ('short_limit', 'long_limit', 'short_usage', 'long_usage'):
+      if name in kwargs:
+        setattr(self, f'_{name}', kwargs.pop(name))
+
   @property
   def stravalib_client(self):
     # Supply a genuine stravalib Client for passthrough methods.
@@ -87,9 +94,18 @@ class Client:
     return sample_athlete
 
   @rate_limit
-  def get_activities(self, limit=None):
+  def get_athlete_stats(self, athlete_id=None):
+    return stravalib.model.AthleteStats(
+      all_run_totals=stravalib.model.ActivityTotals(count=self._activity_count)
+    )
+
+  @rate_limit
+  def get_activities(self, before=None, after=None, limit=None):
     o = BatchedResultsIterator()
     o._num_results = min(limit, self._activity_count) if limit else self._activity_count
+    # Every mock activity starts at the same time.
+    if after is not None and after >= MOCK_START_DATE:
+      o._num_results = 0
     return o
 
   @rate_limit
@@ -100,9 +116,20 @@ class Client:
     return stravalib.model.Activity(**data)
 
   @rate_limit
-  def get_activity_streams(self, activity_id, types=None):
+  def get_activity_streams(self, activity_id, types=None, resolution=None, series_type=None):
     with open('tests/unit_tests/sample_data/get_activity_streams.json', 'r') as f:
       data = json.load(f)
+
+    # Like Strava, send the requested types plus the series type.
+    if types is not None:
+      types = set(types) | {series_type or 'distance'}
+      data = [stream for stream in data if stream['type'] in types]
+    if resolution == 'low':
+      for stream in data:
+        step = max(1, len(stream['data']) // 100)
+        stream['data'] = stream['data'][::step]
+        stream['resolution'] = resolution
+
     return {stream['type']: stravalib.model.Stream(**stream) for stream in data}
 
   @property
@@ -138,6 +165,9 @@ class BatchedResultsIterator:
 
   _num_results = 1000
 
+  entity = stravalib.model.Activity
+  bind_client = None
+
   def __iter__(self):
     return self
 
@@ -147,21 +177,33 @@ class BatchedResultsIterator:
     elif self._counter >= self._num_results:
       raise StopIteration
     else:
-      result = stravalib.model.Activity(
-        id=self._counter + 1,
-        name=f'Activity {self._counter + 1}',
-        # Throw in a bike ride every once in a while
-        type='Run' if self._counter % 5 else 'Ride',
-        start_date_local='2018-02-20T10:02:13Z',
-        start_date='2018-02-20T10:02:02',
-        distance=10000,
-        moving_time=3000,
-        elapsed_time=3600,
-        total_elevation_gain=100,
-      )
+      result = self.entity.deserialize(self._raw_activity(self._counter))
       self._counter += 1
       return result
 
+  def result_fetcher(self, page=1, per_page=200):
+    """One page of raw activity data, like stravalib's fetchers return."""
+    return [
+      self._raw_activity(i)
+      for i in range((page - 1) * per_page, min(page * per_page, self._num_results))
+    ]
+
+  @staticmethod
+  def _raw_activity(i):
+    return dict(
+      id=i + 1,
+      name=f'Activity {i + 1}',
+      # Throw in a bike ride every once in a while
+      type='Run' if i % 5 else 'Ride',
+      start_date_local='2018-02-20T10:02:13Z',
+      start_date=MOCK_START_DATE.isoformat(),
+      timezone='(GMT-07:00) America/Denver',
+      distance=10000,
+      moving_time=3000,
+      elapsed_time=3600,
+      total_elevation_gain=100,
+    )
+
 
 class LowLimitClient(Client):
   _short_limit = 100
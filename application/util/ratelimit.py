@@ -0,0 +1,401 @@
+"""Token buckets for the Strava API rate limits, shared by every process.
+
+Strava allows so many requests per 15 minutes and so many per day,
+across everything that uses the app's API credentials: page views,
+Celery workers, the CLI. Each limit is modeled as a bucket that holds
+up to `limit` tokens and refills at `limit / period` tokens per second.
+Every API call takes a token from each bucket first.
+
+Calls go in one of two lanes. A share of each bucket is held back for
+the 'interactive' lane (page views), so the 'background' lane (Celery
+tasks) can't use up a window and leave pages with nothing.
+
+A call that would have to wait for tokens can reserve them and sleep,
+if the wait is short enough. Otherwise it raises `RateLimitExceeded`
+with the wait as its `timeout`, so a task knows exactly when to retry.
+After each call, the buckets are drained to match the usage Strava
+reports, so calls made elsewhere with the same credentials count too.
+
+The buckets live in Redis when `STRAVA_RATE_LIMIT_REDIS_URL` is set,
+and in the `rate_limit_bucket` table otherwise.
+
+https://developers.strava.com/docs/rate-limits/
+"""
+import functools
+import threading
+import time
+
+from flask import current_app
+import sqlalchemy as sa
+from sqlalchemy.exc import IntegrityError
+from stravalib.exc import RateLimitExceeded
+
+from application import db
+
+
+# Client methods that don't make a request to Strava themselves.
+# `get_activities` only returns an iterator; each page it fetches as it
+# is read takes a token then.
+_NO_REQUEST_METHODS = ('authorization_url', 'get_activities')
+
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+
+
+class DatabaseBucketStore(object):
+  """Keeps token buckets in `RateLimitBucket` rows.
+
+  Each update runs in its own transaction on its own connection, so
+  it never commits (or waits on) the caller's session. Tokens are
+  refilled and taken by one conditional UPDATE per bucket, so two
+  processes can't both spend the same tokens. Threads in one process
+  also take turns before they get to the database, which SQLite
+  couldn't sort out on its own.
+  """
+
+  def __init__(self):
+    self._lock = threading.Lock()
+
+  def _table(self):
+    from application.models import RateLimitBucket
+    return RateLimitBucket.__table__
+
+  def _create_missing(self, conn, names, now, limits):
+    """Add a full bucket for each of `names` that isn't there yet."""
+    table = self._table()
+    existing = {
+      name for (name,) in conn.execute(
+        sa.select(table.c.name).where(table.c.name.in_(names)))
+    }
+    for name in names:
+      if name not in existing:
+        try:
+          with conn.begin_nested():
+            conn.execute(table.insert().values(
+              name=name, tokens=float(limits[name][0]), updated=now))
+        except IntegrityError:
+          # Another process added it first, which is just as good.
+          pass
+
+  def _refilled_sql(self, capacity, rate, now):
+    """A bucket's tokens, refilled up to `now`, as a SQL expression."""
+    table = self._table()
+    elapsed_s = sa.case((table.c.updated < now, now - table.c.updated), else_=0)
+    tokens = table.c.tokens + elapsed_s * rate
+    return sa.case((tokens > capacity, capacity), else_=tokens)
+
+  def _refilled(self, rows, names, now, limits):
+    state = {}
+    for name in names:
+      capacity, rate = limits[name]
+      if name in rows:
+        tokens = rows[name].tokens + max(0, now - rows[name].updated) * rate
+        state[name] = min(capacity, tokens)
+      else:
+        state[name] = float(capacity)
+    return state
+
+  def take(self, limits, cost, now, max_wait_s, floors):
+    table = self._table()
+    with self._lock, db.engine.connect() as conn:
+      with conn.begin() as transaction:
+        self._create_missing(conn, list(limits), now, limits)
+        for name, (capacity, rate) in limits.items():
+          refilled = self._refilled_sql(capacity, rate, now)
+          # Enough tokens, once the caller has waited up to max_wait_s.
+          taken = conn.execute(
+            table.update()
+            .where(table.c.name == name)
+            .where(refilled >= cost + floors[name] - max_wait_s * rate)
+            .values(tokens=refilled - cost, updated=now)
+          ).rowcount
+          if not taken:
+            transaction.rollback()
+            break
+        else:
+          tokens = dict(conn.execute(
+            sa.select(table.c.name, table.c.tokens)
+            .where(table.c.name.in_(list(limits)))
+          ).all())
+          wait_s = max(
+            (floors[name] - tokens[name]) / rate
+            for name, (_, rate) in limits.items()
+          )
+          return True, max(wait_s, 0.0)
+
+    tokens = self.peek(limits, now)
+    wait_s = max(
+      (cost + floors[name] - tokens[name]) / rate
+      for name, (_, rate) in limits.items()
+    )
+    return False, wait_s
+
+  def peek(self, limits, now):
+    table = self._table()
+    with self._lock, db.engine.connect() as conn:
+      rows = {
+        row.name: row for row in conn.execute(
+          table.select().where(table.c.name.in_(list(limits))))
+      }
+    return self._refilled(rows, list(limits), now, limits)
+
+  def drain(self, limits, remaining, now):
+    table = self._table()
+    with self._lock, db.engine.begin() as conn:
+      self._create_missing(conn, list(remaining), now, limits)
+      for name, left in remaining.items():
+        capacity, rate = limits[name]
+        refilled = self._refilled_sql(capacity, rate, now)
+        conn.execute(
+          table.update()
+          .where(table.c.name == name)
+          .values(tokens=sa.case((refilled > left, left), else_=refilled), updated=now)
+        )
+
+
+class RedisBucketStore(object):
+  """Keeps token buckets in Redis hashes, updated by Lua scripts so
+  that each take is atomic across every process."""
+
+  # KEYS: bucket keys. ARGV: now, cost, max_wait_s, then capacity,
+  # rate and floor (tokens the caller must leave) for each bucket.
+  # Floats go back as strings, because Lua numbers are truncated to
+  # integers on the way out.
+  TAKE_SCRIPT = '''
+    local now = tonumber(ARGV[1])
+    local cost = tonumber(ARGV[2])
+    local max_wait = tonumber(ARGV[3])
+    local tokens = {}
+    local wait = -math.huge
+    for i, key in ipairs(KEYS) do
+      local capacity = tonumber(ARGV[1 + 3 * i])
+      local rate = tonumber(ARGV[2 + 3 * i])
+      local floor = tonumber(ARGV[3 + 3 * i])
+      local state = redis.call('HMGET', key, 'tokens', 'updated')
+      local t = tonumber(state[1]) or capacity
+      local updated = tonumber(state[2]) or now
+      t = math.min(capacity, t + math.max(0, now - updated) * rate)
+      tokens[i] = t
+      wait = math.max(wait, (cost + floor - t) / rate)
+    end
+    if wait > max_wait then
+      return {0, tostring(wait)}
+    end
+    for i, key in ipairs(KEYS) do
+      redis.call('HSET', key, 'tokens', tostring(tokens[i] - cost), 'updated', tostring(now))
+    end
+    return {1, tostring(math.max(wait, 0))}
+  '''
+
+  # KEYS: bucket keys. ARGV: now, then capacity, rate and remaining
+  # requests for each bucket.
+  DRAIN_SCRIPT = '''
+    local now = tonumber(ARGV[1])
+    for i, key in ipairs(KEYS) do
+      local capacity = tonumber(ARGV[3 * i - 1])
+      local rate = tonumber(ARGV[3 * i])
+      local remaining = tonumber(ARGV[3 * i + 1])
+      local state = redis.call('HMGET', key, 'tokens', 'updated')
+      local t = tonumber(state[1]) or capacity
+      local updated = tonumber(state[2]) or now
+      t = math.min(capacity, t + math.max(0, now - updated) * rate, remaining)
+      redis.call('HSET', key, 'tokens', tostring(t), 'updated', tostring(now))
+    end
+    return 1
+  '''
+
+  KEY_PREFIX = 'strava-rate-limit:'
+
+  def __init__(self, url):
+    import redis
+
+    self.redis = redis.Redis.from_url(url)
+    self._take = self.redis.register_script(self.TAKE_SCRIPT)
+    self._drain = self.redis.register_script(self.DRAIN_SCRIPT)
+
+  def take(self, limits, cost, now, max_wait_s, floors):
+    args = [now, cost, max_wait_s]
+    for name, (capacity, rate) in limits.items():
+      args += [capacity, rate, floors[name]]
+    ok, wait_s = self._take(
+      keys=[self.KEY_PREFIX + name for name in limits], args=args)
+    return bool(ok), float(wait_s)
+
+  def peek(self, limits, now):
+    tokens = {}
+    for name, (capacity, rate) in limits.items():
+      t, updated = self.redis.hmget(self.KEY_PREFIX + name, 'tokens', 'updated')
+      if t is None:
+        tokens[name] = float(capacity)
+      else:
+        refill = max(0, now - float(updated or now)) * rate
+        tokens[name] = min(capacity, float(t) + refill)
+    return tokens
+
+  def drain(self, limits, remaining, now):
+    args = [now]
+    for name in remaining:
+      capacity, rate = limits[name]
+      args += [capacity, rate, remaining[name]]
+    self._drain(keys=[self.KEY_PREFIX + name for name in remaining], args=args)
+
+
+class RateLimiter(object):
+  """Shared token buckets for the Strava API rate limits.
+
+  Args:
+    limits (dict): (requests, period in seconds) of each limit, keyed
+      by name. Strava's are 'short' (15 minutes) and 'long' (daily).
+    store: `DatabaseBucketStore` or `RedisBucketStore`.
+    interactive_share (float): fraction of each bucket that only the
+      interactive lane can use.
+    clock (callable): returns the current unix time.
+  """
+
+  def __init__(self, limits, store, interactive_share=0, clock=time.time):
+    self.limits = {
+      name: (requests, requests / period)
+      for name, (requests, period) in limits.items()
+    }
+    self.store = store
+    self.interactive_share = interactive_share
+    self.clock = clock
+
+  def _floors(self, lane):
+    """Tokens a call in `lane` has to leave in each bucket."""
+    share = self.interactive_share if lane == BACKGROUND else 0
+    return {
+      name: share * capacity for name, (capacity, _) in self.limits.items()
+    }
+
+  def reserve(self, cost=1, max_wait_s=0, lane=INTERACTIVE):
+    """Take tokens now, for a request that may have to wait for them.
+
+    Args:
+      cost (int): number of requests.
+      max_wait_s (float): longest the request can wait for tokens.
+      lane (str): `INTERACTIVE` or `BACKGROUND`.
+
+    Returns:
+      float: seconds to wait before making the request.
+
+    Raises:
+      RateLimitExceeded: if the wait would be longer than `max_wait_s`.
+        No tokens are taken, and `timeout` is the wait in seconds.
+    """
+    ok, wait_s = self.store.take(
+      self.limits, cost, self.clock(), max_wait_s, self._floors(lane))
+    if not ok:
+      raise RateLimitExceeded(
+        f'Strava rate limit reached. Try again in {wait_s:.0f} seconds.',
+        timeout=wait_s,
+      )
+    return wait_s
+
+  def seconds_until_available(self, cost=1, lane=INTERACTIVE):
+    """How long until `cost` tokens are free, without taking any."""
+    tokens = self.store.peek(self.limits, self.clock())
+    floors = self._floors(lane)
+    return max(0.0, *(
+      (cost + floors[name] - tokens[name]) / rate
+      for name, (_, rate) in self.limits.items()
+    ))
+
+  def acquire(self, cost=1, max_wait_s=0, lane=INTERACTIVE):
+    """Take tokens, sleeping until they are available if need be."""
+    wait_s = self.reserve(cost, max_wait_s=max_wait_s, lane=lane)
+    if wait_s > 0:
+      time.sleep(wait_s)
+
+  def record_usage(self, rate_limits):
+    """Drain the buckets down to the requests Strava says are left.
+
+    Args:
+      rate_limits (dict): 'usage' and 'limit' keyed by limit name, as
+        kept by stravalib's `XRateLimitRule` from response headers.
+    """
+    remaining = {
+      name: limit['limit'] - limit['usage']
+      for name, limit in rate_limits.items()
+      if name in self.limits and limit.get('limit') and limit.get('usage')
+    }
+    if remaining:
+      self.store.drain(self.limits, remaining, self.clock())
+
+
+def get_rate_limiter():
+  """The rate limiter for the current app, made the first time it's needed."""
+  limiter = current_app.extensions.get('strava_rate_limiter')
+  if limiter is None:
+    redis_url = current_app.config.get('STRAVA_RATE_LIMIT_REDIS_URL')
+    limiter = RateLimiter(
+      current_app.config['STRAVA_RATE_LIMITS'],
+      RedisBucketStore(redis_url) if redis_url else DatabaseBucketStore(),
+      interactive_share=current_app.config.get(
+        'STRAVA_RATE_LIMIT_INTERACTIVE_SHARE', 0),
+    )
+    current_app.extensions['strava_rate_limiter'] = limiter
+  return limiter
+
+
+def current_lane():
+  """`BACKGROUND` while running a Celery task, `INTERACTIVE` otherwise."""
+  from celery import current_task
+
+  return BACKGROUND if current_task else INTERACTIVE
+
+
+class RateLimitedClient(object):
+  """Wraps a stravalib `Client` so every request goes through a
+  `RateLimiter`.
+
+  Everything else about the client, including attributes, passes
+  straight through. Result iterators that fetch more pages as they go
+  are wrapped too, so each page is counted.
+
+  Args:
+    client (stravalib.Client): the client to wrap.
+    limiter (RateLimiter): the shared buckets.
+    max_wait_s (float): longest a request will wait for tokens before
+      raising `RateLimitExceeded`.
+    lane (str): `INTERACTIVE` or `BACKGROUND`.
+  """
+
+  def __init__(self, client, limiter, max_wait_s=0, lane=INTERACTIVE):
+    self._client = client
+    self._limiter = limiter
+    self.max_wait_s = max_wait_s
+    self.lane = lane
+
+  def __getattr__(self, name):
+    attr = getattr(self._client, name)
+    if name.startswith('_') or not callable(attr):
+      return attr
+    return self._limited(attr, makes_request=name not in _NO_REQUEST_METHODS)
+
+  def _limited(self, method, makes_request=True):
+    @functools.wraps(method)
+    def limited_method(*args, **kwargs):
+      if not makes_request:
+        result = method(*args, **kwargs)
+      else:
+        self._limiter.acquire(max_wait_s=self.max_wait_s, lane=self.lane)
+        try:
+          result = method(*args, **kwargs)
+        finally:
+          self._record_usage()
+
+      if callable(getattr(result, 'result_fetcher', None)):
+        result.result_fetcher = self._limited(result.result_fetcher)
+      return result
+
+    return limited_method
+
+  def _record_usage(self):
+    try:
+      rules = self._client.protocol.rate_limiter.rules
+    except AttributeError:
+      return
+    for rule in rules:
+      if hasattr(rule, 'rate_limits'):
+        self._limiter.record_usage(rule.rate_limits)
@@ -1,6 +1,9 @@
 """Methods to convert data into easy-to-digest DataFrames."""
 import io
+import mmap
+import os
 
+import numpy as np
 import pandas as pd
 
 
@@ -18,120 +21,370 @@ MOVING = 'moving'
 POWER = 'power'
 
 
+# Standard column names for Strava stream types that are named
+# differently. Other stream types keep their Strava names.
+STRAVA_STREAM_NAMES = {
+  'altitude': ELEVATION,
+  'velocity_smooth': SPEED,
+  'grade_smooth': GRADE,
+}
+
+# Column dtypes of a DataFrame read from Strava streams. Types that
+# aren't listed here are read as float32.
+STRAVA_STREAM_SCHEMA = {
+  TIME: 'int32',
+  LAT: 'float64',
+  LON: 'float64',
+  CADENCE: 'int32',
+  MOVING: 'bool',
+}
+
+
+def decode_strava_stream(stream_type, data):
+  """Convert one Strava stream's data into typed NumPy arrays.
+
+  Args:
+    stream_type (str): Strava's name for the stream, eg 'velocity_smooth'.
+    data (list): the stream's data, as in `stravalib.model.Stream.data`.
+
+  Returns:
+    dict(numpy.ndarray): arrays keyed by standard column name. Most
+    streams yield a single array; 'latlng' yields `LAT` and `LON`.
+  """
+  if stream_type == 'latlng':
+    # Points missing from the stream (None) become NaN.
+    latlng = np.asarray(
+      [(np.nan, np.nan) if point is None else point for point in data],
+      dtype=STRAVA_STREAM_SCHEMA[LAT]
+    ).reshape(-1, 2)
+    return {LAT: latlng[:, 0], LON: latlng[:, 1]}
+
+  name = STRAVA_STREAM_NAMES.get(stream_type, stream_type)
+  dtype = STRAVA_STREAM_SCHEMA.get(name, 'float32')
+
+  if dtype == 'bool' and any(value is None for value in data):
+    # NumPy would quietly read None as False. As floats, gaps are NaN.
+    return {name: np.asarray(data, dtype='float32')}
+
+  try:
+    arr = np.asarray(data, dtype=dtype)
+  except TypeError:
+    # Integer streams with gaps (None) have to be floats to hold NaN.
+    arr = np.asarray(data, dtype='float32')
+
+  return {name: arr}
+
+
 def from_strava_streams(streams):
   """Processes strava stream list (json) into a DataFrame.
+
+  Each stream is decoded straight into a typed array following
+  `STRAVA_STREAM_SCHEMA`, so the DataFrame has compact, predictable
+  dtypes rather than float64/object columns.
   
   Args:
     stream_dict (dict(stravalib.model.Stream)): Strava stream data,
       as returned by `stravalib.Client.get_activity_streams()`.
 
   """
-  stream_data_dict = {key: stream.data for key, stream in streams.items()}
+  columns = {}
+  for stream_type, stream in streams.items():
+    columns.update(decode_strava_stream(stream_type, stream.data))
 
-  df = pd.DataFrame.from_dict(stream_data_dict)
+  # Convert RPM to SPM since we are talking about running, not cycling.
+  if CADENCE in columns:
+    columns[CADENCE] = columns[CADENCE] * 2
 
-  # Rename streams to standard names if they are there, ignore if not.
-  df = df.rename(columns=dict(
-    altitude=ELEVATION,
-    velocity_smooth=SPEED,
-    grade_smooth=GRADE
-  ))
+  return pd.DataFrame(columns)
 
-  if 'latlng' in df.columns:
-    df[LAT] = df['latlng'].apply(lambda x: x[0])
-    df[LON] = df['latlng'].apply(lambda x: x[1])
-    df = df.drop('latlng', axis=1)
 
-  # Convert RPM to SPM since we are talking about running, not cycling.
-  if CADENCE in df.columns:
-    df[CADENCE] = df[CADENCE] * 2
+# Trackpoint elements whose text holds each field, by local tag name.
+# TCX trackpoints only have one `Value` element (under `HeartRateBpm`).
+TCX_TRACKPOINT_TAGS = {
+  'LatitudeDegrees': LAT,
+  'LongitudeDegrees': LON,
+  'DistanceMeters': DISTANCE,
+  'AltitudeMeters': ELEVATION,
+  'Value': HEARTRATE,
+  'Speed': SPEED,
+  'RunCadence': CADENCE,
+  'Cadence': CADENCE,
+}
+
+GPX_TRACKPOINT_TAGS = {
+  'ele': ELEVATION,
+  'hr': HEARTRATE,
+  'cad': CADENCE,
+}
 
-  return df
+# Fields that come out as integers when no trackpoint is missing them.
+INTEGER_FIELDS = (HEARTRATE, CADENCE)
 
 
-def from_tcx(file_obj):
+def from_tcx(file_obj, fields=None):
   """Read a file object representing a .tcx file into a DataFrame.
 
   Args:
-    file_obj(file or file-like object): Any accepted object accepted
-      by `lxml.ElementTree.parse`
-      https://lxml.de/tutorial.html#the-parse-function
+    file_obj(str, bytes, or file-like object): A filename, the file's
+      contents, or any file object accepted by `lxml.etree.iterparse`.
+      https://lxml.de/parsing.html#iterparse-and-iterwalk
+    fields (iterable(str)): column names to read, out of `LAT`, `LON`,
+      `DISTANCE`, `ELEVATION`, `HEARTRATE`, `SPEED` and `CADENCE`.
+      `TIME` is always read. Defaults to all of them.
   """
-  from activereader import Tcx
-  
-  reader = Tcx.from_file(file_obj)
-
-  # Build a DataFrame using only trackpoints (as records).
-  # Make sure to name the fields appropriately, so the plotter function
-  # will find them.
-  initial_time = reader.activities[0].start_time or reader.trackpoints[0].time
-  records = [
-    {
-      TIME: int((tp.time - initial_time).total_seconds()),
-      LAT: tp.lat,
-      LON: tp.lon,
-      DISTANCE: tp.distance_m,
-      ELEVATION: tp.altitude_m,
-      HEARTRATE: tp.hr,
-      SPEED: tp.speed_ms,
-      #'cadence': 2.0 * tp.cadence_rpm,
-      CADENCE: tp.cadence_rpm,
-    } for tp in reader.trackpoints
-  ]
+  return _read_tcx(file_obj, fields=fields)[0]
+
+
+def _read_tcx(file_obj, fields=None):
+  return _read_trackpoints(
+    file_obj,
+    trackpoint_tag='Trackpoint',
+    start_time_tag='Id',  # Activity/Id
+    time_tag='Time',
+    field_tags=TCX_TRACKPOINT_TAGS,
+    fields=fields,
+  )
+
+
+def from_gpx(file_obj, fields=None):
+  """Read a file object representing a .gpx file into a DataFrame.
+
+  Args:
+    file_obj(str, bytes, or file-like object): A filename, the file's
+      contents, or any file object accepted by `lxml.etree.iterparse`.
+      https://lxml.de/parsing.html#iterparse-and-iterwalk
+    fields (iterable(str)): column names to read, out of `LAT`, `LON`,
+      `ELEVATION`, `HEARTRATE` and `CADENCE`. `TIME` is always read.
+      Defaults to all of them.
+  """
+  return _read_gpx(file_obj, fields=fields)[0]
+
+
+def _read_gpx(file_obj, fields=None):
+  return _read_trackpoints(
+    file_obj,
+    trackpoint_tag='trkpt',
+    start_time_tag='metadata',  # metadata/time
+    time_tag='time',
+    field_tags=GPX_TRACKPOINT_TAGS,
+    attr_fields={'lat': LAT, 'lon': LON},
+    fields=fields,
+  )
 
-  df = pd.DataFrame.from_records(records)
+
+def _read_trackpoints(
+  file_obj,
+  trackpoint_tag,
+  start_time_tag,
+  time_tag,
+  field_tags,
+  attr_fields=None,
+  fields=None,
+):
+  """Stream trackpoints out of an XML activity file into a DataFrame.
+
+  Each trackpoint is parsed as soon as its closing tag is read, then
+  cleared from the tree along with its predecessors, so memory use
+  doesn't grow with file size. Values go straight into a preallocated
+  float64 buffer that doubles in size as it fills.
+
+  Returns:
+    (pandas.DataFrame, pandas.Timestamp): the trackpoints, and the
+    activity's start time in UTC.
+  """
+  from lxml import etree
+
+  if isinstance(file_obj, bytes):
+    file_obj = io.BytesIO(file_obj)
+
+  attr_fields = attr_fields or {}
+  all_fields = list(attr_fields.values()) + list(field_tags.values())
+  # A field may have more than one tag, like TCX cadence.
+  fields = [
+    f for f in dict.fromkeys(all_fields) if fields is None or f in fields
+  ]
+  col_index = {field: i for i, field in enumerate(fields)}
+  tag_cols = {
+    tag: col_index[field]
+    for tag, field in field_tags.items()
+    if field in col_index
+  }
+  attr_cols = {
+    key: col_index[field]
+    for key, field in attr_fields.items()
+    if field in col_index
+  }
+
+  buf = np.full((4096, len(fields)), np.nan)
+  times = []
+  start_time = None
+
+  for _, elem in etree.iterparse(
+    file_obj,
+    events=('end',),
+    tag=(f'{{*}}{trackpoint_tag}', f'{{*}}{start_time_tag}'),
+  ):
+    if not elem.tag.endswith(trackpoint_tag):
+      # Activity start time: TCX `Activity/Id` or GPX `metadata/time`.
+      if start_time is None:
+        start_time = elem.findtext(f'{{*}}{time_tag}') if len(elem) else elem.text
+      continue
+
+    i = len(times)
+    if i == len(buf):
+      buf = np.concatenate([buf, np.full_like(buf, np.nan)])
+    row = buf[i]
+
+    time = None
+    for key, col in attr_cols.items():
+      value = elem.get(key)
+      if value and value.strip():
+        row[col] = float(value)
+    for child in elem.iter(tag=etree.Element):
+      tag = child.tag[child.tag.rfind('}') + 1:]
+      if tag == time_tag:
+        time = child.text
+      elif tag in tag_cols and child.text and child.text.strip():
+        row[tag_cols[tag]] = float(child.text)
+    times.append(time)
+
+    # Free the trackpoint, and any siblings already processed.
+    elem.clear()
+    while elem.getprevious() is not None:
+      del elem.getparent()[0]
+
+  timestamps = pd.to_datetime(pd.Series(times), utc=True)
+  if start_time:
+    initial_time = pd.Timestamp(start_time)
+    # Times without an offset are taken to be UTC, as `to_datetime` does.
+    initial_time = (
+      initial_time.tz_localize('UTC') if initial_time.tzinfo is None
+      else initial_time.tz_convert('UTC')
+    )
+  else:
+    initial_time = timestamps.iloc[0]
+
+  columns = {
+    TIME: (timestamps - initial_time).dt.total_seconds().astype('int64').to_numpy()
+  }
+  data = buf[:len(times)]
+  for field, col in col_index.items():
+    arr = data[:, col]
+    if field in INTEGER_FIELDS and not np.isnan(arr).any():
+      arr = arr.astype('int64')
+    columns[field] = arr
+
+  df = pd.DataFrame(columns)
 
   # Convert RPM to SPM since we are talking about running, not cycling.
-  df[CADENCE] = df[CADENCE] * 2
+  if CADENCE in df.columns:
+    df[CADENCE] = df[CADENCE] * 2
 
   # Drop any columns that lack data.
   df = df.dropna(axis=1, how='all')
 
-  return df
+  return df, initial_time
 
 
-def from_gpx(file_obj):
-  """Read a file object representing a .gpx file into a DataFrame.
+# fitparse names of the record fields read from .fit files.
+FIT_RECORD_FIELDS = {
+  'position_lat': LAT,
+  'position_long': LON,
+  'distance': DISTANCE,
+  'altitude': ELEVATION,
+  'speed': SPEED,
+  'heart_rate': HEARTRATE,
+  'cadence': CADENCE,
+  'fractional_cadence': 'fractional_cadence',
+  'power': POWER,
+  'temperature': 'temperature',
+}
+
+# Newer devices only write the 32-bit "enhanced" versions of these.
+FIT_ENHANCED_FIELDS = {
+  'altitude': 'enhanced_altitude',
+  'speed': 'enhanced_speed',
+}
+
+
+def from_fit(file_obj):
+  """Read a file-ish object representing a .fit file into a DataFrame.
+
+  Record and event messages are decoded straight into arrays by
+  `fit.decode_messages`. Files it doesn't support are read with
+  `fitparse` instead.
 
   Args:
-    file_obj(file or file-like object): Any accepted object accepted
-      by `lxml.ElementTree.parse`
-      https://lxml.de/tutorial.html#the-parse-function
+    file_obj(str, BytesIO, bytes, file contents): A filename, the
+      file's contents, or a file object opened in binary mode.
+
   """
-  from activereader import Gpx
-  
-  reader = Gpx.from_file(file_obj)
-
-  # Build a DataFrame using only trackpoints (as records).
-  # Make sure to name the fields appropriately, so the plotter function
-  # will find them.
-  initial_time = reader.start_time or reader.trackpoints[0].time
-  records = [
-    {
-      TIME: int((tp.time - initial_time).total_seconds()),
-      LAT: tp.lat,
-      LON: tp.lon,
-      # DISTANCE: tp.distance_m,  # not available in gpx
-      ELEVATION: tp.altitude_m,
-      HEARTRATE: tp.hr,
-      # SPEED: tp.speed_ms,  # not available in gpx
-      CADENCE: tp.cadence_rpm,
-    } for tp in reader.trackpoints
-  ]
+  return _read_fit(file_obj)[0]
+
+
+def _read_fit(file_obj):
+  if isinstance(file_obj, str):
+    # Map the file instead of reading it all in; the decoder only
+    # copies out the messages it needs.
+    with open(file_obj, 'rb') as f:
+      with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return _read_fit_data(data)
+  elif isinstance(file_obj, (bytes, bytearray)):
+    return _read_fit_data(file_obj)
+  else:
+    return _read_fit_data(file_obj.read())
+
+
+def _read_fit_data(data):
+  from application.util import fit
+
+  try:
+    messages = fit.decode_messages(data)
+  except fit.FitDecodeError as e:
+    print(f'Reading .fit file with fitparse: {e}')
+    return _read_fit_fitparse(data)
+
+  records = messages['record']
+  timestamps = records.get('timestamp')
+  if timestamps is None or np.isnan(timestamps).any():
+    print('Reading .fit file with fitparse: records lack timestamps')
+    return _read_fit_fitparse(data)
+
+  if not (np.diff(timestamps) > 0).all():
+    print('Something funky is going on with timestamps.')
+
+  event_types = messages['event'].get('event_type', np.array([]))
+  if (event_types == 0).sum() > 1:  # event_type 0 is 'start'
+    print('Pauses are present in this file')
+
+  columns = {TIME: (timestamps - timestamps[0]).astype('int64')}
+  for name, field in FIT_RECORD_FIELDS.items():
+    arr = records.get(name)
+    enhanced = records.get(FIT_ENHANCED_FIELDS.get(name))
+    if enhanced is not None:
+      arr = enhanced if arr is None else np.where(np.isnan(arr), enhanced, arr)
+    if arr is None:
+      continue
+    if field in INTEGER_FIELDS + (POWER,) and not np.isnan(arr).any():
+      arr = arr.astype('int64')
+    columns[field] = arr
 
-  df = pd.DataFrame.from_records(records)
+  df = pd.DataFrame(columns)
 
   # Convert RPM to SPM since we are talking about running, not cycling.
-  df[CADENCE] = df[CADENCE] * 2
+  if CADENCE in df.columns:
+    df[CADENCE] = df[CADENCE] * 2
 
   # Drop any columns that lack data.
   df = df.dropna(axis=1, how='all')
 
-  return df
+  start_time = pd.Timestamp(timestamps[0] + fit.FIT_EPOCH_S, unit='s', tz='UTC')
 
+  return df, start_time
 
-def from_fit(file_obj):
-  """Read a file-ish object representing a .fit file into a DataFrame.
+
+def _read_fit_fitparse(file_obj):
+  """Read a .fit file into a DataFrame using `fitparse`.
 
   Args:
     file_obj(str, BytesIO, bytes, file contents): Any accepted `fileish`
@@ -207,4 +460,35 @@ def from_fit(file_obj):
   # Drop any columns that lack data.
   df_rec = df_rec.dropna(axis=1, how='all')
 
-  return df_rec
\ No newline at end of file
+  return df_rec, pd.Timestamp(activity_start_time_utc)
+
+
+ACTIVITY_FILE_READERS = {
+  '.fit': _read_fit,
+  '.tcx': _read_tcx,
+  '.gpx': _read_gpx,
+}
+
+
+def read_activity_file(file_obj, filename=None):
+  """Read a .fit, .tcx or .gpx file into a DataFrame, with its start time.
+
+  Args:
+    file_obj(str, bytes, or file-like object): A filename, the file's
+      contents, or a file object opened in binary mode.
+    filename (str): The file's name, which tells its type. Defaults to
+      `file_obj` when that is a filename.
+
+  Returns:
+    (pandas.DataFrame, pandas.Timestamp): the file's data, and the
+    time the activity started in UTC.
+  """
+  filename = filename or file_obj
+  ext = os.path.splitext(filename)[1].lower()
+  if ext not in ACTIVITY_FILE_READERS:
+    raise ValueError(
+      f'{filename} does not seem to be a file type that is accepted '
+      'at this time (.fit, .tcx, .gpx)'
+    )
+
+  return ACTIVITY_FILE_READERS[ext](file_obj)
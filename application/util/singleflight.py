@@ -0,0 +1,173 @@
+"""Share one Strava request among everyone who makes it at once.
+
+Opening an activity in two tabs while a Celery task imports it used to
+fetch its streams three times. Identical requests for an account's data
+(same method, same arguments) that overlap now make one request between
+them:
+
+- Within a process, the first caller makes the request and the rest
+  wait for its result.
+- Across processes, when the shared cache is Redis
+  (`CACHE_REDIS_URL`), the first caller holds a short-lived named lock
+  (see `util.locks`) while it makes the request, then leaves the
+  result in the cache (see `util.cache`) for
+  `STRAVA_SINGLE_FLIGHT_TTL_S`. Whoever was waiting on the lock reads
+  it from there. Without Redis, a lock and a cache entry in the
+  database would cost more than most of the requests they'd save.
+
+Only requests that read a single thing are coalesced (see
+`COALESCED_METHODS`). Their results are stravalib entities, or dicts of
+them, which go through the cache as their `to_dict()`.
+"""
+import functools
+import hashlib
+from importlib import import_module
+import json
+import threading
+
+from flask import current_app
+from stravalib.model import BoundEntity
+
+from application.util import cache, locks
+
+
+# Client methods whose requests are coalesced.
+COALESCED_METHODS = ('get_activity', 'get_activity_streams', 'get_athlete',
+  'get_athlete_stats')
+
+# Longest a request waits for another process to make it first.
+LOCK_TIMEOUT_S = 30
+
+
+class _Call(object):
+  def __init__(self):
+    self.done = threading.Event()
+    self.result = None
+    self.error = None
+
+
+class SingleFlight(object):
+  """Runs one call at a time per key in this process, and hands its
+  result (or error) to everyone else who asked while it was running."""
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._calls = {}
+
+  def do(self, key, fn):
+    with self._lock:
+      call = self._calls.get(key)
+      is_leader = call is None
+      if is_leader:
+        call = self._calls[key] = _Call()
+
+    if not is_leader:
+      call.done.wait()
+      if call.error is not None:
+        raise call.error
+      return call.result
+
+    try:
+      call.result = fn()
+    except BaseException as e:
+      call.error = e
+      raise
+    finally:
+      with self._lock:
+        del self._calls[key]
+      call.done.set()
+
+    return call.result
+
+
+_in_flight = SingleFlight()
+
+
+def request_key(key_prefix, method_name, args, kwargs):
+  """A key for a request, short enough for any cache or lock."""
+  request = json.dumps([method_name, args, sorted(kwargs.items())], default=str)
+  return f'{key_prefix}:{hashlib.sha256(request.encode()).hexdigest()}'
+
+
+def _encode(result):
+  if isinstance(result, dict):
+    return {'dict': {key: _encode(value) for key, value in result.items()}}
+  entity = type(result)
+  return {
+    'entity': f'{entity.__module__}.{entity.__qualname__}',
+    'data': result.to_dict(),
+  }
+
+
+def _decode(value, bind_client):
+  if 'dict' in value:
+    return {key: _decode(item, bind_client) for key, item in value['dict'].items()}
+  module_path, class_name = value['entity'].rsplit('.', 1)
+  entity = getattr(import_module(module_path), class_name)
+  if issubclass(entity, BoundEntity):
+    return entity.deserialize(value['data'], bind_client=bind_client)
+  return entity.deserialize(value['data'])
+
+
+def _shared(key, fetch, bind_client):
+  """The result of `fetch()`, or of another process's identical call."""
+  shared_cache = cache.get_cache()
+  cache_key = f'single-flight:{key}'
+
+  cached = shared_cache.get(cache_key)
+  if cached is not None:
+    return _decode(cached, bind_client)
+
+  try:
+    with locks.named_lock(cache_key, timeout_s=LOCK_TIMEOUT_S):
+      # Someone else may have made the request while we waited.
+      cached = shared_cache.get(cache_key)
+      if cached is not None:
+        return _decode(cached, bind_client)
+
+      result = fetch()
+      shared_cache.set(
+        cache_key,
+        _encode(result),
+        current_app.config.get('STRAVA_SINGLE_FLIGHT_TTL_S', 5)
+      )
+      return result
+  except locks.LockTimeout:
+    # Whoever has it is stuck. Don't wait on them any longer.
+    return fetch()
+
+
+class SingleFlightClient(object):
+  """Wraps a Strava client so identical requests for one account's data
+  that overlap make one request.
+
+  Everything but `COALESCED_METHODS` passes straight through.
+
+  Args:
+    client: the client to wrap, usually a `ratelimit.RateLimitedClient`,
+      so only the requests that are made take a rate limit token.
+    key_prefix (str): whose data the client gets, like 'strava:1234'.
+  """
+
+  def __init__(self, client, key_prefix):
+    self._client = client
+    self._key_prefix = key_prefix
+
+  def __getattr__(self, name):
+    attr = getattr(self._client, name)
+    if name not in COALESCED_METHODS:
+      return attr
+    return self._coalesced(name, attr)
+
+  def _coalesced(self, name, method):
+    @functools.wraps(method)
+    def coalesced_method(*args, **kwargs):
+      key = request_key(self._key_prefix, name, args, kwargs)
+      if not current_app.config.get('CACHE_REDIS_URL'):
+        return _in_flight.do(key, lambda: method(*args, **kwargs))
+      return _in_flight.do(
+        key,
+        lambda: _shared(key, lambda: method(*args, **kwargs), bind_client=self)
+      )
+
+    return coalesced_method
@@ -1,12 +1,17 @@
 import datetime
 import math
 
+import numpy as np
+import pandas as pd
+
 
 # Define conversion factors.
 FT_PER_M = 3.28084
 M_PER_MI = 1609.34
 KG_PER_LB = 2.2
 
+# Lookup table for zero-padded minutes and seconds.
+_TWO_DIGITS = np.array([f'{i:02d}' for i in range(60)], dtype=object)
 
 
 def pace_to_speed(pace_string):
@@ -50,6 +55,32 @@ def speed_to_pace(speed_ms):
   return datetime_to_string(mile_pace_time)
 
 
+def speed_to_pace_series(speed_ms):
+  """Array-aware version of `speed_to_pace`.
+
+  Formats a whole Series of speeds at once using integer math,
+  rather than building a `datetime.time` for each value.
+
+  Args:
+    speed_ms (pandas.Series or array-like): speeds in meters per second.
+
+  Returns:
+    pandas.Series: mile paces as strings, eg '7:30', with the index of
+    `speed_ms`. Missing speeds become None.
+  """
+  speed_ms = pd.Series(speed_ms, dtype='float64')
+  is_stopped = (speed_ms <= 0.1).to_numpy()
+
+  with np.errstate(divide='ignore', invalid='ignore'):
+    pace_min_mile = M_PER_MI / (speed_ms.to_numpy() * 60.0)
+  pace_secs = np.where(is_stopped, np.nan, np.floor(pace_min_mile * 60.0))
+
+  paces = seconds_to_string_series(pd.Series(pace_secs, index=speed_ms.index))
+  paces[is_stopped] = '24:00:00'
+
+  return paces
+
+
 def seconds_to_datetime(seconds):
   if seconds is None:
     return None
@@ -66,6 +97,41 @@ def seconds_to_string(seconds, show_hour=False):
   return datetime_to_string(time_dt, show_hour=show_hour)
 
 
+def seconds_to_string_series(seconds, show_hour=False):
+  """Array-aware version of `seconds_to_string`.
+
+  Args:
+    seconds (pandas.Series or array-like): durations in seconds.
+    show_hour (bool): Always include the hour, even when it is zero.
+      Default False.
+
+  Returns:
+    pandas.Series: durations as strings, eg '1:02:03' or '2:03', with
+    the index of `seconds`. Missing values become None.
+  """
+  seconds = pd.Series(seconds, dtype='float64')
+  is_valid = seconds.notna().to_numpy()
+
+  # Like `seconds_to_string`, drop fractional seconds and whole days.
+  total_secs = np.floor(seconds.fillna(0).to_numpy()).astype('int64') % 86400
+  hrs = total_secs // 3600
+  mins = total_secs // 60 % 60
+  secs = _TWO_DIGITS[total_secs % 60]
+
+  with_hour = hrs.astype(str).astype(object) + ':' + _TWO_DIGITS[mins] + ':' + secs
+  if show_hour:
+    strings = with_hour
+  else:
+    without_hour = mins.astype(str).astype(object) + ':' + secs
+    strings = np.where(hrs > 0, with_hour, without_hour)
+
+  return pd.Series(
+    np.where(is_valid, strings, None),
+    index=seconds.index,
+    name=seconds.name,
+  )
+
+
 def string_to_seconds(pace_str):
   times = [float(t) for t in pace_str.split(':')]
   
@@ -0,0 +1,226 @@
+"""Save activity files as they show up in a folder.
+
+Meant for a folder that watches sync their files to. The folder (not
+its subfolders) is watched with inotify where that's available, and
+polled otherwise. A file is only read once it has stopped changing for
+a moment, so files that are still being written get left alone.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from application import importer
+from application.models import db
+from application.util import readers
+
+
+class _Inotify(object):
+  """Just enough of the Linux inotify API, via libc.
+
+  https://man7.org/linux/man-pages/man7/inotify.7.html
+  """
+  IN_MODIFY = 0x00000002
+  IN_CLOSE_WRITE = 0x00000008
+  IN_MOVED_TO = 0x00000080
+  IN_CREATE = 0x00000100
+
+  EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+
+  def __init__(self, directory):
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+    self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if self.fd < 0:
+      raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+    if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+      errno = ctypes.get_errno()
+      os.close(self.fd)
+      raise OSError(errno, f'inotify_add_watch failed for {directory}')
+
+  def read(self, timeout):
+    """Wait up to `timeout` seconds for events, and return the names
+    of the files they happened to."""
+    readable, _, _ = select.select([self.fd], [], [], timeout)
+    if not readable:
+      return []
+
+    data = os.read(self.fd, 64 * 1024)
+    names = []
+    pos = 0
+    while pos < len(data):
+      _, _, _, name_len = self.EVENT_HEADER.unpack_from(data, pos)
+      pos += self.EVENT_HEADER.size
+      names.append(os.fsdecode(data[pos:pos + name_len].rstrip(b'\0')))
+      pos += name_len
+    return names
+
+  def close(self):
+    os.close(self.fd)
+
+
+class FolderWatcher(object):
+  """Finds activity files in a folder that are new or changed.
+
+  Files already in the folder count as new.
+
+  Args:
+    directory (str): the folder to watch.
+    settle_s (float): how long a file must go unchanged before it is
+      reported.
+    poll_interval_s (float): how often to check for changes when
+      polling, and the longest `poll` waits by default.
+    use_inotify (bool): set False to always poll.
+  """
+  def __init__(self, directory, settle_s=2.0, poll_interval_s=1.0, use_inotify=True):
+    self.directory = directory
+    self.settle_s = settle_s
+    self.poll_interval_s = poll_interval_s
+
+    self._inotify = None
+    if use_inotify:
+      try:
+        self._inotify = _Inotify(directory)
+      except (OSError, AttributeError) as e:
+        # No inotify here (eg not Linux)
+        print(f'Polling {directory} for changes: {e}')
+
+    # Path: (size, mtime) at the last poll.
+    self._snapshot = self._scan()
+    # Path: monotonic time of its latest change.
+    self._pending = dict.fromkeys(self._snapshot, time.monotonic())
+
+  @property
+  def uses_inotify(self):
+    return self._inotify is not None
+
+  def _scan(self):
+    snapshot = {}
+    with os.scandir(self.directory) as entries:
+      for entry in entries:
+        if (
+          entry.is_file()
+          and os.path.splitext(entry.name)[1].lower() in readers.ACTIVITY_FILE_READERS
+        ):
+          stat = entry.stat()
+          snapshot[entry.path] = (stat.st_size, stat.st_mtime_ns)
+    return snapshot
+
+  def poll(self, timeout=None):
+    """Wait for changes, then report the files that have settled.
+
+    Args:
+      timeout (float): seconds to wait for changes. Defaults to
+        `poll_interval_s`.
+
+    Returns:
+      list(str): paths of files that have gone `settle_s` seconds
+      without changing, each reported once per change.
+    """
+    timeout = self.poll_interval_s if timeout is None else timeout
+
+    if self._inotify:
+      names = self._inotify.read(timeout)
+      now = time.monotonic()
+      for name in names:
+        if os.path.splitext(name)[1].lower() in readers.ACTIVITY_FILE_READERS:
+          self._pending[os.path.join(self.directory, name)] = now
+    else:
+      time.sleep(timeout)
+      snapshot = self._scan()
+      now = time.monotonic()
+      for path, stat in snapshot.items():
+        if self._snapshot.get(path) != stat:
+          self._pending[path] = now
+      self._snapshot = snapshot
+
+    settled = sorted(
+      path for path, changed in self._pending.items()
+      if now - changed >= self.settle_s
+    )
+    for path in settled:
+      del self._pending[path]
+
+    return [path for path in settled if os.path.isfile(path)]
+
+  def close(self):
+    if self._inotify:
+      self._inotify.close()
+
+
+def watch(directory, handle_overlap='existing', max_workers=None,
+          settle_s=2.0, use_inotify=True, echo=print, should_stop=None):
+  """Save activity files from a folder as they arrive, until stopped.
+
+  Files are parsed on a pool of worker processes and saved one at a
+  time, as soon as each is ready. Must be called within an app context.
+
+  Args:
+    directory (str): the folder to watch.
+    handle_overlap (str): what to do when saved activities overlap a new
+      one: 'existing', 'both' or 'incoming', as for activities from
+      Strava.
+    max_workers (int): number of worker processes. Defaults to the
+      number of CPUs.
+    settle_s (float): how long a file must go unchanged before it is
+      read.
+    use_inotify (bool): set False to always poll the folder.
+    echo (callable): reports progress.
+    should_stop (callable): checked every loop; returns True to stop.
+      By default, runs until interrupted.
+  """
+  should_stop = should_stop or (lambda: False)
+  watcher = FolderWatcher(directory, settle_s=settle_s, use_inotify=use_inotify)
+  echo(
+    f'Watching {directory} '
+    f'({"inotify" if watcher.uses_inotify else "polling"})'
+  )
+
+  saved_hashes = importer.saved_source_hashes()
+  # (path, hash) of the file each pending parse is for.
+  in_progress = {}
+
+  try:
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+      while not should_stop():
+        for path in watcher.poll():
+          try:
+            with open(path, 'rb') as f:
+              data = f.read()
+            source_hash = importer.hash_contents(data)
+          except OSError as e:
+            echo(f'Could not read {path}: {e}')
+            continue
+
+          if (
+            source_hash in saved_hashes
+            or any(source_hash == h for _, h in in_progress.values())
+          ):
+            continue
+          future = executor.submit(
+            importer.parse_activity_path, (path, data, source_hash))
+          in_progress[future] = (path, source_hash)
+
+        for future in [f for f in in_progress if f.done()]:
+          path, source_hash = in_progress.pop(future)
+          try:
+            row, error = future.result()
+            if error:
+              echo(f'Failed to read {error}')
+            elif importer.save_activity(row, handle_overlap=handle_overlap):
+              # Only saved files are passed over from now on, so one that
+              # failed gets another try if it is written again.
+              saved_hashes.add(source_hash)
+              echo(f'Saved {row["title"]} ({row["recorded"]:%Y-%m-%d %H:%M})')
+            else:
+              echo(f'Skipped {row["title"]}: it overlaps a saved activity')
+          except Exception as e:
+            db.session.rollback()
+            echo(f'Failed to save {path}: {e}')
+  finally:
+    watcher.close()
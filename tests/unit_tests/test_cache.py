@@ -0,0 +1,32 @@
+from application.util import cache
+from .base import FlaskTestCase
+from .test_ratelimit import FakeClock
+
+
+class TestDatabaseCache(FlaskTestCase):
+  def setUp(self):
+    super().setUp()
+    self.clock = FakeClock()
+    self.cache = cache.DatabaseCache(clock=self.clock)
+
+  def test_gets_what_was_set(self):
+    self.assertIsNone(self.cache.get('key'))
+
+    self.cache.set('key', {'a': [1, 2]}, ttl_s=10)
+    self.assertEqual(self.cache.get('key'), {'a': [1, 2]})
+
+    self.cache.set('key', 'replaced', ttl_s=10)
+    self.assertEqual(self.cache.get('key'), 'replaced')
+
+  def test_entries_expire(self):
+    self.cache.set('key', 'value', ttl_s=10)
+
+    self.clock.now += 9
+    self.assertEqual(self.cache.get('key'), 'value')
+    self.clock.now += 1
+    self.assertIsNone(self.cache.get('key'))
+
+  def test_delete(self):
+    self.cache.set('key', 'value', ttl_s=10)
+    self.cache.delete('key')
+    self.assertIsNone(self.cache.get('key'))
@@ -1,13 +1,17 @@
 """Holding area for logic that can only be tested with a live dashboard"""
+import sys
+
+from dash.exceptions import PreventUpdate
 from flask import url_for
 import stravalib
 import unittest
 from unittest.mock import patch
 
-from application.models import db, AdminUser, StravaAccount
+from application.models import db, AdminUser, StravaAccount, StravaActivitySummary
 from application.util.mock_stravalib import (
   MOCK_TOKEN, 
-  BatchedResultsIterator as MockBatchIterator
+  BatchedResultsIterator as MockBatchIterator,
+  Client as MockClient
 )
 from .base import (
   AuthenticatedFlaskTestCase,
@@ -162,4 +166,108 @@ class TestManageAccounts(LoggedInFlaskTestCase):
     # TODO: Finish this test
   
   def test_displays_multiple_accounts(self):
-    pass
\ No newline at end of file
+    pass
+
+
+class TestStravaTableQuery(FlaskTestCase):
+  def setUp(self):
+    super().setUp()
+    self.app.config['STRAVALIB_CLIENT'] = 'application.util.mock_stravalib.Client'
+    self.app.config['MOCK_STRAVALIB_ACTIVITY_COUNT'] = 10
+    # The mock client keeps its config on the class.
+    self.addCleanup(setattr, MockClient, '_activity_count', MockClient._activity_count)
+    db.session.add(StravaAccount(strava_id=1, expires_at=0))
+    db.session.commit()
+
+    from application import tasks
+    tasks.sync_activity_summaries(StravaAccount.query.get(1))
+
+    self.page = sys.modules['pages.strava_table']
+
+  def strava_ids(self, **kwargs):
+    return [
+      activity.strava_id
+      for activity, *_ in self.page.table_query(1, **kwargs)
+    ]
+
+  def test_newest_first_by_default(self):
+    ids = self.strava_ids()
+
+    self.assertEqual(len(ids), 10)
+    dates = [StravaActivitySummary.query.get(i).start_date for i in ids]
+    self.assertEqual(dates, sorted(dates, reverse=True))
+
+  def test_sorts_across_every_activity(self):
+    ids = self.strava_ids(sort_by=[{'column_id': 'Time', 'direction': 'asc'}])
+
+    times = [StravaActivitySummary.query.get(i).moving_time_s for i in ids]
+    self.assertEqual(times, sorted(times))
+
+  def test_filters(self):
+    self.assertEqual(
+      self.strava_ids(filter_query='{Sport} scontains Ride'),
+      [
+        activity.strava_id
+        for activity in StravaActivitySummary.query.filter_by(type='Ride')
+          .order_by(StravaActivitySummary.start_date.desc())
+      ]
+    )
+    self.assertEqual(self.strava_ids(filter_query='{Overlap} s> 0'), [])
+    # Values that don't make sense for a column are ignored.
+    self.assertEqual(len(self.strava_ids(filter_query='{Distance} s> fast')), 10)
+
+  def test_counts_overlaps_for_the_page(self):
+    _, data, page_count = self.page.update_table(0, 4, None, None, 1)
+
+    self.assertEqual(page_count, 3)
+    self.assertEqual([row['Overlap'] for row in data], [0, 0, 0, 0])
+
+
+class TestStravaActivityStreams(FlaskTestCase):
+  def setUp(self):
+    super().setUp()
+    self.app.config['STRAVALIB_CLIENT'] = 'application.util.mock_stravalib.Client'
+    db.session.add(StravaAccount(strava_id=1, expires_at=0))
+    db.session.commit()
+
+    self.page = sys.modules['pages.strava_activity']
+
+  def test_login_required(self):
+    with self.app.test_request_context():
+      with patch.object(self.page.streams, 'get_activity_streams') as get_streams:
+        with self.assertRaises(PreventUpdate):
+          self.page.load_streams({'activity_id': 5, 'strava_id': 1})
+
+    get_streams.assert_not_called()
+
+
+class TestSavedActivityStreams(FlaskTestCase):
+  def setUp(self):
+    super().setUp()
+    self.app.config['STRAVALIB_CLIENT'] = 'application.util.mock_stravalib.Client'
+    self.page = sys.modules['pages.saved_activity']
+
+  def load_streams(self, activity_id):
+    with patch.object(self.page.streams, 'get_activity_streams') as get_streams:
+      with self.assertRaises(PreventUpdate):
+        self.page.load_streams(activity_id)
+    get_streams.assert_not_called()
+
+  def test_unknown_activity(self):
+    self.load_streams(12345)
+
+  def test_activity_without_strava_account(self):
+    activity = self.create_activity()
+    activity.strava_id = 5
+    db.session.commit()
+
+    self.load_streams(activity.id)
+
+  def test_unauthorized_strava_account(self):
+    db.session.add(StravaAccount(strava_id=1, expires_at=0))
+    activity = self.create_activity()
+    activity.strava_id = 5
+    activity.strava_acct_id = 1
+    db.session.commit()
+
+    self.load_streams(activity.id)
@@ -2,9 +2,12 @@ import datetime
 import unittest
 
 from dateutil import tz
+import numpy as np
 import pandas as pd
 
-from application.util.dataframe import calc_ctl_atl
+from application.util import labels  # registers `DataFrame.fld`
+from application.util.dataframe import (
+  calc_best_efforts, calc_ctl_atl, calc_distance)
 
 
 class TestCalcCtlAtl(unittest.TestCase):
@@ -42,3 +45,75 @@ class TestCalcCtlAtl(unittest.TestCase):
 
     self.assertEqual(len(result), 2 * n)
     self.assertEqual((result['tss'].iloc[1::2] == 0.0).sum(), n)
+
+
+class TestCalcBestEfforts(unittest.TestCase):
+  def test_steady_pace(self):
+    # 4 m/s for an hour.
+    df = pd.DataFrame({
+      'time': range(3601),
+      'distance': [4.0 * i for i in range(3601)],
+    })
+
+    result = calc_best_efforts(df, distances=[400.0, 5000.0])
+
+    self.assertAlmostEqual(result[400.0], 100.0)
+    self.assertAlmostEqual(result[5000.0], 1250.0)
+
+  def test_finds_fastest_segment(self):
+    # 3 m/s, then a 2 minute surge at 5 m/s, then 3 m/s again.
+    speeds = [3.0] * 600 + [5.0] * 120 + [3.0] * 600
+    distance = [0.0]
+    for speed in speeds:
+      distance.append(distance[-1] + speed)
+    df = pd.DataFrame({'time': range(len(distance)), 'distance': distance})
+
+    result = calc_best_efforts(df, distances=[400.0])
+
+    self.assertAlmostEqual(result[400.0], 80.0)
+
+  def test_interpolates_segment_start(self):
+    # Records are sparse; segment start falls between them.
+    df = pd.DataFrame({
+      'time': [0, 10, 20, 30],
+      'distance': [0.0, 50.0, 100.0, 150.0],
+    })
+
+    result = calc_best_efforts(df, distances=[120.0])
+
+    self.assertAlmostEqual(result[120.0], 24.0)
+
+  def test_skips_distances_longer_than_activity(self):
+    df = pd.DataFrame({'time': range(11), 'distance': range(0, 1100, 100)})
+
+    result = calc_best_efforts(df)
+
+    self.assertEqual(list(result.keys()), [400.0])
+
+  def test_missing_streams(self):
+    df = pd.DataFrame({'time': range(10)})
+
+    self.assertEqual(calc_best_efforts(df), {})
+
+
+class TestCalcDistance(unittest.TestCase):
+  def test_sums_great_circle_steps(self):
+    # A thousandth of a degree of latitude is about 111 m.
+    df = pd.DataFrame({
+      'time': range(4),
+      'lat': [40.0, 40.001, np.nan, 40.002],
+      'lon': [-105.0, -105.0, np.nan, -105.0],
+    })
+
+    calc_distance(df)
+
+    np.testing.assert_allclose(
+      df['distance'], [0.0, 111.2, 111.2, 222.4], atol=0.1)
+
+  def test_keeps_recorded_distance(self):
+    df = pd.DataFrame({
+      'lat': [40.0, 40.001], 'lon': [-105.0, -105.0], 'distance': [0.0, 100.0]})
+
+    calc_distance(df)
+
+    self.assertEqual(df['distance'].to_list(), [0.0, 100.0])
@@ -0,0 +1,185 @@
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import zipfile
+
+from application import importer
+from application.models import db, Activity, BestEffort, UserSettings
+from .base import FlaskTestCase
+from .test_readers import TESTDATA_DIR, build_fit
+
+
+class TestImportFiles(FlaskTestCase):
+  def setUp(self):
+    super().setUp()
+    db.session.add(UserSettings())
+    db.session.commit()
+
+    self.tmpdir = tempfile.mkdtemp()
+    os.mkdir(os.path.join(self.tmpdir, 'more'))
+    for fname in ('testdata.tcx', 'testdata.gpx'):
+      shutil.copy(os.path.join(TESTDATA_DIR, fname), self.tmpdir)
+    # Same contents, different name.
+    shutil.copy(
+      os.path.join(TESTDATA_DIR, 'testdata.tcx'),
+      os.path.join(self.tmpdir, 'more', 'copy.TCX')
+    )
+    with open(os.path.join(self.tmpdir, 'more', 'run.fit'), 'wb') as f:
+      f.write(build_fit(n=120))
+    with open(os.path.join(self.tmpdir, 'notes.txt'), 'w') as f:
+      f.write('not an activity')
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+    super().tearDown()
+
+  def import_all(self, **kwargs):
+    paths = importer.find_activity_files(self.tmpdir)
+    return importer.import_files(paths, max_workers=1, echo=lambda msg: None, **kwargs)
+
+  def test_find_activity_files(self):
+    self.assertEqual(
+      [os.path.relpath(p, self.tmpdir) for p in importer.find_activity_files(self.tmpdir)],
+      [os.path.join('more', 'copy.TCX'), os.path.join('more', 'run.fit'),
+       'testdata.gpx', 'testdata.tcx']
+    )
+
+  def test_imports_files(self):
+    stats = self.import_all(batch_size=2)
+
+    self.assertEqual(stats['imported'], 3)
+    self.assertEqual(stats['skipped'], 1)
+    self.assertEqual(stats['failed'], 0)
+    self.assertEqual(Activity.query.count(), 3)
+
+    activity = Activity.query.filter_by(title='run').one()
+    self.assertEqual(activity.elapsed_time_s, 119)
+    self.assertEqual(activity.moving_time_s, 119)
+    self.assertAlmostEqual(activity.distance_m, 357.0)
+    self.assertAlmostEqual(activity.ngp_ms, 3.0)
+    self.assertEqual(len(activity.source_hash), 64)
+    self.assertEqual(activity.best_efforts, [])  # shorter than 400m
+
+  def test_gpx_distance_from_positions(self):
+    self.import_all()
+
+    with open(os.path.join(TESTDATA_DIR, 'testdata.gpx'), 'rb') as f:
+      source_hash = importer.hash_contents(f.read())
+    activity = Activity.query.filter_by(source_hash=source_hash).one()
+    self.assertGreater(activity.distance_m, 0)
+
+  def test_saves_best_efforts(self):
+    with open(os.path.join(self.tmpdir, 'long.fit'), 'wb') as f:
+      f.write(build_fit(n=200))
+
+    self.import_all()
+
+    activity = Activity.query.filter_by(title='long').one()
+    self.assertEqual(len(activity.best_efforts), 1)
+    self.assertAlmostEqual(BestEffort.fastest(400.0)[0].elapsed_time_s, 400 / 3)
+
+  def test_skips_saved_files(self):
+    self.import_all()
+
+    stats = self.import_all()
+
+    self.assertEqual(stats['imported'], 0)
+    self.assertEqual(stats['skipped'], 4)
+    self.assertEqual(Activity.query.count(), 3)
+
+  def test_reports_unreadable_files(self):
+    with open(os.path.join(self.tmpdir, 'broken.fit'), 'wb') as f:
+      f.write(b'garbage')
+
+    stats = self.import_all()
+
+    self.assertEqual(stats['failed'], 1)
+    self.assertEqual(stats['imported'], 3)
+
+
+def build_strava_export():
+  """A Strava bulk export ZIP, in memory."""
+  with open(os.path.join(TESTDATA_DIR, 'testdata.gpx'), 'rb') as f:
+    gpx = f.read()
+
+  rows = [
+    'Activity ID,Activity Date,Activity Name,Activity Type,Activity Description,'
+    'Elapsed Time,Distance,Filename,Distance',
+    '101,"Apr 16, 2021, 1:37:53 PM",Morning Run,Run,"Hilly, windy",120,0.36,'
+    'activities/101.fit.gz,357.0',
+    '102,"Apr 17, 2021, 1:37:53 PM",Evening Walk,Walk,,222,0.16,'
+    'activities/102.gpx,158.7',
+    '103,"Apr 18, 2021, 1:37:53 PM",Commute,Ride,,600,3.0,'
+    'activities/103.fit.gz,3000.0',
+    '104,"Apr 19, 2021, 1:37:53 PM",Treadmill,Run,,1800,5.0,,5000.0',
+  ]
+
+  buf = io.BytesIO()
+  with zipfile.ZipFile(buf, 'w') as zf:
+    zf.writestr('activities.csv', '\n'.join(rows) + '\n')
+    zf.writestr('activities/101.fit.gz', gzip.compress(build_fit(n=120)))
+    zf.writestr('activities/102.gpx', gpx)
+    zf.writestr('activities/103.fit.gz', gzip.compress(build_fit(n=600)))
+  buf.seek(0)
+  return buf
+
+
+class TestImportStravaExport(FlaskTestCase):
+  def import_export(self, **kwargs):
+    return importer.import_strava_export(
+      build_strava_export(), max_workers=1, echo=lambda msg: None, **kwargs)
+
+  def test_imports_activities(self):
+    stats = self.import_export()
+
+    self.assertEqual(stats['imported'], 2)
+    self.assertEqual(stats['skipped'], 2)  # the ride, and no file
+    self.assertEqual(stats['failed'], 0)
+
+    run = Activity.query.filter_by(strava_id=101).one()
+    self.assertEqual(run.title, 'Morning Run')
+    self.assertEqual(run.description, 'Hilly, windy')
+    self.assertEqual(run.elapsed_time_s, 119)
+    self.assertAlmostEqual(run.distance_m, 357.0)
+    self.assertEqual(
+      Activity.query.filter_by(strava_id=102).one().title, 'Evening Walk')
+
+  def test_skips_saved_activities(self):
+    self.import_export()
+
+    stats = self.import_export()
+
+    self.assertEqual(stats['imported'], 0)
+    self.assertEqual(stats['skipped'], 4)
+    self.assertEqual(Activity.query.count(), 2)
+
+  def test_skips_files_imported_from_elsewhere(self):
+    tmpdir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, tmpdir)
+    shutil.copy(os.path.join(TESTDATA_DIR, 'testdata.gpx'), tmpdir)
+    importer.import_files(importer.find_activity_files(tmpdir),
+                          max_workers=1, echo=lambda msg: None)
+
+    stats = self.import_export()
+
+    self.assertEqual(stats['imported'], 1)
+    self.assertEqual(Activity.query.count(), 2)
+
+
+class TestCopyBuffer(FlaskTestCase):
+  def test_nulls_stay_distinct_from_text(self):
+    buf = importer._copy_buffer(
+      ['title', 'description', 'strava_id'],
+      [
+        {'title': r'\N', 'description': None, 'strava_id': 5},
+        {'title': '', 'description': 'Hills, "tempo"\nthen home'},
+      ]
+    )
+
+    self.assertEqual(
+      buf.getvalue(),
+      '"\\N",,"5"\n'
+      '"","Hills, ""tempo""\nthen home",\n'
+    )
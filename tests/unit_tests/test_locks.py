@@ -0,0 +1,47 @@
+import threading
+
+from application.util import locks
+from .base import FlaskTestCase
+
+
+class TestNamedLock(FlaskTestCase):
+  def test_shuts_out_other_holders(self):
+    held = threading.Event()
+    release = threading.Event()
+
+    def hold():
+      with self.app.app_context():
+        with locks.named_lock('test'):
+          held.set()
+          release.wait(5)
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    self.addCleanup(thread.join)
+    self.addCleanup(release.set)
+    held.wait(5)
+
+    with self.assertRaises(locks.LockTimeout):
+      with locks.named_lock('test', timeout_s=0.1):
+        pass
+
+    # Other names aren't held.
+    with locks.named_lock('other', timeout_s=0.1):
+      pass
+
+  def test_waits_for_release(self):
+    held = threading.Event()
+
+    def hold():
+      with self.app.app_context():
+        with locks.named_lock('test'):
+          held.set()
+          threading.Event().wait(0.2)
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    self.addCleanup(thread.join)
+    held.wait(5)
+
+    with locks.named_lock('test', timeout_s=5):
+      self.assertFalse(thread.is_alive())
@@ -1,14 +1,26 @@
+import contextlib
 import datetime
+import time
+from unittest import mock
 
 import pytz
 from sqlalchemy import exc
 
 from application import db
-from application.models import Activity, AdminUser, StravaAccount, UserSettings
-from application.util import units
+from application.models import (Activity, AdminUser, BestEffort,
+  RATE_LIMITED_PROFILE, StravaAccount, StravaActivitySummary, UserSettings)
+from application.util import cache, locks, units
+from application.util.mock_stravalib import Client
 from .base import FlaskTestCase
 
 
+NEW_TOKEN = dict(
+  access_token='token-2',
+  refresh_token='refresh-2',
+  expires_at=int(datetime.datetime(2100, 1, 1).timestamp()),
+)
+
+
 class ActivityModelTest(FlaskTestCase):
 
   def test_saving_and_retrieving_items(self):
@@ -133,6 +145,91 @@ class ActivityModelTest(FlaskTestCase):
       2
     )
 
+  def test_resolve_overlaps(self):
+    saved_8_9 = self.create_activity(
+      recorded=datetime.datetime(2019, 12, 4, hour=8),
+      elapsed_time_s=3600,
+    )
+    saved_11_12 = self.create_activity(
+      recorded=datetime.datetime(2019, 12, 4, hour=11),
+      elapsed_time_s=3600,
+    )
+
+    # Incoming:    |_a_|   |_b_|  |_c_|
+    # Saved:         |______|      |______|
+    intervals = [
+      (datetime.datetime(2019, 12, 4, hour=9, minute=30),
+       datetime.datetime(2019, 12, 4, hour=10, minute=30)),
+      (datetime.datetime(2019, 12, 4, hour=7, minute=30),
+       datetime.datetime(2019, 12, 4, hour=8, minute=30)),
+      (datetime.datetime(2019, 12, 4, hour=10),
+       datetime.datetime(2019, 12, 4, hour=11, minute=15)),
+    ]
+
+    self.assertEqual(
+      Activity.resolve_overlaps(intervals, handle_overlap='existing'),
+      [True, False, False]  # the last overlaps both saved and incoming
+    )
+    self.assertEqual(
+      Activity.resolve_overlaps(intervals, handle_overlap='both'),
+      [True, True, True]
+    )
+    self.assertEqual(Activity.query.count(), 2)
+
+    self.assertEqual(
+      Activity.resolve_overlaps(intervals, handle_overlap='incoming'),
+      [False, True, True]  # the last replaces an earlier incoming one
+    )
+    self.assertEqual(Activity.query.count(), 0)
+
+  def test_resolve_overlaps_after_a_long_activity(self):
+    self.create_activity(
+      recorded=datetime.datetime(2019, 12, 4, hour=11),
+      elapsed_time_s=1800,
+    )
+
+    # Incoming:  |______a______|
+    #             |b|
+    # Saved:              |_|
+    intervals = [
+      (datetime.datetime(2019, 12, 4, hour=8),
+       datetime.datetime(2019, 12, 4, hour=12)),
+      (datetime.datetime(2019, 12, 4, hour=8, minute=10),
+       datetime.datetime(2019, 12, 4, hour=8, minute=20)),
+    ]
+
+    self.assertEqual(
+      Activity.resolve_overlaps(intervals, handle_overlap='existing'),
+      [False, True]
+    )
+    self.assertEqual(
+      Activity.resolve_overlaps(intervals, handle_overlap='incoming'),
+      [False, True]  # b replaces a, which had replaced the saved one
+    )
+    self.assertEqual(Activity.query.count(), 0)
+
+  def test_resolve_overlaps_with_a_long_saved_activity(self):
+    # Started well before the batch, and still going.
+    self.create_activity(
+      recorded=datetime.datetime(2019, 12, 4, hour=2),
+      elapsed_time_s=10 * 3600,
+    )
+    self.create_activity(
+      recorded=datetime.datetime(2019, 12, 3, hour=9),
+      elapsed_time_s=3600,
+    )
+
+    intervals = [
+      (datetime.datetime(2019, 12, 4, hour=9),
+       datetime.datetime(2019, 12, 4, hour=10)),
+    ]
+
+    self.assertEqual(
+      Activity.resolve_overlaps(intervals, handle_overlap='existing'), [False])
+    self.assertEqual(
+      Activity.resolve_overlaps(intervals, handle_overlap='incoming'), [True])
+    self.assertEqual(Activity.query.count(), 1)
+
   def test_intensity_factor(self):
     db.session.add(UserSettings())
     db.session.commit()
@@ -183,6 +280,109 @@ class ActivityModelTest(FlaskTestCase):
     )
 
 
+class BestEffortModelTest(FlaskTestCase):
+
+  def test_fastest(self):
+    for i, elapsed_time_s in enumerate([400.0, 380.0, 420.0]):
+      activity = self.create_activity(title=f'Activity {i}')
+      activity.best_efforts = [
+        BestEffort(distance_m=units.M_PER_MI, elapsed_time_s=elapsed_time_s),
+        BestEffort(distance_m=5000.0, elapsed_time_s=5 * elapsed_time_s),
+      ]
+    db.session.commit()
+
+    fastest = BestEffort.fastest(units.M_PER_MI, limit=2)
+
+    self.assertEqual([e.elapsed_time_s for e in fastest], [380.0, 400.0])
+    self.assertEqual(fastest[0].activity.title, 'Activity 1')
+
+  def test_cannot_save_duplicate_distance(self):
+    activity = self.create_activity()
+    activity.best_efforts = [
+      BestEffort(distance_m=400.0, elapsed_time_s=80.0),
+      BestEffort(distance_m=400.0, elapsed_time_s=90.0),
+    ]
+    with self.assertRaisesRegex(exc.IntegrityError, 'UNIQUE constraint failed'):
+      db.session.commit()
+
+  def test_deleted_with_activity(self):
+    activity = self.create_activity()
+    activity.best_efforts = [BestEffort(distance_m=400.0, elapsed_time_s=80.0)]
+    db.session.commit()
+
+    db.session.delete(activity)
+    db.session.commit()
+
+    self.assertEqual(BestEffort.query.count(), 0)
+
+
+def summary(strava_id, start_date, name='Morning Run', type='Run', elapsed_time=3600):
+  return dict(
+    id=strava_id,
+    name=name,
+    type=type,
+    start_date=start_date,
+    start_date_local=start_date.replace('Z', ''),
+    timezone='(GMT-07:00) America/Denver',
+    moving_time=elapsed_time - 60,
+    elapsed_time=elapsed_time,
+    distance=10000.0,
+    total_elevation_gain=100.0,
+  )
+
+
+class StravaActivitySummaryModelTest(FlaskTestCase):
+  def setUp(self):
+    super().setUp()
+    db.session.add(StravaAccount(strava_id=1, expires_at=0))
+    db.session.commit()
+
+  def test_upsert_adds_and_updates(self):
+    StravaActivitySummary.upsert(1, [
+      summary(10, '2019-04-14T12:44:02Z'),
+      summary(11, '2019-04-15T12:44:02Z'),
+    ])
+    StravaActivitySummary.upsert(1, [
+      summary(10, '2019-04-14T12:44:02Z', name='Renamed'),
+    ])
+
+    self.assertEqual(StravaActivitySummary.query.count(), 2)
+    updated = StravaActivitySummary.query.get(10)
+    self.assertEqual(updated.name, 'Renamed')
+    self.assertEqual(updated.start_date, datetime.datetime(2019, 4, 14, 12, 44, 2))
+
+  def test_table_query_flags_saved_and_overlapping(self):
+    StravaActivitySummary.upsert(1, [
+      summary(10, '2019-04-14T12:44:02Z'),
+      summary(11, '2019-04-15T12:44:02Z'),
+      summary(12, '2019-04-16T12:44:02Z'),
+    ])
+    saved = self.create_activity(
+      recorded=datetime.datetime(2019, 4, 14, 12, 44, 2), elapsed_time_s=3600)
+    saved.strava_id = 10
+    # Starts halfway through activity 11.
+    self.create_activity(
+      recorded=datetime.datetime(2019, 4, 15, 13, 14, 2), elapsed_time_s=3600)
+    # Starts right as activity 12 ends.
+    self.create_activity(
+      recorded=datetime.datetime(2019, 4, 16, 13, 44, 2), elapsed_time_s=3600)
+    db.session.commit()
+
+    query, _, _ = StravaActivitySummary.table_query(1, with_overlap_count=True)
+    rows = {
+      activity.strava_id: (saved, overlap_count)
+      for activity, saved, overlap_count in query
+    }
+    self.assertEqual(rows, {10: (True, 1), 11: (False, 1), 12: (False, 0)})
+
+    # Counted in Python for a page of rows, the same as in SQL.
+    query, _, _ = StravaActivitySummary.table_query(1)
+    activities = [activity for activity, _ in query]
+    self.assertEqual(
+      StravaActivitySummary.overlap_counts(activities), {10: 1, 11: 1, 12: 0})
+    self.assertEqual(StravaActivitySummary.overlap_counts([]), {})
+
+
 class AdminUserModelTest(FlaskTestCase):
 
   def test_user_is_valid_with_id_only(self):
@@ -218,3 +418,91 @@ class StravaAccountModelTest(FlaskTestCase):
       strava_acct.access_token,
       '4190a7feccff6acaeb6a78cadda52e65de85a75es'
     )
+
+  def test_client_is_pooled(self):
+    self.app.config['STRAVALIB_CLIENT'] = 'application.util.mock_stravalib.Client'
+    expires_at = int(datetime.datetime(2100, 1, 1).timestamp())
+    strava_acct = StravaAccount(
+      strava_id=1, access_token='token-1', expires_at=expires_at)
+    other_acct = StravaAccount(
+      strava_id=2, access_token='token-2', expires_at=expires_at)
+    db.session.add_all((strava_acct, other_acct))
+    db.session.commit()
+
+    # Under the single-flight and rate-limiting wrappers.
+    pooled = lambda acct: acct.client._client._client
+
+    client = pooled(strava_acct)
+    self.assertEqual(client.access_token, 'token-1')
+    self.assertIs(pooled(strava_acct), client)
+    self.assertIsNot(pooled(other_acct), client)
+
+    # Refreshing the token means a new client.
+    strava_acct.expires_at = 0
+    self.assertIsNot(pooled(strava_acct), client)
+    self.assertEqual(pooled(strava_acct).access_token, strava_acct.access_token)
+
+  def test_refreshes_token_ahead_of_expiry(self):
+    self.app.config['STRAVALIB_CLIENT'] = 'application.util.mock_stravalib.Client'
+    strava_acct = StravaAccount(
+      strava_id=1,
+      access_token='token-1',
+      expires_at=int(time.time()) + 60
+    )
+    db.session.add(strava_acct)
+    db.session.commit()
+
+    with mock.patch.object(
+      Client, 'refresh_access_token', return_value=NEW_TOKEN) as refresh:
+      self.assertEqual(strava_acct.get_token()['access_token'], 'token-2')
+      self.assertEqual(strava_acct.get_token()['access_token'], 'token-2')
+    refresh.assert_called_once()
+
+  def test_uses_token_refreshed_elsewhere(self):
+    self.app.config['STRAVALIB_CLIENT'] = 'application.util.mock_stravalib.Client'
+    strava_acct = StravaAccount(strava_id=1, access_token='token-1', expires_at=0)
+    db.session.add(strava_acct)
+    db.session.commit()
+
+    @contextlib.contextmanager
+    def refreshed_while_waiting(name):
+      # Another process refreshes the token while this one waits.
+      with db.engine.begin() as conn:
+        conn.execute(
+          StravaAccount.__table__.update().values(**NEW_TOKEN))
+      yield
+
+    with mock.patch.object(
+      locks, 'named_lock', refreshed_while_waiting
+    ), mock.patch.object(Client, 'refresh_access_token') as refresh:
+      self.assertEqual(strava_acct.get_token(), NEW_TOKEN)
+    refresh.assert_not_called()
+
+  def test_load_athletes(self):
+    self.app.config['STRAVALIB_CLIENT'] = 'application.util.mock_stravalib.Client'
+    strava_accts = [
+      StravaAccount(
+        strava_id=i, access_token=f'token-{i}', expires_at=NEW_TOKEN['expires_at'])
+      for i in (1, 2, 3)
+    ]
+    db.session.add_all(strava_accts)
+    db.session.commit()
+    cache.get_cache().set(
+      'strava-athlete:1', dict(RATE_LIMITED_PROFILE, firstname='Cached'), 60)
+
+    with mock.patch.object(
+      Client, 'get_athlete', autospec=True, side_effect=Client.get_athlete
+    ) as get_athlete:
+      StravaAccount.load_athletes(strava_accts)
+      self.assertEqual(
+        sorted(call.args[0].access_token for call in get_athlete.call_args_list),
+        ['token-2', 'token-3']
+      )
+
+      self.assertEqual(
+        [acct.firstname for acct in strava_accts], ['Cached', 'Sample', 'Sample'])
+      self.assertEqual(strava_accts[1].run_count, 100)
+
+      # A new page load finds them all cached.
+      StravaAccount.load_athletes(StravaAccount.query.all())
+      self.assertEqual(get_athlete.call_count, 2)
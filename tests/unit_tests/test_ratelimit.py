@@ -0,0 +1,216 @@
+from stravalib.exc import RateLimitExceeded
+
+from application import celery
+from application.models import db, RateLimitBucket, StravaAccount
+from application.util import ratelimit
+from application.util.mock_stravalib import Client
+from .base import FlaskTestCase
+
+
+class FakeClock:
+  def __init__(self, now=1000.0):
+    self.now = now
+
+  def __call__(self):
+    return self.now
+
+
+class TestRateLimiter(FlaskTestCase):
+  def setUp(self):
+    super().setUp()
+    self.clock = FakeClock()
+    # 10 requests per 100 s (one every 10 s), 100 per 10000 s.
+    self.limiter = ratelimit.RateLimiter(
+      {'short': (10, 100), 'long': (100, 10000)},
+      ratelimit.DatabaseBucketStore(),
+      clock=self.clock,
+    )
+
+  def tokens(self, name):
+    return RateLimitBucket.query.get(name).tokens
+
+  def test_takes_from_every_bucket(self):
+    self.limiter.acquire()
+
+    self.assertEqual(self.tokens('short'), 9)
+    self.assertEqual(self.tokens('long'), 99)
+
+  def test_raises_when_empty(self):
+    for _ in range(10):
+      self.limiter.acquire()
+
+    with self.assertRaises(RateLimitExceeded) as cm:
+      self.limiter.acquire()
+    self.assertAlmostEqual(cm.exception.timeout, 10)
+    self.assertEqual(self.tokens('short'), 0)
+
+  def test_failed_take_leaves_every_bucket(self):
+    self.limiter.acquire()
+    RateLimitBucket.query.get('long').tokens = 0
+    db.session.commit()
+
+    with self.assertRaises(RateLimitExceeded):
+      self.limiter.acquire()
+
+    self.assertEqual(self.tokens('short'), 9)
+
+  def test_stores_in_other_processes_share_tokens(self):
+    # Each process has its own store, and its own lock.
+    other = ratelimit.RateLimiter(
+      {'short': (10, 100), 'long': (100, 10000)},
+      ratelimit.DatabaseBucketStore(),
+      clock=self.clock,
+    )
+    for limiter in [self.limiter, other] * 5:
+      limiter.acquire()
+
+    with self.assertRaises(RateLimitExceeded):
+      other.acquire()
+    self.assertEqual(self.tokens('short'), 0)
+
+  def test_refills_over_time(self):
+    for _ in range(10):
+      self.limiter.acquire()
+
+    self.clock.now += 25
+    self.limiter.acquire()
+    self.limiter.acquire()
+
+    with self.assertRaises(RateLimitExceeded):
+      self.limiter.acquire()
+
+  def test_never_refills_past_limit(self):
+    self.limiter.acquire()
+    self.clock.now += 1e6
+
+    self.limiter.acquire()
+
+    self.assertEqual(self.tokens('short'), 9)
+
+  def test_reservations_queue_up(self):
+    for _ in range(10):
+      self.limiter.acquire()
+
+    self.assertAlmostEqual(self.limiter.reserve(max_wait_s=60), 10)
+    self.assertAlmostEqual(self.limiter.reserve(max_wait_s=60), 20)
+    self.assertAlmostEqual(self.limiter.seconds_until_available(), 30)
+
+  def test_seconds_until_available_takes_nothing(self):
+    self.assertEqual(self.limiter.seconds_until_available(), 0)
+    self.assertIsNone(RateLimitBucket.query.get('short'))
+
+    self.limiter.acquire()
+    self.assertEqual(self.limiter.seconds_until_available(), 0)
+    self.assertEqual(self.limiter.seconds_until_available(), 0)
+
+    self.assertEqual(self.tokens('short'), 9)
+
+  def test_background_lane_leaves_interactive_share(self):
+    limiter = ratelimit.RateLimiter(
+      {'short': (10, 100)},
+      ratelimit.DatabaseBucketStore(),
+      interactive_share=0.3,
+      clock=self.clock,
+    )
+    for _ in range(7):
+      limiter.acquire(lane=ratelimit.BACKGROUND)
+
+    with self.assertRaises(RateLimitExceeded) as cm:
+      limiter.acquire(lane=ratelimit.BACKGROUND)
+    self.assertAlmostEqual(cm.exception.timeout, 10)
+    self.assertAlmostEqual(
+      limiter.seconds_until_available(lane=ratelimit.BACKGROUND), 10)
+
+    for _ in range(3):
+      limiter.acquire(lane=ratelimit.INTERACTIVE)
+    with self.assertRaises(RateLimitExceeded):
+      limiter.acquire(lane=ratelimit.INTERACTIVE)
+
+  def test_records_usage_reported_by_strava(self):
+    self.limiter.record_usage({
+      'short': {'usage': 4, 'limit': 10},
+      'long': {'usage': 0, 'limit': 100},  # no report yet
+    })
+
+    self.assertEqual(self.tokens('short'), 6)
+    self.assertIsNone(RateLimitBucket.query.get('long'))
+
+
+@celery.task
+def current_lane_task():
+  return ratelimit.current_lane()
+
+
+class TestLanes(FlaskTestCase):
+  def test_tasks_use_background_lane(self):
+    self.assertEqual(current_lane_task(), ratelimit.BACKGROUND)
+
+  def test_everything_else_uses_interactive_lane(self):
+    self.assertEqual(ratelimit.current_lane(), ratelimit.INTERACTIVE)
+
+
+class FakeIterator:
+  def __init__(self, result_fetcher):
+    self.result_fetcher = result_fetcher
+
+
+class FakeClient(Client):
+  def get_pages(self):
+    return FakeIterator(lambda page=1: [page])
+
+
+class TestRateLimitedClient(FlaskTestCase):
+  def setUp(self):
+    super().setUp()
+    self.clock = FakeClock()
+    self.limiter = ratelimit.RateLimiter(
+      {'short': (3, 300)},
+      ratelimit.DatabaseBucketStore(),
+      clock=self.clock,
+    )
+    self.client = ratelimit.RateLimitedClient(FakeClient(), self.limiter)
+
+  def test_requests_take_tokens(self):
+    self.client.get_activity(5)
+    self.client.get_activity_streams(5)
+
+    self.assertEqual(self.limiter.seconds_until_available(2), 100)
+
+  def test_raises_instead_of_making_request(self):
+    for _ in range(3):
+      self.client.get_activity(5)
+
+    with self.assertRaises(RateLimitExceeded) as cm:
+      self.client.get_activity(5)
+    self.assertAlmostEqual(cm.exception.timeout, 100)
+
+  def test_counts_each_page_of_results(self):
+    pages = self.client.get_pages()
+    pages.result_fetcher(page=2)
+    pages.result_fetcher(page=3)
+
+    with self.assertRaises(RateLimitExceeded):
+      pages.result_fetcher(page=4)
+
+  def test_listing_takes_tokens_per_page(self):
+    listing = self.client.get_activities()
+    self.assertEqual(self.limiter.seconds_until_available(3), 0)
+
+    listing.result_fetcher(page=1, per_page=200)
+    self.assertEqual(self.limiter.seconds_until_available(3), 100)
+
+  def test_passes_through_other_attributes(self):
+    self.assertIsNone(self.client.access_token)
+    self.client.authorization_url(
+      client_id=1, redirect_uri='http://localhost/strava/callback')
+
+    self.assertEqual(self.limiter.seconds_until_available(3), 0)
+
+  def test_accounts_use_rate_limited_clients(self):
+    self.app.config['STRAVALIB_CLIENT'] = 'application.util.mock_stravalib.Client'
+
+    client = StravaAccount.get_client(access_token='token')
+
+    self.assertIsInstance(client, ratelimit.RateLimitedClient)
+    self.assertIs(client._limiter, ratelimit.get_rate_limiter())
+    self.assertEqual(client.lane, ratelimit.INTERACTIVE)
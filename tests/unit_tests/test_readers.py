@@ -0,0 +1,253 @@
+import io
+import json
+import os
+import struct
+import unittest
+
+from fitparse.records import Crc
+import numpy as np
+import pandas as pd
+import stravalib
+
+from application.util import readers
+
+
+SAMPLE_DATA_DIR = os.path.join(
+  os.path.abspath(os.path.dirname(__file__)),
+  'sample_data'
+)
+
+
+def load_sample_streams():
+  with open(os.path.join(SAMPLE_DATA_DIR, 'get_activity_streams.json'), 'r') as f:
+    data = json.load(f)
+  return {stream['type']: stravalib.model.Stream(**stream) for stream in data}
+
+
+# (field number, size, base type) of the record and event messages
+# in `build_fit` files.
+FIT_RECORD_DEF = [
+  (253, 4, 0x86),  # timestamp
+  (0, 4, 0x85),  # position_lat
+  (1, 4, 0x85),  # position_long
+  (5, 4, 0x86),  # distance
+  (2, 2, 0x84),  # altitude
+  (6, 2, 0x84),  # speed
+  (3, 1, 0x02),  # heart_rate
+  (4, 1, 0x02),  # cadence
+]
+FIT_EVENT_DEF = [(253, 4, 0x86), (0, 1, 0x00), (1, 1, 0x00)]
+
+
+def fit_definition(local_mesg_num, global_mesg_num, field_defs, big_endian=False):
+  endian = '>' if big_endian else '<'
+  return (
+    struct.pack(f'{endian}BBBHB', 0x40 | local_mesg_num, 0, big_endian,
+                global_mesg_num, len(field_defs))
+    + b''.join(struct.pack('3B', *field_def) for field_def in field_defs)
+  )
+
+
+def build_fit(n=10, compressed_timestamp=False):
+  """Make a running .fit file with one record message per second.
+
+  Halfway through, the record message is redefined big-endian without
+  heart rate. One early heart rate value is invalid.
+  """
+  t0 = 1000000000
+  messages = [
+    fit_definition(0, 20, FIT_RECORD_DEF),
+    fit_definition(1, 21, FIT_EVENT_DEF),
+    struct.pack('<BIBB', 1, t0, 0, 0),  # timer start
+  ]
+  for i in range(n):
+    values = [
+      t0 + i,
+      int((40.0 + i * 1e-4) * 2 ** 31 / 180),
+      int((-105.0 - i * 1e-4) * 2 ** 31 / 180),
+      i * 300,  # 3m/s, in cm
+      (1600 + i % 100 + 500) * 5,
+      3000,
+      150 + i % 50 if i != 2 else 0xFF,
+      88,
+    ]
+    if i == n // 2:
+      messages.append(fit_definition(0, 20, FIT_RECORD_DEF[:6], big_endian=True))
+    if i >= n // 2:
+      messages.append(struct.pack('>BIiiIHH', 0, *values[:6]))
+    else:
+      messages.append(struct.pack('<BIiiIHHBB', 0, *values))
+  if compressed_timestamp:
+    messages.append(fit_definition(2, 20, FIT_RECORD_DEF[1:4]))
+    messages.append(struct.pack('<BiiI', 0x80 | (2 << 5) | ((t0 + n) & 0x1F),
+                                *values[1:3], n * 300))
+  messages.append(struct.pack('<BIBB', 1, t0 + n, 0, 4))  # timer stop_all
+
+  data = b''.join(messages)
+  header = struct.pack('<BBHI4s', 14, 0x20, 2132, len(data), b'.FIT')
+  header += struct.pack('<H', Crc.calculate(header))
+  return header + data + struct.pack('<H', Crc.calculate(header + data))
+
+
+class TestFromStravaStreams(unittest.TestCase):
+  def setUp(self):
+    self.streams = load_sample_streams()
+
+  def test_dtypes(self):
+    df = readers.from_strava_streams(self.streams)
+
+    self.assertEqual(df[readers.TIME].dtype, np.int32)
+    self.assertEqual(df[readers.CADENCE].dtype, np.int32)
+    self.assertEqual(df[readers.MOVING].dtype, bool)
+    self.assertEqual(df[readers.LAT].dtype, np.float64)
+    self.assertEqual(df[readers.LON].dtype, np.float64)
+    for col in [readers.SPEED, readers.ELEVATION, readers.GRADE,
+                readers.DISTANCE, readers.HEARTRATE, 'temp']:
+      self.assertEqual(df[col].dtype, np.float32, col)
+
+  def test_splits_latlng(self):
+    df = readers.from_strava_streams(self.streams)
+
+    self.assertNotIn('latlng', df.columns)
+    self.assertEqual(len(df), len(self.streams['latlng'].data))
+    self.assertEqual(
+      [df[readers.LAT].iloc[-1], df[readers.LON].iloc[-1]],
+      self.streams['latlng'].data[-1]
+    )
+
+  def test_cadence_in_spm(self):
+    df = readers.from_strava_streams(self.streams)
+
+    self.assertEqual(df[readers.CADENCE].iloc[0], 2 * self.streams['cadence'].data[0])
+
+  def test_gaps_in_integer_stream(self):
+    arrs = readers.decode_strava_stream('cadence', [80, None, 82])
+
+    self.assertEqual(arrs[readers.CADENCE].dtype, np.float32)
+    self.assertTrue(np.isnan(arrs[readers.CADENCE][1]))
+
+  def test_gaps_in_latlng_stream(self):
+    arrs = readers.decode_strava_stream(
+      'latlng', [[40.0, -105.0], None, [40.1, None]])
+
+    np.testing.assert_array_equal(arrs[readers.LAT], [40.0, np.nan, 40.1])
+    np.testing.assert_array_equal(arrs[readers.LON], [-105.0, np.nan, np.nan])
+
+  def test_gaps_in_bool_stream(self):
+    arrs = readers.decode_strava_stream('moving', [True, None, False])
+
+    np.testing.assert_array_equal(arrs[readers.MOVING], [1.0, np.nan, 0.0])
+
+
+TESTDATA_DIR = os.path.join(
+  os.path.dirname(os.path.abspath(os.path.dirname(__file__))),
+  'functional_tests'
+)
+
+
+class TestFromTcx(unittest.TestCase):
+  def setUp(self):
+    self.path = os.path.join(TESTDATA_DIR, 'testdata.tcx')
+
+  def test_columns(self):
+    df = readers.from_tcx(self.path)
+
+    self.assertEqual(
+      df.columns.to_list(),
+      [readers.TIME, readers.LAT, readers.LON, readers.DISTANCE,
+       readers.ELEVATION, readers.HEARTRATE, readers.SPEED, readers.CADENCE]
+    )
+    self.assertEqual(df[readers.TIME].iloc[0], 0)
+    self.assertEqual(df[readers.HEARTRATE].dtype, np.int64)
+
+  def test_accepts_bytes(self):
+    with open(self.path, 'rb') as f:
+      df_bytes = readers.from_tcx(f.read())
+
+    self.assertTrue(df_bytes.equals(readers.from_tcx(self.path)))
+
+  def test_requested_fields_only(self):
+    df = readers.from_tcx(self.path, fields=[readers.LAT, readers.LON])
+
+    self.assertEqual(
+      df.columns.to_list(),
+      [readers.TIME, readers.LAT, readers.LON]
+    )
+
+  def test_bike_cadence_blank_values_and_naive_times(self):
+    tcx = b'''<?xml version="1.0" encoding="UTF-8"?>
+<TrainingCenterDatabase
+  xmlns="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2">
+  <Activities><Activity Sport="Biking">
+    <Id>2019-06-01T12:00:00</Id>
+    <Lap><Track>
+      <Trackpoint>
+        <Time>2019-06-01T12:00:05</Time>
+        <HeartRateBpm><Value> </Value></HeartRateBpm>
+        <Cadence>80</Cadence>
+      </Trackpoint>
+      <Trackpoint>
+        <Time>2019-06-01T12:00:06</Time>
+        <HeartRateBpm><Value>120</Value></HeartRateBpm>
+        <Cadence></Cadence>
+      </Trackpoint>
+    </Track></Lap>
+  </Activity></Activities>
+</TrainingCenterDatabase>'''
+
+    df, start_time = readers._read_tcx(tcx)
+
+    self.assertEqual(start_time, pd.Timestamp('2019-06-01T12:00:00', tz='UTC'))
+    self.assertEqual(df[readers.TIME].to_list(), [5, 6])
+    np.testing.assert_array_equal(df[readers.HEARTRATE], [np.nan, 120])
+    np.testing.assert_array_equal(df[readers.CADENCE], [160, np.nan])
+
+
+class TestFromGpx(unittest.TestCase):
+  def setUp(self):
+    self.path = os.path.join(TESTDATA_DIR, 'testdata.gpx')
+
+  def test_columns(self):
+    df = readers.from_gpx(self.path)
+
+    self.assertEqual(
+      df.columns.to_list(),
+      [readers.TIME, readers.LAT, readers.LON, readers.ELEVATION,
+       readers.HEARTRATE, readers.CADENCE]
+    )
+    self.assertAlmostEqual(df[readers.LAT].iloc[0], 40.0381155777)
+    self.assertTrue(df[readers.TIME].is_monotonic_increasing)
+
+
+class TestFromFit(unittest.TestCase):
+  def test_matches_fitparse(self):
+    data = build_fit()
+
+    df = readers.from_fit(data)
+    expected = readers._read_fit_fitparse(data)[0]
+
+    self.assertEqual(set(df.columns), set(expected.columns))
+    pd.testing.assert_frame_equal(df[expected.columns], expected,
+                                  check_dtype=False)
+
+  def test_values(self):
+    df = readers.from_fit(io.BytesIO(build_fit()))
+
+    self.assertEqual(df[readers.TIME].tolist(), list(range(10)))
+    self.assertAlmostEqual(df[readers.LAT].iloc[0], 40.0, places=6)
+    self.assertAlmostEqual(df[readers.LON].iloc[0], -105.0, places=6)
+    self.assertEqual(df[readers.DISTANCE].iloc[-1], 27.0)
+    self.assertEqual(df[readers.ELEVATION].iloc[3], 1603.0)
+    self.assertTrue((df[readers.SPEED] == 3.0).all())
+    self.assertEqual(df[readers.HEARTRATE].iloc[0], 150)
+    self.assertTrue(np.isnan(df[readers.HEARTRATE].iloc[2]))
+    self.assertTrue(df[readers.HEARTRATE].iloc[5:].isna().all())
+    self.assertEqual(df[readers.CADENCE].iloc[0], 176)
+
+  def test_falls_back_to_fitparse(self):
+    data = build_fit(compressed_timestamp=True)
+
+    df = readers.from_fit(data)
+
+    self.assertEqual(len(df), 11)
+    self.assertEqual(df[readers.TIME].iloc[-1], 10)
@@ -0,0 +1,129 @@
+import datetime
+import threading
+from unittest import mock
+
+import stravalib
+
+from application.models import db, StravaAccount
+from application.util import cache, singleflight
+from application.util.mock_stravalib import Client
+from .base import FlaskTestCase
+
+
+def use_shared_cache(app):
+  """Results are only shared through Redis, which the database cache
+  stands in for here."""
+  app.config['CACHE_REDIS_URL'] = 'redis://localhost:6379/0'
+  app.extensions['shared_cache'] = cache.DatabaseCache()
+
+
+class FakeClient(object):
+  def __init__(self):
+    self.calls = []
+    self.release = threading.Event()
+    self.release.set()
+
+  def get_athlete_stats(self, athlete_id):
+    self.calls.append(athlete_id)
+    self.release.wait(5)
+    return stravalib.model.AthleteStats(
+      all_run_totals=stravalib.model.ActivityTotals(count=athlete_id))
+
+  def get_athlete(self):
+    raise RuntimeError('Strava is down')
+
+  def get_activities(self):
+    self.calls.append('get_activities')
+
+
+class TestSingleFlightClient(FlaskTestCase):
+  def setUp(self):
+    super().setUp()
+    self.fake = FakeClient()
+    self.client = singleflight.SingleFlightClient(self.fake, key_prefix='strava:1')
+
+  def test_concurrent_duplicates_make_one_request(self):
+    self.fake.release.clear()
+    results = []
+
+    def get_stats():
+      with self.app.app_context():
+        results.append(self.client.get_athlete_stats(3))
+
+    threads = [threading.Thread(target=get_stats) for _ in range(3)]
+    for thread in threads:
+      thread.start()
+    self.fake.release.set()
+    for thread in threads:
+      thread.join()
+
+    self.assertEqual(self.fake.calls, [3])
+    self.assertEqual([stats.all_run_totals.count for stats in results], [3, 3, 3])
+
+  def test_shares_result_with_other_processes(self):
+    use_shared_cache(self.app)
+    self.client.get_athlete_stats(3)
+
+    # Another process has its own client, but the same cache.
+    other = singleflight.SingleFlightClient(FakeClient(), key_prefix='strava:1')
+    stats = other.get_athlete_stats(3)
+
+    self.assertEqual(other._client.calls, [])
+    self.assertIsInstance(stats, stravalib.model.AthleteStats)
+    self.assertEqual(stats.all_run_totals.count, 3)
+
+  def test_doesnt_share_through_the_database(self):
+    self.app.config['CACHE_REDIS_URL'] = None
+    self.client.get_athlete_stats(3)
+
+    other = singleflight.SingleFlightClient(FakeClient(), key_prefix='strava:1')
+    other.get_athlete_stats(3)
+
+    self.assertEqual(other._client.calls, [3])
+    self.assertIsNone(cache.get_cache().get(
+      'single-flight:' + singleflight.request_key('strava:1', 'get_athlete_stats', (3,), {})))
+
+  def test_different_requests_arent_shared(self):
+    self.client.get_athlete_stats(3)
+    self.client.get_athlete_stats(4)
+    singleflight.SingleFlightClient(
+      self.fake, key_prefix='strava:2').get_athlete_stats(3)
+
+    self.assertEqual(self.fake.calls, [3, 4, 3])
+
+  def test_errors_arent_shared_after(self):
+    for _ in range(2):
+      with self.assertRaises(RuntimeError):
+        self.client.get_athlete()
+
+  def test_other_methods_pass_through(self):
+    self.client.get_activities()
+    self.client.get_activities()
+
+    self.assertEqual(self.fake.calls, ['get_activities', 'get_activities'])
+
+
+class TestAccountClients(FlaskTestCase):
+  def setUp(self):
+    super().setUp()
+    self.app.config['STRAVALIB_CLIENT'] = 'application.util.mock_stravalib.Client'
+    self.strava_acct = StravaAccount(
+      strava_id=1,
+      access_token='token',
+      expires_at=int(datetime.datetime(2100, 1, 1).timestamp())
+    )
+    db.session.add(self.strava_acct)
+    db.session.commit()
+
+  def test_page_and_task_share_streams(self):
+    use_shared_cache(self.app)
+    with mock.patch.object(
+      Client, 'get_activity_streams', autospec=True,
+      side_effect=Client.get_activity_streams
+    ) as get_activity_streams:
+      streams = self.strava_acct.client.get_activity_streams(5, types=['time'])
+      task_streams = StravaAccount.get_client(
+        access_token='token', strava_id=1).get_activity_streams(5, types=['time'])
+
+    get_activity_streams.assert_called_once()
+    self.assertEqual(task_streams['time'].data, streams['time'].data)
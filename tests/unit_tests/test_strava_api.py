@@ -1,11 +1,21 @@
-from unittest.mock import Mock, patch
+import io
+import json
+import os
+from unittest.mock import patch
 
 from flask import url_for
 import stravalib
 
-from application.models import db, AdminUser, StravaAccount
+from application.models import db, Activity, AdminUser, StravaAccount
+from application.util import cache
 from application.util.mock_stravalib import MOCK_TOKEN
-from .base import LoggedInFlaskTestCase, AuthenticatedFlaskTestCase
+from .base import (BASEDIR, FlaskTestCase, LoggedInFlaskTestCase,
+  AuthenticatedFlaskTestCase)
+
+
+ATHLETE_STATS = stravalib.model.AthleteStats(
+  all_run_totals=stravalib.model.ActivityTotals(count=10)
+)
 
 
 class TestAuthorize(LoggedInFlaskTestCase):
@@ -29,15 +39,18 @@ class TestHandleCode(LoggedInFlaskTestCase):
   #   self.mock_stravalib_client = mock_stravalib.Client()
   
   # @patch('stravalib.Client', mock_stravalib.Client)
+  @patch('stravalib.Client.get_athlete_stats')
   @patch('stravalib.Client.get_athlete')
   @patch('stravalib.Client.exchange_code_for_token')
   @patch('stravalib.Client.refresh_access_token')
-  def test_strava_oauth_callback(self, mock_refresh_access_token, mock_exchange_code_for_token, mock_get_athlete):
+  def test_strava_oauth_callback(self, mock_refresh_access_token, mock_exchange_code_for_token, mock_get_athlete, mock_get_athlete_stats):
     # mock_strava_api.get('/activities/{id}', response_update={'id': test_activity_id})
     # self.mock_stravalib_client.get_token(response_update={''})
     mock_refresh_access_token.return_value = MOCK_TOKEN
     mock_exchange_code_for_token.return_value = MOCK_TOKEN
-    mock_get_athlete.return_value = Mock(id=1)
+    mock_get_athlete.return_value = stravalib.model.Athlete(
+      id=1, firstname='Aaron', lastname='Schroeder')
+    mock_get_athlete_stats.return_value = ATHLETE_STATS
 
     rv = self.client.get(
       f'{url_for("strava_api.handle_code")}'
@@ -115,11 +128,13 @@ class TestHandleCode(LoggedInFlaskTestCase):
 
 
 class TestRevoke(AuthenticatedFlaskTestCase):
+  @patch('stravalib.Client.get_athlete_stats')
   @patch('stravalib.Client.get_athlete')
   @patch('stravalib.Client.refresh_access_token')
-  def test_revoke(self, mock_refresh_access_token, mock_get_athlete):
+  def test_revoke(self, mock_refresh_access_token, mock_get_athlete, mock_get_athlete_stats):
     mock_get_athlete.return_value = stravalib.model.Athlete(
       firstname='Aaron', lastname='Schroeder')
+    mock_get_athlete_stats.return_value = ATHLETE_STATS
     mock_refresh_access_token.return_value = MOCK_TOKEN
 
     strava_accts = AdminUser().strava_accounts
@@ -137,4 +152,125 @@ class TestRevoke(AuthenticatedFlaskTestCase):
     
     Expected behavior: revoking access results in a webhook event
     """
-    pass
\ No newline at end of file
+    pass
+
+class TestImportExport(AuthenticatedFlaskTestCase):
+  def test_shows_form(self):
+    rv = self.client.get(url_for('strava_api.import_export'))
+
+    self.assertEqual(rv.status_code, 200)
+    self.assertIn(b'enctype="multipart/form-data"', rv.data)
+    self.assertIn(b'Strava Account #1', rv.data)
+
+  @patch('application.tasks.async_import_strava_export.delay')
+  def test_queues_upload(self, mock_delay):
+    rv = self.client.post(
+      url_for('strava_api.import_export'),
+      data={
+        'file': (io.BytesIO(b'zip contents'), 'export_123.zip'),
+        'strava_acct_id': '1',
+      },
+      content_type='multipart/form-data',
+    )
+
+    self.assertEqual(rv.status_code, 302)
+    self.assertEqual(rv.location, '/settings/strava')
+
+    path = mock_delay.call_args.args[0]
+    self.addCleanup(os.remove, path)
+    self.assertEqual(os.path.dirname(path), self.app.config['UPLOAD_FOLDER'])
+    with open(path, 'rb') as f:
+      self.assertEqual(f.read(), b'zip contents')
+    self.assertEqual(mock_delay.call_args.kwargs, {'strava_account_id': 1})
+
+  @patch('application.tasks.async_import_strava_export.delay')
+  def test_rejects_other_files(self, mock_delay):
+    rv = self.client.post(
+      url_for('strava_api.import_export'),
+      data={'file': (io.BytesIO(b'<gpx/>'), 'run.gpx')},
+      content_type='multipart/form-data',
+    )
+
+    self.assertEqual(rv.status_code, 302)
+    mock_delay.assert_not_called()
+
+
+class TestWebhook(FlaskTestCase):
+  def setUp(self):
+    super().setUp()
+    self.app.config['STRAVA_WEBHOOK_VERIFY_TOKEN'] = 'verify-me'
+    db.session.add(StravaAccount(strava_id=123, access_token='token', expires_at=0))
+    db.session.commit()
+
+    patcher = patch('application.tasks.async_save_webhook_activities.apply_async')
+    self.mock_apply_async = patcher.start()
+    self.addCleanup(patcher.stop)
+
+    with open(os.path.join(BASEDIR, 'sample_data', 'webhook_events.json')) as f:
+      self.events = json.load(f)
+
+  def test_verifies_subscription(self):
+    rv = self.client.get(url_for(
+      'strava_api.webhook',
+      **{'hub.mode': 'subscribe', 'hub.challenge': '15f7d1a91c1f40f8a748fd134752feb3',
+        'hub.verify_token': 'verify-me'}
+    ))
+
+    self.assertEqual(rv.status_code, 200)
+    self.assertEqual(rv.json, {'hub.challenge': '15f7d1a91c1f40f8a748fd134752feb3'})
+
+  def test_rejects_wrong_verify_token(self):
+    rv = self.client.get(url_for(
+      'strava_api.webhook',
+      **{'hub.mode': 'subscribe', 'hub.challenge': 'abc', 'hub.verify_token': 'nope'}
+    ))
+
+    self.assertEqual(rv.status_code, 403)
+
+  def test_coalesces_recorded_events(self):
+    for event in self.events:
+      rv = self.client.post(url_for('strava_api.webhook'), json=event)
+      self.assertEqual(rv.status_code, 200)
+
+    # The new activity and its edits go in one import, along with the
+    # other new activity. Deletes and athlete events are ignored.
+    self.mock_apply_async.assert_called_once_with(
+      (123,), countdown=self.app.config['STRAVA_WEBHOOK_DELAY_S'])
+    self.assertEqual(
+      cache.get_cache().get('strava-webhook:123'), [3472157523, 3472158672])
+
+  def test_ignores_unlinked_accounts(self):
+    rv = self.client.post(
+      url_for('strava_api.webhook'), json=dict(self.events[0], owner_id=456))
+
+    self.assertEqual(rv.status_code, 200)
+    self.mock_apply_async.assert_not_called()
+
+  def test_rejects_other_subscriptions(self):
+    self.app.config['STRAVA_WEBHOOK_SUBSCRIPTION_ID'] = 1
+
+    rv = self.client.post(url_for('strava_api.webhook'), json=self.events[0])
+
+    self.assertEqual(rv.status_code, 403)
+    self.mock_apply_async.assert_not_called()
+
+  def test_rejects_malformed_object_ids(self):
+    for object_id in (None, '3472157523', -1, True):
+      rv = self.client.post(
+        url_for('strava_api.webhook'), json=dict(self.events[0], object_id=object_id))
+      self.assertEqual(rv.status_code, 400)
+
+    self.mock_apply_async.assert_not_called()
+
+  def test_updates_saved_activity_title(self):
+    activity = self.create_activity(title='Morning Run')
+    activity.strava_id = 3472157523
+    db.session.commit()
+
+    rv = self.client.post(url_for('strava_api.webhook'), json=dict(
+      self.events[0], aspect_type='update', updates={'title': 'Hill repeats'}))
+
+    self.assertEqual(rv.status_code, 200)
+    self.assertEqual(Activity.query.one().title, 'Hill repeats')
+    # It's saved already, so there's nothing to import.
+    self.mock_apply_async.assert_not_called()
@@ -0,0 +1,76 @@
+from unittest import mock
+
+from stravalib.exc import ObjectNotFound, RateLimitExceeded
+
+from application import streams
+from application.models import db, StravaAccount
+from application.util.mock_stravalib import Client
+from .base import FlaskTestCase
+
+
+class TestFetchActivityStreams(FlaskTestCase):
+  def setUp(self):
+    super().setUp()
+    self.app.config['STRAVALIB_CLIENT'] = 'application.util.mock_stravalib.Client'
+    self.strava_acct = StravaAccount(strava_id=1, expires_at=0)
+    db.session.add(self.strava_acct)
+    db.session.commit()
+
+  def test_fetches_every_activity(self):
+    activity_streams, remaining = streams.fetch_activity_streams(
+      self.strava_acct, [1, 2, 3, 4, 5], concurrency=3)
+
+    self.assertEqual(sorted(activity_streams), [1, 2, 3, 4, 5])
+    self.assertIn('time', activity_streams[3])
+    self.assertEqual(remaining, [])
+
+  def test_reports_rate_limited_activities(self):
+    get_activity_streams = Client.get_activity_streams
+
+    def limited(client, activity_id, **kwargs):
+      if activity_id in (2, 4):
+        raise RateLimitExceeded('Rate limit exceeded.', timeout=10)
+      return get_activity_streams(client, activity_id, **kwargs)
+
+    with mock.patch.object(Client, 'get_activity_streams', limited):
+      activity_streams, remaining = streams.fetch_activity_streams(
+        self.strava_acct, [1, 2, 3, 4, 5], concurrency=3)
+
+    self.assertEqual(sorted(activity_streams), [1, 3, 5])
+    self.assertEqual(remaining, [2, 4])
+
+  def test_skips_missing_activities(self):
+    get_activity_streams = Client.get_activity_streams
+
+    def deleted(client, activity_id, **kwargs):
+      if activity_id == 2:
+        raise ObjectNotFound('Record Not Found')
+      return get_activity_streams(client, activity_id, **kwargs)
+
+    with mock.patch.object(Client, 'get_activity_streams', deleted):
+      activity_streams, remaining = streams.fetch_activity_streams(
+        self.strava_acct, [1, 2, 3], concurrency=3)
+
+    self.assertEqual(sorted(activity_streams), [1, 3])
+    self.assertEqual(remaining, [])
+
+
+class TestStreamProfiles(FlaskTestCase):
+  def setUp(self):
+    super().setUp()
+    self.app.config['STRAVALIB_CLIENT'] = 'application.util.mock_stravalib.Client'
+    self.client = StravaAccount.get_client()
+
+  def test_preview_is_low_resolution(self):
+    preview = streams.get_activity_streams(self.client, 1, 'preview')
+
+    self.assertEqual(
+      sorted(preview), ['altitude', 'distance', 'latlng', 'velocity_smooth'])
+    self.assertLessEqual(len(preview['latlng'].data), 110)
+
+  def test_analysis_has_what_metrics_need(self):
+    analysis = streams.get_activity_streams(self.client, 1, 'analysis')
+
+    self.assertEqual(
+      sorted(analysis), ['distance', 'grade_smooth', 'time', 'velocity_smooth'])
+    self.assertEqual(len(analysis['time'].data), 4294)
@@ -7,40 +7,340 @@ Things required by each test:
   triggered by the code under test.
 
 """
-import unittest
+import datetime
+from unittest import mock
 
-from application.tasks import est_15_min_rate
-from application.util.mock_stravalib import SimDevClient, SimProdClient
+from stravalib.exc import ObjectNotFound
 
+from application.models import (db, Activity, BestEffort, StravaAccount,
+  StravaActivitySummary, UserSettings)
+from application.tasks import (apply_webhook_event,
+  async_save_strava_activities,
+  async_save_strava_activity, async_save_webhook_activities,
+  async_sync_strava_activities, activity_summary,
+  iter_activity_pages, queue_webhook_activity, sync_activity_summaries,
+  sync_activity_summaries_soon, sync_after)
+from application.util.mock_stravalib import (MOCK_START_DATE,
+  BatchedResultsIterator, Client)
+from application.util import cache
+from .base import FlaskTestCase
 
-class TestEstRate(unittest.TestCase):
-    
-  def test_low_limit(self):
+
+class TestSaveStravaActivity(FlaskTestCase):
+  def setUp(self):
+    super().setUp()
+    self.app.config['STRAVALIB_CLIENT'] = 'application.util.mock_stravalib.Client'
+    db.session.add(StravaAccount(strava_id=1, expires_at=0))
+    db.session.add(UserSettings())
+    db.session.commit()
+
+  def test_saves_activity(self):
+    async_save_strava_activity(1, 5)
+
+    activity = Activity.query.one()
+    self.assertEqual(activity.strava_id, 5)
+    self.assertEqual(activity.strava_acct_id, 1)
+    self.assertIsNotNone(activity.ngp_ms)
+
+  def test_indexes_best_efforts(self):
+    async_save_strava_activity(1, 5)
+
+    activity = Activity.query.one()
+    distances = [effort.distance_m for effort in activity.best_efforts]
+    self.assertIn(400.0, distances)
+    self.assertIn(10000.0, distances)
+    self.assertEqual(BestEffort.query.count(), len(distances))
+
+  def test_skips_saved_activity(self):
+    async_save_strava_activity(1, 5)
+    async_save_strava_activity(1, 5)
+
+    self.assertEqual(Activity.query.count(), 1)
+
+  def test_saves_batch(self):
+    # The mock client's activities all start at the same time.
+    async_save_strava_activities(1, [5, 6, 7], handle_overlap='both')
+
+    self.assertEqual(
+      sorted(a.strava_id for a in Activity.query.all()), [5, 6, 7])
+    for activity in Activity.query.all():
+      self.assertEqual(activity.strava_acct_id, 1)
+      self.assertIsNotNone(activity.ngp_ms)
+      self.assertTrue(len(activity.best_efforts))
+
+  def test_batch_skips_missing_activities(self):
+    get_activity = Client.get_activity
+
+    def deleted(client, activity_id):
+      if activity_id == 6:
+        raise ObjectNotFound('Record Not Found')
+      return get_activity(client, activity_id)
+
+    with mock.patch.object(Client, 'get_activity', deleted):
+      async_save_strava_activities(1, [5, 6, 7], handle_overlap='both')
+
+    self.assertEqual(
+      sorted(a.strava_id for a in Activity.query.all()), [5, 7])
+
+  def test_batch_skips_saved_activities(self):
+    async_save_strava_activity(1, 5)
+
+    async_save_strava_activities(1, [5, 6, 6], handle_overlap='both')
+
+    self.assertEqual(
+      sorted(a.strava_id for a in Activity.query.all()), [5, 6])
+
+  def test_batch_keeps_existing_overlapping_activity(self):
+    async_save_strava_activity(1, 5)
+
+    async_save_strava_activities(1, [6, 7], handle_overlap='existing')
+
+    self.assertEqual(Activity.query.one().strava_id, 5)
+
+  def test_batch_uses_summaries(self):
+    summaries = [
+      activity_summary(activity)
+      for activity in StravaAccount.query.get(1).client.get_activities(limit=3)
+    ]
+
+    with mock.patch.object(Client, 'get_activity') as get_activity:
+      async_save_strava_activities(
+        1, [1, 2, 3], handle_overlap='both', summaries=summaries)
+    get_activity.assert_not_called()
+
+    # The first mock activity is a ride.
+    self.assertEqual(
+      sorted(a.title for a in Activity.query.all()), ['Activity 2', 'Activity 3'])
+    self.assertIsNone(Activity.query.first().description)
+
+  def test_batch_fetches_descriptions_if_wanted(self):
+    self.app.config['STRAVA_IMPORT_DESCRIPTIONS'] = True
+    summaries = [
+      activity_summary(activity)
+      for activity in StravaAccount.query.get(1).client.get_activities(limit=3)
+    ]
+
+    async_save_strava_activities(1, [2], summaries=summaries)
+
+    self.assertEqual(Activity.query.one().title, 'Morning Run')
+
+  def test_batch_replaces_overlapping_activities(self):
+    async_save_strava_activity(1, 5)
+
+    async_save_strava_activities(1, [6, 7], handle_overlap='incoming')
+
+    self.assertEqual(Activity.query.one().strava_id, 7)
+    self.assertEqual(
+      BestEffort.query.count(), len(Activity.query.one().best_efforts))
+
+
+class TestSyncStravaActivities(FlaskTestCase):
+  def setUp(self):
+    super().setUp()
+    self.app.config['STRAVALIB_CLIENT'] = 'application.util.mock_stravalib.Client'
+    self.app.config['MOCK_STRAVALIB_ACTIVITY_COUNT'] = 10
+    self.strava_acct = StravaAccount(strava_id=1, expires_at=0)
+    db.session.add(self.strava_acct)
+    db.session.add(UserSettings())
+    db.session.commit()
+
+    # The batches aren't saved, but whatever comes after them runs.
+    patcher = mock.patch(
+      'application.tasks._save_in_turn',
+      side_effect=lambda *args, then=None: then and then.apply()
+    )
+    self.save_in_turn = patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def test_first_sync_lists_everything(self):
+    self.assertIsNone(sync_after(self.strava_acct))
+
+    async_sync_strava_activities(1)
+
+    # Every fifth mock activity is a ride.
+    self.save_in_turn.assert_called_once()
+    _, activity_ids, handle_overlap, summaries = self.save_in_turn.call_args.args
+    self.assertEqual(activity_ids, [2, 3, 4, 5, 7, 8, 9, 10])
+    self.assertEqual(handle_overlap, 'existing')
+    self.assertEqual(summaries[2]['name'], 'Activity 2')
+    self.assertEqual(
+      self.strava_acct.synced_until, int(MOCK_START_DATE.timestamp()))
+
+  def test_cursor_waits_for_the_saves(self):
+    self.save_in_turn.side_effect = None
+
+    async_sync_strava_activities(1)
+
+    self.assertIsNone(self.strava_acct.synced_until)
+    self.save_in_turn.call_args.kwargs['then'].apply()
     self.assertEqual(
-      est_15_min_rate(
-        SimDevClient()
-      ),
-      3
+      self.strava_acct.synced_until, int(MOCK_START_DATE.timestamp()))
+
+  def test_queues_each_page_as_it_arrives(self):
+    self.app.config['MOCK_STRAVALIB_ACTIVITY_COUNT'] = 450
+    self.save_in_turn.side_effect = None
+
+    async_sync_strava_activities(1)
+
+    self.assertEqual(
+      [len(call.args[1]) for call in self.save_in_turn.call_args_list],
+      [160, 160, 40]
+    )
+    # The cursor moves once every page's saves are done, in any order.
+    thens = [call.kwargs['then'] for call in self.save_in_turn.call_args_list]
+    for then in reversed(thens):
+      self.assertIsNone(self.strava_acct.synced_until)
+      then.apply()
+    self.assertEqual(
+      self.strava_acct.synced_until, int(MOCK_START_DATE.timestamp()))
+
+  def test_later_syncs_list_only_new_activities(self):
+    async_sync_strava_activities(1)
+    async_sync_strava_activities(1)
+
+    self.save_in_turn.assert_called_once()
+
+  def test_starts_after_latest_saved_activity(self):
+    async_save_strava_activity(1, 5)
+
+    self.assertEqual(
+      sync_after(self.strava_acct),
+      Activity.query.one().recorded.replace(tzinfo=datetime.timezone.utc)
     )
 
-  def test_high_limit(self):
+
+class TestSyncActivitySummaries(FlaskTestCase):
+  def setUp(self):
+    super().setUp()
+    self.app.config['STRAVALIB_CLIENT'] = 'application.util.mock_stravalib.Client'
+    self.app.config['MOCK_STRAVALIB_ACTIVITY_COUNT'] = 10
+    self.strava_acct = StravaAccount(strava_id=1, expires_at=0)
+    db.session.add(self.strava_acct)
+    db.session.commit()
+
+  def test_mirrors_every_activity_once(self):
+    self.assertEqual(sync_activity_summaries(self.strava_acct), 10)
+    # Rides too.
+    self.assertEqual(StravaActivitySummary.query.count(), 10)
+
+    # Only activities newer than the latest mirrored one are listed.
+    self.assertEqual(sync_activity_summaries(self.strava_acct), 0)
+
+  def test_lists_everything_until_the_mirror_is_complete(self):
+    # A webhook event mirrors a newer activity before the first sync.
+    StravaActivitySummary.upsert(
+      1, [activity_summary(self.strava_acct.client.get_activity(99))])
+
+    self.assertEqual(sync_activity_summaries(self.strava_acct), 10)
+    self.assertEqual(
+      self.strava_acct.summaries_synced_until, int(MOCK_START_DATE.timestamp()))
+
+  def test_activity_sync_mirrors_what_it_lists(self):
+    with mock.patch('application.tasks._save_in_turn'):
+      async_sync_strava_activities(1)
+
+    self.assertEqual(StravaActivitySummary.query.count(), 10)
+    # Everything was listed, so the mirror is up to date.
+    self.assertEqual(sync_activity_summaries(self.strava_acct), 0)
+
+  @mock.patch('application.tasks.async_sync_activity_summaries.delay')
+  def test_queues_sync_once_per_interval(self, mock_delay):
+    self.assertTrue(sync_activity_summaries_soon(1))
+    self.assertFalse(sync_activity_summaries_soon(1))
+
+    mock_delay.assert_called_once_with(1)
+
+  def test_applies_webhook_events(self):
+    sync_activity_summaries(self.strava_acct)
+
+    apply_webhook_event(1, dict(
+      aspect_type='update', object_id=2, updates={'title': 'Renamed', 'type': 'Hike'}))
+    apply_webhook_event(1, dict(aspect_type='delete', object_id=3, updates={}))
+
+    renamed = StravaActivitySummary.query.get(2)
+    self.assertEqual((renamed.name, renamed.type), ('Renamed', 'Hike'))
+    self.assertIsNone(StravaActivitySummary.query.get(3))
+
+
+class TestWebhookActivities(FlaskTestCase):
+  def setUp(self):
+    super().setUp()
+    patcher = mock.patch('application.tasks._save_in_turn')
+    self.save_in_turn = patcher.start()
+    self.addCleanup(patcher.stop)
+
+    patcher = mock.patch('application.tasks.async_save_webhook_activities.apply_async')
+    self.apply_async = patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def test_saves_queued_activities_once(self):
+    self.assertTrue(queue_webhook_activity(1, 10))
+    self.assertFalse(queue_webhook_activity(1, 10))
+    self.assertTrue(queue_webhook_activity(1, 11))
+    self.apply_async.assert_called_once()
+
+    async_save_webhook_activities(1)
+
+    self.save_in_turn.assert_called_once_with(1, [10, 11], 'existing')
+    self.assertIsNone(cache.get_cache().get('strava-webhook:1'))
+
+    # Events after the save start a new one.
+    queue_webhook_activity(1, 10)
+    self.assertEqual(self.apply_async.call_count, 2)
+
+  def test_skips_saved_activities(self):
+    act = self.create_activity()
+    act.strava_id = 10
+    db.session.commit()
+    queue_webhook_activity(1, 10)
+    queue_webhook_activity(1, 11)
+
+    async_save_webhook_activities(1)
+
+    self.save_in_turn.assert_called_once_with(1, [11], 'existing')
+
+
+class TestIterActivityPages(FlaskTestCase):
+  def setUp(self):
+    super().setUp()
+    self.app.config['STRAVALIB_CLIENT'] = 'application.util.mock_stravalib.Client'
+    db.session.add(StravaAccount(strava_id=1, expires_at=0))
+    db.session.commit()
+
+  def list_pages(self, activity_count):
+    self.app.config['MOCK_STRAVALIB_ACTIVITY_COUNT'] = activity_count
+    with mock.patch.object(
+      BatchedResultsIterator, 'result_fetcher', autospec=True,
+      side_effect=BatchedResultsIterator.result_fetcher
+    ) as result_fetcher:
+      pages = list(iter_activity_pages(StravaAccount.query.get(1), concurrency=3))
+    return pages, result_fetcher
+
+  def test_pages_in_order(self):
+    pages, _ = self.list_pages(1050)
+
+    self.assertEqual([len(page) for page in pages], [200] * 5 + [50])
     self.assertEqual(
-      est_15_min_rate(
-        SimProdClient()
-      ),
-      104
+      [activity.id for page in pages for activity in page],
+      list(range(1, 1051))
     )
 
-  @unittest.skip('estimator function is not yet sophisticated enough')
-  def test_high_limit_w_usage(self):
-    self.assertEqual(
-      est_15_min_rate(
-        SimProdClient(
-          # short_limit=600,
-          # short_usage=0,
-          # long_limit=30000,
-          # long_usage=15000,
-        )
-      ),
-      52
-    )
\ No newline at end of file
+  def test_one_page(self):
+    pages, result_fetcher = self.list_pages(30)
+
+    self.assertEqual([len(page) for page in pages], [30])
+    self.assertEqual(result_fetcher.call_count, 1)
+
+  def test_threads_list_with_their_own_clients(self):
+    _, result_fetcher = self.list_pages(1050)
+
+    # Page 1's listing, and one for each of the threads that fetched
+    # the rest.
+    listings = {id(call.args[0]) for call in result_fetcher.call_args_list}
+    self.assertGreaterEqual(len(listings), 2)
+    self.assertLessEqual(len(listings), 4)
+
+  def test_stops_at_empty_page(self):
+    pages, _ = self.list_pages(400)
+
+    self.assertEqual([len(page) for page in pages], [200, 200])
@@ -0,0 +1,44 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from application.util import units
+
+
+class TestSecondsToStringSeries(unittest.TestCase):
+  def test_matches_scalar(self):
+    seconds = pd.Series([0, 5.9, 59, 60, 599, 3599, 3600, 3661.5, 86399])
+
+    for show_hour in (False, True):
+      self.assertEqual(
+        units.seconds_to_string_series(seconds, show_hour=show_hour).to_list(),
+        [units.seconds_to_string(s, show_hour=show_hour) for s in seconds]
+      )
+
+  def test_keeps_index(self):
+    seconds = pd.Series([60, 120], index=['a', 'b'])
+
+    result = units.seconds_to_string_series(seconds)
+
+    self.assertEqual(result['b'], '2:00')
+
+  def test_missing_values(self):
+    result = units.seconds_to_string_series([np.nan, None, 61])
+
+    self.assertEqual(result.to_list(), [None, None, '1:01'])
+
+
+class TestSpeedToPaceSeries(unittest.TestCase):
+  def test_matches_scalar(self):
+    speeds = pd.Series([0.05, 0.1, 0.5, 1.0, 2.68224, 3.57632, 5.0, 7.2])
+
+    self.assertEqual(
+      units.speed_to_pace_series(speeds).to_list(),
+      [units.speed_to_pace(s) for s in speeds]
+    )
+
+  def test_missing_values(self):
+    result = units.speed_to_pace_series([np.nan, 3.0])
+
+    self.assertEqual(result.to_list(), [None, '8:56'])
@@ -0,0 +1,220 @@
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+
+from application import uploads
+from application.util import readers
+from .base import LoggedInFlaskTestCase
+from .test_readers import TESTDATA_DIR, build_fit
+
+
+class UploadTestCase(LoggedInFlaskTestCase):
+  def setUp(self):
+    super().setUp()
+    self.tmpdir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmpdir)
+    self.app.config['UPLOAD_FOLDER'] = os.path.join(self.tmpdir, 'uploads')
+    self.app.config['UPLOAD_CACHE_FOLDER'] = os.path.join(self.tmpdir, 'cache')
+
+  def post(self, data, filename='run.fit', **form):
+    form['file'] = (io.BytesIO(data), filename)
+    return self.client.post('/upload', data=form,
+                            content_type='multipart/form-data')
+
+
+class TestUpload(UploadTestCase):
+  def test_whole_file(self):
+    data = build_fit(n=60)
+
+    response = self.post(data)
+
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.json['filename'], 'run.fit')
+    self.assertEqual(response.json['received'], len(data))
+    with open(uploads.path_for(response.json['handle']), 'rb') as f:
+      self.assertEqual(f.read(), data)
+
+  def test_chunks(self):
+    data = build_fit(n=60)
+    upload_id = uploads.new_upload_id()
+
+    for offset in range(0, len(data), 100):
+      final = offset + 100 >= len(data)
+      response = self.post(data[offset:offset + 100], upload_id=upload_id,
+                           offset=offset, final='1' if final else '0')
+      self.assertEqual(response.status_code, 200)
+      self.assertEqual(response.json['received'], min(offset + 100, len(data)))
+      self.assertEqual('handle' in response.json, final)
+
+    path = uploads.path_for(response.json['handle'])
+    with open(path, 'rb') as f:
+      self.assertEqual(f.read(), data)
+    self.assertTrue(readers.from_fit(path).equals(readers.from_fit(data)))
+
+  def test_resent_chunk(self):
+    upload_id = uploads.new_upload_id()
+
+    self.post(b'abc', upload_id=upload_id, offset=0, final='0')
+    self.post(b'abc', upload_id=upload_id, offset=0, final='0')
+    response = self.post(b'def', upload_id=upload_id, offset=3)
+
+    with open(uploads.path_for(response.json['handle']), 'rb') as f:
+      self.assertEqual(f.read(), b'abcdef')
+
+  def test_rejects_other_file_types(self):
+    response = self.post(b'data', filename='run.exe')
+
+    self.assertEqual(response.status_code, 400)
+    self.assertIn('error', response.json)
+    self.assertEqual(os.listdir(uploads.upload_folder()), [])
+
+  def test_rejects_bad_upload_id(self):
+    response = self.post(b'data', upload_id='../../etc/passwd')
+
+    self.assertEqual(response.status_code, 400)
+
+  def test_path_for_rejects_bad_handles(self):
+    for handle in ('../run.fit', 'run.fit', None):
+      with self.assertRaises(ValueError):
+        uploads.path_for(handle)
+
+    with self.assertRaises(FileNotFoundError):
+      uploads.path_for(uploads.new_upload_id() + '.fit')
+
+  def test_removes_stale_uploads(self):
+    old = self.post(b'old').json['handle']
+    stale_time = time.time() - self.app.config['UPLOAD_MAX_AGE_S'] - 1
+    os.utime(uploads.path_for(old), (stale_time, stale_time))
+
+    new = self.post(b'new').json['handle']
+
+    self.assertEqual(os.listdir(uploads.upload_folder()), [new])
+
+  def test_login_required(self):
+    response = self.app.test_client().post('/upload')
+
+    self.assertNotEqual(response.status_code, 200)
+
+
+class TestParsing(UploadTestCase):
+  def wait_for_result(self, key, timeout_s=10):
+    time_ed = time.monotonic() + timeout_s
+    while time.monotonic() < time_ed:
+      df = uploads.parsed_result(key)
+      if df is not None:
+        return df
+      time.sleep(0.05)
+    self.fail(f'{key} was not parsed')
+
+  def upload(self, data, filename='run.fit'):
+    response = self.post(data, filename=filename)
+    return {'handle': response.json['handle'], 'filename': filename}
+
+  def test_parses_files_concurrently(self):
+    files = [self.upload(build_fit(n=n), f'run{n}.fit') for n in (60, 120)]
+    with open(os.path.join(TESTDATA_DIR, 'testdata.gpx'), 'rb') as f:
+      files.append(self.upload(f.read(), 'walk.gpx'))
+
+    files = uploads.start_parsing(files)
+
+    self.assertEqual(len(self.wait_for_result(files[0]['key'])), 60)
+    self.assertEqual(len(self.wait_for_result(files[1]['key'])), 120)
+    self.assertIn('lat', self.wait_for_result(files[2]['key']).columns)
+
+  def test_caches_parsed_files(self):
+    data = build_fit(n=60)
+    key = uploads.start_parsing([self.upload(data)])[0]['key']
+    df = self.wait_for_result(key)
+
+    with patch.object(uploads, '_get_executor') as get_executor:
+      files = uploads.start_parsing([self.upload(data, 'again.fit')])
+    get_executor.assert_not_called()
+
+    self.assertEqual(files[0]['key'], key)
+    pd.testing.assert_frame_equal(uploads.parsed_result(key), df)
+
+  def test_reports_unreadable_files(self):
+    key = uploads.start_parsing([self.upload(b'garbage')])[0]['key']
+
+    with self.assertRaises(ValueError):
+      self.wait_for_result(key)
+
+  def test_reports_files_that_cant_be_totaled(self):
+    files = uploads.start_parsing([self.upload(b'distance\n1.0\n2.0\n', 'run.csv')])
+
+    with self.assertRaises(ValueError):
+      self.wait_for_result(files[0]['key'])
+
+    # The page shows the error and stops checking.
+    page = sys.modules['pages.analyze_file']
+    _, files, interval_disabled, _, _ = page.show_parsed_files(1, files)
+    self.assertIn('run.csv', files[0]['error'])
+    self.assertTrue(interval_disabled)
+
+  def test_rejects_bad_keys(self):
+    for key in ('../../etc/passwd', 'a' * 63, None):
+      with self.assertRaises(ValueError):
+        uploads.parsed_result(key)
+
+  def test_rejects_missing_uploads(self):
+    with self.assertRaises(FileNotFoundError):
+      uploads.start_parsing(
+        [{'handle': uploads.new_upload_id() + '.fit', 'filename': 'run.fit'}])
+
+
+class TestFrameCache(UploadTestCase):
+  def cache(self, name, size, age_s=0):
+    path = os.path.join(uploads.cache_folder(), f'{name}.npz')
+    uploads.write_frame(path, pd.DataFrame({'time': np.arange(size // 8)}))
+    mtime = time.time() - age_s
+    os.utime(path, (mtime, mtime))
+    return path
+
+  def cached(self):
+    return sorted(os.listdir(uploads.cache_folder()))
+
+  def test_round_trip(self):
+    df = pd.DataFrame({
+      'time': np.arange(5),
+      'speed': np.linspace(2.0, 3.0, 5),
+      'moving': [True, False, True, True, True],
+    })
+    path = os.path.join(uploads.cache_folder(), 'df.npz')
+
+    uploads.write_frame(path, df)
+
+    pd.testing.assert_frame_equal(uploads.read_frame(path), df)
+
+  def test_text_columns_load_without_pickle(self):
+    df = pd.DataFrame({'time': np.arange(3), 'note': ['a', None, 'ccc']})
+    path = os.path.join(uploads.cache_folder(), 'df.npz')
+
+    uploads.write_frame(path, df)
+
+    with np.load(path, allow_pickle=False) as npz:
+      self.assertEqual(npz['note'].dtype.kind, 'U')
+    self.assertEqual(uploads.read_frame(path)['note'].to_list(), ['a', '', 'ccc'])
+
+  def test_evicts_old_entries(self):
+    self.cache('old', 800, age_s=100)
+    self.cache('new', 800, age_s=10)
+
+    uploads.evict_cached_frames(max_bytes=10000, max_age_s=50)
+
+    self.assertEqual(self.cached(), ['new.npz'])
+
+  def test_evicts_least_recently_used_over_size(self):
+    for i, name in enumerate(['a', 'b', 'c']):
+      self.cache(name, 8000, age_s=30 - i)
+    max_bytes = 2 * os.path.getsize(os.path.join(uploads.cache_folder(), 'a.npz'))
+
+    uploads.evict_cached_frames(max_bytes=max_bytes, max_age_s=3600)
+
+    self.assertEqual(self.cached(), ['b.npz', 'c.npz'])
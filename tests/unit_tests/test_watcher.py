@@ -0,0 +1,155 @@
+import datetime
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from application import importer, watcher
+from application.models import db, Activity, UserSettings
+from .base import FlaskTestCase
+from .test_readers import build_fit
+
+
+# Start of `build_fit` files: 1000000000 seconds after the FIT epoch.
+FIT_START = datetime.datetime(2021, 9, 8, 1, 46, 40)
+
+
+class FolderWatcherMixin:
+  use_inotify = True
+
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmpdir)
+
+  def make_watcher(self):
+    folder_watcher = watcher.FolderWatcher(
+      self.tmpdir,
+      settle_s=0.2,
+      poll_interval_s=0.05,
+      use_inotify=self.use_inotify
+    )
+    self.addCleanup(folder_watcher.close)
+    return folder_watcher
+
+  def write(self, fname, data=b'data'):
+    path = os.path.join(self.tmpdir, fname)
+    with open(path, 'ab') as f:
+      f.write(data)
+    return path
+
+  def test_reports_settled_files(self):
+    folder_watcher = self.make_watcher()
+
+    path = self.write('run.fit')
+    self.assertEqual(folder_watcher.poll(), [])
+
+    time.sleep(0.25)
+    self.assertEqual(folder_watcher.poll(), [path])
+    self.assertEqual(folder_watcher.poll(), [])
+
+  def test_waits_for_writes_to_stop(self):
+    folder_watcher = self.make_watcher()
+
+    path = self.write('run.fit')
+    for _ in range(3):
+      time.sleep(0.1)
+      self.write('run.fit')
+      self.assertEqual(folder_watcher.poll(), [])
+
+    time.sleep(0.25)
+    self.assertEqual(folder_watcher.poll(), [path])
+
+  def test_reports_existing_files(self):
+    path = self.write('run.gpx')
+    folder_watcher = self.make_watcher()
+
+    time.sleep(0.25)
+    self.assertEqual(folder_watcher.poll(), [path])
+
+  def test_ignores_other_files(self):
+    folder_watcher = self.make_watcher()
+
+    self.write('notes.txt')
+    time.sleep(0.25)
+    self.assertEqual(folder_watcher.poll(), [])
+
+
+class TestFolderWatcherInotify(FolderWatcherMixin, unittest.TestCase):
+  def test_uses_inotify(self):
+    self.assertTrue(self.make_watcher().uses_inotify)
+
+
+class TestFolderWatcherPolling(FolderWatcherMixin, unittest.TestCase):
+  use_inotify = False
+
+
+class TestWatch(FlaskTestCase):
+  def setUp(self):
+    super().setUp()
+    db.session.add(UserSettings())
+    db.session.commit()
+
+    self.tmpdir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmpdir)
+    with open(os.path.join(self.tmpdir, 'run.fit'), 'wb') as f:
+      f.write(build_fit(n=120))
+
+  def watch(self, handle_overlap='existing', timeout_s=10):
+    """Watch until the file is saved or skipped, or time runs out."""
+    time_ed = time.monotonic() + timeout_s
+    messages = []
+    watcher.watch(
+      self.tmpdir,
+      handle_overlap=handle_overlap,
+      max_workers=1,
+      settle_s=0,
+      echo=messages.append,
+      should_stop=lambda: (
+        time.monotonic() > time_ed
+        or any(msg.startswith(('Saved', 'Skipped', 'Failed')) for msg in messages)
+      ),
+    )
+    return messages
+
+  def test_saves_new_files(self):
+    self.watch()
+
+    activity = Activity.query.one()
+    self.assertEqual(activity.title, 'run')
+    self.assertEqual(activity.recorded, FIT_START)
+
+  def test_skips_saved_files(self):
+    self.watch()
+    self.watch(timeout_s=1.5)
+
+    self.assertEqual(Activity.query.count(), 1)
+
+  def test_keeps_going_after_a_failed_save(self):
+    with mock.patch.object(
+      importer, 'save_activity', side_effect=RuntimeError('database is down')
+    ):
+      messages = self.watch()
+
+    self.assertTrue(messages[-1].startswith('Failed to save'))
+    self.assertEqual(Activity.query.count(), 0)
+
+    # The file wasn't saved, so it isn't passed over next time.
+    self.watch()
+    self.assertEqual(Activity.query.count(), 1)
+
+  def test_keeps_existing_overlapping_activity(self):
+    self.create_activity(recorded=FIT_START, elapsed_time_s=60)
+
+    self.watch(handle_overlap='existing')
+
+    self.assertEqual(Activity.query.count(), 1)
+    self.assertIsNone(Activity.query.one().source_hash)
+
+  def test_replaces_existing_overlapping_activity(self):
+    self.create_activity(recorded=FIT_START, elapsed_time_s=60)
+
+    self.watch(handle_overlap='incoming')
+
+    self.assertEqual(Activity.query.one().title, 'run')